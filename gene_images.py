@@ -2,6 +2,7 @@ import json
 import os
 from PIL import Image, ImageDraw, ImageFont
 from utils.Utils import TextAnchor, diff_bg_change
+from utils.file_lock import FileLock, get_temp_output_path
 
 VERSE_INFO_PATH = './music_datasets/jp_songs_info.json'
 BASE_FONT_NAME = "msyh"
@@ -104,7 +105,11 @@ def generate_single_image(background_path, record_detail, output_path, prefix, i
         for layer, position in layers:
             bg.paste(layer, position, layer)
 
-        bg.save(os.path.join(output_path, f"{prefix}_{index + 1}.png"))
+        image_file = os.path.join(output_path, f"{prefix}_{index + 1}.png")
+        with FileLock(image_file):
+            temp_file = get_temp_output_path(image_file)
+            bg.save(temp_file)
+            os.replace(temp_file, image_file)
 
 
 # verse_info_path = './music_datasets/jp_songs_info.json'
@@ -1,12 +1,25 @@
 import os
+import time
+import contextlib
 from queue import Queue
 import threading
 from typing import Any, Dict, List, Tuple
 import numpy as np
-import subprocess
 from PIL import Image, ImageFilter
 from moviepy import VideoFileClip, ImageClip, TextClip, AudioFileClip, CompositeVideoClip, concatenate_videoclips
 from moviepy import vfx, afx
+from utils.clip_window import to_local_time, get_source_offset
+from utils.stream_selection import get_video_window_height
+from utils.file_lock import FileLock, single_flight, get_temp_output_path
+from utils.mezzanine import get_render_source
+from utils.clip_extract import get_extracted_window
+from utils.media_index import get_media_info, get_loudness
+from utils.scratch import scratch_dir, get_scratch_manager
+from utils.ffmpeg_runner import run_ffmpeg, timeout_for_duration
+
+INTRO_BGM_PATH = "./images/Audioes/intro_bgm.mp3"
+AUDIO_ANALYSIS_FPS = 22050
+AUDIO_PEAK_CEILING = -1.0  # 增益后允许的最大峰值（dBFS）
 
 def get_splited_text(text, text_max_bytes=70):
     """
@@ -82,38 +95,38 @@ def create_blank_image(width, height, color=(0, 0, 0, 0)):
 
 
 def normalize_audio_volume(clip, target_dbfs=-20):
-    """均衡化音频响度到指定的分贝值"""
+    """
+    均衡化音频响度到指定的分贝值
+
+    片段带有 loudness_source（音频来源文件及时间窗口）时，使用媒体索引中缓存的响度计算增益，不再解码音频；
+    否则对解码后的 PCM 做一次向量化的 RMS 计算。
+    """
     if clip.audio is None:
         return clip
     
     try:
-        # 获取音频数据
-        audio = clip.audio
-        
-        # 采样音频的多个点来计算平均音量
-        sample_times = np.linspace(0, clip.duration, num=100)
-        samples = []
-        
-        for t in sample_times:
-            frame = audio.get_frame(t)
-            if isinstance(frame, (list, tuple, np.ndarray)):
-                samples.append(np.array(frame))
-        
-        if not samples:
-            return clip
-            
-        # 将样本堆叠成数组
-        audio_array = np.stack(samples)
-        
-        # 计算当前音频的均方根值
-        current_rms = np.sqrt(np.mean(audio_array**2))
-        
-        # 计算需要的增益
-        target_rms = 10**(target_dbfs/20)
-        gain = target_rms / (current_rms + 1e-8)  # 添加小值避免除零
+        source = getattr(clip, 'loudness_source', None)
+        if source:
+            loudness = get_loudness(*source)
+            if loudness['integrated'] == float('-inf'):
+                return clip
+            gain_db = target_dbfs - loudness['integrated']
+            # 避免放大后削波
+            if loudness['peak'] is not None and loudness['peak'] != float('-inf'):
+                gain_db = min(gain_db, AUDIO_PEAK_CEILING - loudness['peak'])
+            gain = 10 ** (gain_db / 20)
+        else:
+            audio_array = clip.audio.to_soundarray(fps=AUDIO_ANALYSIS_FPS)
+            if audio_array.size == 0:
+                return clip
+            # 计算当前音频的均方根值
+            current_rms = np.sqrt(np.mean(audio_array ** 2))
+            # 计算需要的增益
+            target_rms = 10**(target_dbfs/20)
+            gain = target_rms / (current_rms + 1e-8)  # 添加小值避免除零
         
         # 限制增益范围，避免过度放大或减弱
-        gain = np.clip(gain, 0.1, 3.0)
+        gain = float(np.clip(gain, 0.1, 3.0))
         
         # print(f"Applying volume gain: {gain:.2f}")
         
@@ -167,11 +180,13 @@ def create_info_segment(clip_config, resolution, font_path, text_size=44, inline
     )
 
     # 为整个composite_clip添加bgm
-    bg_audio = AudioFileClip("./images/Audioes/intro_bgm.mp3")
+    bg_audio = AudioFileClip(INTRO_BGM_PATH)
     bg_audio = bg_audio.with_effects([afx.AudioLoop(duration=clip_config['duration'])])
     composite_clip = composite_clip.with_audio(bg_audio)
 
-    return composite_clip.with_duration(clip_config['duration'])
+    composite_clip = composite_clip.with_duration(clip_config['duration'])
+    composite_clip.loudness_source = (INTRO_BGM_PATH, None, None)
+    return composite_clip
 
 
 def create_video_segment(clip_config, resolution, font_path, text_size=None, inline_max_len=21):
@@ -211,24 +226,40 @@ def create_video_segment(clip_config, resolution, font_path, text_size=None, inl
     
     # 3. 视频片段层
     if 'video' in clip_config and os.path.exists(clip_config['video']):
-        video_clip = VideoFileClip(clip_config['video'])
+        # 已生成中间文件（预缩放、恒定帧率）时直接使用，时间轴与源文件一致
+        render_source = get_render_source(clip_config['video'], resolution)
+        # 仅下载了片段窗口的视频，配置中的时间以原视频为基准，需要换算为本地文件中的时间
+        local_start = to_local_time(clip_config['video'], clip_config['start'])
+        local_end = to_local_time(clip_config['video'], clip_config['end'])
+        if local_start < 0:
+            raise ValueError(f"开始时间 {clip_config['start']} 超出视频长度")
+
+        # 只截取片段所需的几秒，避免在完整的源文件中定位与解码
+        render_source, extract_offset = get_extracted_window(render_source, local_start, local_end)
+        # 响度按原始文件与片段窗口缓存，与是否使用中间文件、截取文件无关
+        loudness_source = (clip_config['video'], local_start, local_end)
+        local_start -= extract_offset
+        local_end -= extract_offset
+        video_clip = VideoFileClip(render_source)
         
         # 时间范围校验
-        if clip_config['start'] < 0 or clip_config['start'] >= video_clip.duration:
+        if local_start < 0 or local_start >= video_clip.duration:
             raise ValueError(f"开始时间 {clip_config['start']} 超出视频长度")
-        if clip_config['end'] <= clip_config['start'] or clip_config['end'] > video_clip.duration:
+        if local_end <= local_start or local_end > video_clip.duration:
             raise ValueError(f"结束时间 {clip_config['end']} 无效")
         
-        video_clip = video_clip.subclipped(clip_config['start'], clip_config['end'])
+        video_clip = video_clip.subclipped(local_start, local_end)
         
         # 动态计算视频显示区域 (保持16:9比例中的核心区域)
-        video_height = int(0.667 * resolution[1])  # 原1080p下716px的逻辑
-        video_clip = video_clip.with_effects([vfx.Resize(height=video_height)])
+        video_height = get_video_window_height(resolution)  # 原1080p下716px的逻辑
+        if abs(video_clip.h - video_height) > 1:
+            video_clip = video_clip.with_effects([vfx.Resize(height=video_height)])
     else:
         print(f"警告: {clip_config['id']} 缺少视频文件")
         blank_size = int(540 * scale_factor)  # 原1080p下540px的逻辑
         video_clip = ImageClip(create_blank_image(blank_size, blank_size))
         video_clip = video_clip.with_duration(clip_config['duration'])
+        loudness_source = None
     
     # 4. 文字层
     text_list = get_splited_text(clip_config['text'], text_max_bytes=inline_max_len)
@@ -261,7 +292,10 @@ def create_video_segment(clip_config, resolution, font_path, text_size=None, inl
         txt_clip.with_position(text_pos)
     ], size=resolution, use_bgclip=True)
     
-    return composite_clip.with_duration(clip_config['duration'])
+    composite_clip = composite_clip.with_duration(clip_config['duration'])
+    if loudness_source:
+        composite_clip.loudness_source = loudness_source
+    return composite_clip
 
 
 def add_clip_with_transition(clips, new_clip, set_start=False, trans_time=1):
@@ -319,7 +353,7 @@ def create_full_video(resources, resolution, font_path, auto_add_transition=True
         if clip_config['id'] == resources['main'][-1]['id'] and full_last_clip:
             start_time = clip_config['start']
             # 获取原始视频的长度（不是配置文件中配置的duration）
-            full_clip_duration = VideoFileClip(clip_config['video']).duration - 5
+            full_clip_duration = get_source_offset(clip_config['video']) + get_media_info(clip_config['video'])['duration'] - 5
             # 修改配置文件中的duration，因此下面创建视频片段时，会使用加长版duration
             clip_config['duration'] = full_clip_duration - start_time
             clip_config['end'] = full_clip_duration
@@ -381,6 +415,9 @@ def sort_video_files(files):
     sorted_files = []
     
     for filename in files:
+        # 跳过渲染中断遗留的临时文件
+        if filename.endswith(f".tmp{os.path.splitext(filename)[1]}"):
+            continue
         try:
             # 获取文件名中第一个下划线前的数字
             number = int(os.path.splitext(filename)[0].split('_')[0])
@@ -660,26 +697,46 @@ def render_all_video_clips(
         nonlocal vfile_prefix
         for config in clip_configs:
             if config in to_render:  # 只渲染需要的新片段
-                if segment_type == 'info':
-                    clip = create_info_segment(config, resolution, font_path)
-                else:
-                    clip = create_video_segment(config, resolution, font_path)
-                
                 output_file = os.path.join(video_output_path, f"{vfile_prefix}_{config['id']}.mp4")
-                print(f"正在合成视频片段: {vfile_prefix}_{config['id']}.mp4")
-                
-                clip = normalize_audio_volume(clip)
-                if auto_add_transition:
-                    clip = clip.with_effects([
-                        vfx.FadeIn(duration=trans_time),
-                        vfx.FadeOut(duration=trans_time),
-                        afx.AudioFadeIn(duration=trans_time),
-                        afx.AudioFadeOut(duration=trans_time)
-                    ])
-                
-                clip.write_videofile(output_file, fps=60, threads=2, preset='fast', bitrate=v_bitrate_kbps)
-                clip.close()
-                del clip
+                render_started = time.time()
+
+                def render_clip(config=config, output_file=output_file):
+                    # 渲染期间持有源视频的锁，下载缓存的配额淘汰会跳过正在使用的视频
+                    source_lock = FileLock(config['video']) if segment_type != 'info' else contextlib.nullcontext()
+                    with source_lock:
+                        if segment_type == 'info':
+                            clip = create_info_segment(config, resolution, font_path)
+                        else:
+                            clip = create_video_segment(config, resolution, font_path)
+
+                        print(f"正在合成视频片段: {os.path.basename(output_file)}")
+
+                        clip = normalize_audio_volume(clip)
+                        if auto_add_transition:
+                            clip = clip.with_effects([
+                                vfx.FadeIn(duration=trans_time),
+                                vfx.FadeOut(duration=trans_time),
+                                afx.AudioFadeIn(duration=trans_time),
+                                afx.AudioFadeOut(duration=trans_time)
+                            ])
+
+                        # 先写入临时文件，完成后再替换，其他进程不会把写了一半的片段当作已渲染
+                        # moviepy 的临时音频文件写入临时空间，而不是输出目录
+                        temp_file = get_temp_output_path(output_file)
+                        with scratch_dir("render_audio") as scratch:
+                            clip.write_videofile(temp_file, fps=60, threads=2, preset='fast', bitrate=v_bitrate_kbps,
+                                                 temp_audiofile_path=scratch.path)
+                        clip.close()
+                        del clip
+                        os.replace(temp_file, output_file)
+
+                # 其他会话正在渲染同一片段时等待其完成并直接复用
+                reused, _ = single_flight(
+                    output_file, render_clip,
+                    is_ready=lambda output_file=output_file: os.path.exists(output_file) and
+                        (not force_render or os.path.getmtime(output_file) >= render_started))
+                if reused:
+                    print(f"片段已由其他任务渲染完成，直接复用: {os.path.basename(output_file)}")
             
             vfile_prefix += 1  # 无论是否渲染，索引都要增加
 
@@ -701,26 +758,20 @@ def combine_full_video_direct(video_clip_path, username):
     if not sorted_files:
         raise ValueError("Error: 没有有效的视频片段文件！")
 
-    # 创建临时目录存放 ts 文件
-    temp_dir = os.path.join(video_clip_path, "temp_ts")
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    try:
-        # 1. 创建MP4文件列表
-        mp4_list_file = os.path.join(video_clip_path, "mp4_files.txt")
-        with open(mp4_list_file, 'w', encoding='utf-8') as f:
-            for file in sorted_files:
-                # 使用正斜杠替换反斜杠，并使用相对路径
-                full_path = os.path.join(video_clip_path, file).replace('\\', '/')
-                f.write(f"file '{full_path}'\n")
-
-        # 2. 创建TS文件列表并转换视频
-        ts_list_file = os.path.join(video_clip_path, "ts_files.txt")
+    real_path = os.path.abspath(video_clip_path)
+    output_path = os.path.join(real_path, f"{username}_Best30_fast.mp4")
+
+    # ts 文件与列表文件放在临时空间中，拼接结束（包括失败）后自动清理
+    clip_bytes = sum(os.path.getsize(os.path.join(video_clip_path, file)) for file in sorted_files)
+    clip_durations = [(get_media_info(os.path.join(video_clip_path, file)) or {}).get('duration')
+                      for file in sorted_files]
+    with scratch_dir("concat", size_hint=clip_bytes) as scratch:
+        # 1. 转换视频并创建TS文件列表
+        ts_list_file = scratch.file("ts_files.txt")
         with open(ts_list_file, 'w', encoding='utf-8') as f:
             for i, file in enumerate(sorted_files):
-                ts_name = f"{i:04d}.ts"
-                ts_path = os.path.join(temp_dir, ts_name)
-                
+                ts_path = scratch.file(f"{i:04d}.ts")
+
                 # 转换MP4为TS
                 cmd = [
                     'ffmpeg', '-y', '-loglevel', 'warning',
@@ -731,44 +782,28 @@ def combine_full_video_direct(video_clip_path, username):
                     '-threads', '0',
                     ts_path
                 ]
-                subprocess.run(cmd, check=True)
-                
-                # 写入TS文件相对路径，使用正斜杠
-                # relative_ts_path = os.path.join('temp_ts', ts_name).replace('\\', '/')
-                # f.write(f"file '{relative_ts_path}'\n")
+                run_ffmpeg(cmd, f"转换 {file} 为 ts 失败", timeout=timeout_for_duration(clip_durations[i]))
+                scratch.usage()
 
                 # 写入TS文件绝对路径，使用正斜杠
-                absolute_ts_path = os.path.abspath(os.path.join(video_clip_path, 'temp_ts', ts_name)) 
-                f.write(f"file '{absolute_ts_path}'\n")
+                f.write(f"file '{ts_path.replace(os.sep, '/')}'\n")
 
-        # 3. 拼接TS文件并输出为MP4
-        output_path = os.path.join(video_clip_path, "final_output.mp4")
-        
-        # 执行拼接命令
-        real_path = os.path.abspath(video_clip_path)
-        # current_dir = os.getcwd()
-        # os.chdir(video_clip_path)
-        
+        # 2. 拼接TS文件并输出为MP4
         cmd = [
             'ffmpeg', '-y', '-loglevel', 'warning',
             '-f', 'concat',
             '-safe', '0',
-            '-i', f'{real_path}\\ts_files.txt',  # 使用绝对路径
+            '-i', ts_list_file,
             '-c', 'copy',
-            f'{real_path}\\{username}_Best30_fast.mp4',  # 使用绝对路径
+            output_path,
             '-threads', '0',
         ]
-        
-        subprocess.run(cmd, check=True)
+
+        total_duration = None if None in clip_durations else sum(clip_durations)
+        run_ffmpeg(cmd, "拼接视频失败", timeout=timeout_for_duration(total_duration))
         print("视频拼接完成，已清理临时转换的 ts 片段文件")
-        
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_dir):
-            for file in os.listdir(temp_dir):
-                os.remove(os.path.join(temp_dir, file))
-            os.rmdir(temp_dir)
 
+    print(get_scratch_manager().report())
     return output_path
 
 def combine_full_video_ffmpeg_concat_gl(video_clip_path, resolution, trans_name="fade", trans_time=1):
@@ -3,6 +3,8 @@ import json
 import os
 import yaml
 import traceback
+from utils.scratch import scratch_dir
+from utils.render_validation import validate_video_configs
 
 FONT_PATH = "./font/SOURCEHANSANSSC-BOLD.OTF"
 
@@ -10,8 +12,10 @@ def generate_one_video_clip(config, video_output_path, video_res, video_bitrate,
     print(f"正在合成视频片段: {config['id']}")
     try:
         clip = create_video_segment(config, resolution=video_res, font_path=font_path)
-        clip.write_videofile(os.path.join(video_output_path, f"{config['id']}.mp4"), 
-                             fps=60, codec='h264_nvenc', threads=8, preset='fast', bitrate=video_bitrate)
+        with scratch_dir("render_audio") as scratch:
+            clip.write_videofile(os.path.join(video_output_path, f"{config['id']}.mp4"), 
+                                 fps=60, codec='h264_nvenc', threads=8, preset='fast', bitrate=video_bitrate,
+                                 temp_audiofile_path=scratch.path)
         clip.close()
         return {"status": "success", "info": f"合成 {config['id']} 成功"}
     except Exception as e:
@@ -21,15 +25,24 @@ def generate_one_video_clip(config, video_output_path, video_res, video_bitrate,
 def generate_complete_video(configs, username,
                             video_output_path, video_res, video_bitrate,
                             video_trans_enable, video_trans_time, full_last_clip,
-                            font_path=FONT_PATH):
+                            font_path=FONT_PATH, validate=True):
+    if validate:
+        # 渲染前检查所有片段的配置，避免渲染到一半才失败
+        report = validate_video_configs(configs, video_res, font_path, video_output_path, video_bitrate)
+        if not report.ok:
+            lines = "\n".join(report.format_lines())
+            print(f"Error: 配置检查未通过，共 {len(report.errors)} 个错误:\n{lines}")
+            return {"status": "error", "info": f"配置检查未通过，共 {len(report.errors)} 个错误:\n{lines}"}
     print(f"正在合成完整视频")
     try:
         final_video = create_full_video(configs, resolution=video_res, font_path=font_path, 
                                         auto_add_transition=video_trans_enable, 
                                         trans_time=video_trans_time, 
                                         full_last_clip=full_last_clip)
-        final_video.write_videofile(os.path.join(video_output_path, f"{username}_Best30.mp4"), 
-                                    fps=60, codec='h264_nvenc', threads=8, preset='fast', bitrate=video_bitrate)
+        with scratch_dir("render_audio") as scratch:
+            final_video.write_videofile(os.path.join(video_output_path, f"{username}_Best30.mp4"), 
+                                        fps=60, codec='h264_nvenc', threads=8, preset='fast', bitrate=video_bitrate,
+                                        temp_audiofile_path=scratch.path)
         final_video.close()
         return {"status": "success", "info": f"合成完整视频成功"}
     except Exception as e:
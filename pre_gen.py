@@ -4,6 +4,15 @@ import json
 import random
 from utils.Utils import get_b30_data_from_lxns, get_b30_data_from_fish, get_keyword, _process_b30_data
 from utils.video_crawler import PurePytubefixDownloader, BilibiliDownloader
+from utils.circuit_breaker import RiskControlError, get_all_breaker_stats
+from utils.download_scheduler import DownloadScheduler, DEFAULT_DOWNLOAD_WORKERS
+from utils.download_cache import get_download_record, is_cached_complete, touch_download, DEFAULT_CACHE_QUOTA_GB
+from utils.stream_selection import needs_upgrade
+from utils.clip_window import window_covers
+from utils.file_lock import FileLock
+from utils.PageUtils import save_config
+
+MAX_SEARCH_RETRY_ROUNDS = 3  # 风控导致搜索失败时，对失败谱面的最大重试轮数
 
 def merge_b30_data(new_b30_data, old_b30_data):
     """
@@ -97,34 +106,71 @@ def search_one_video(downloader, song_data):
 def search_b30_videos(downloader, b30_data, b30_data_file, search_wait_time=(0,0)):
     global search_max_results, downloader_type
 
-    i = 0
-    for song in b30_data:
-        i += 1
-        # Skip if video info already exists and is not empty
-        if 'video_info_match' in song and song['video_info_match']:
-            print(f"跳过({i}/30): {song['title']} ，已储存有相关视频信息")
-            continue
-        
-        print(f"正在搜索视频({i}/30): {song['title']}")
-        song_data = search_one_video(downloader, song)
-
-        # 每次搜索后都写入b30_data_file
-        with open(b30_data_file, "w", encoding="utf-8") as f:
-            json.dump(b30_data, f, ensure_ascii=False, indent=4)
+    # 被风控的谱面不写入空结果，留待后续轮次重试
+    pending = list(range(len(b30_data)))
+    for retry_round in range(MAX_SEARCH_RETRY_ROUNDS + 1):
+        if retry_round > 0:
+            print(f"第 {retry_round} 轮重试：共有 {len(pending)} 个谱面因风控搜索失败")
+        failed = []
+        for index in pending:
+            song = b30_data[index]
+            i = index + 1
+            # Skip if video info already exists and is not empty
+            if 'video_info_match' in song and song['video_info_match']:
+                print(f"跳过({i}/30): {song['song_name']} ，已储存有相关视频信息")
+                continue
+            
+            print(f"正在搜索视频({i}/30): {song['song_name']}")
+            try:
+                search_one_video(downloader, song)
+            except RiskControlError as e:
+                print(f"搜索({i}/30)被风控: {e}")
+                failed.append(index)
+                continue
+
+            # 每次搜索后都写入b30_data_file
+            save_config(b30_data_file, b30_data)
+            
+            # 等待几秒，以减少被检测为bot的风险
+            if search_wait_time[0] > 0 and search_wait_time[1] > search_wait_time[0]:
+                time.sleep(random.randint(search_wait_time[0], search_wait_time[1]))
         
-        # 等待几秒，以减少被检测为bot的风险
-        if search_wait_time[0] > 0 and search_wait_time[1] > search_wait_time[0]:
-            time.sleep(random.randint(search_wait_time[0], search_wait_time[1]))
+        pending = failed
+        if not pending:
+            break
     
+    if pending:
+        print(f"Warning: 仍有 {len(pending)} 个谱面因风控未能完成搜索，请稍后重新搜索")
+    for stats in get_all_breaker_stats():
+        print(f"[{stats['name']}] 请求 {stats['calls']} 次，触发风控 {stats['trips']} 次，累计暂停 {stats['total_wait_time']:.0f} 秒")
     return b30_data
 
 
-def download_one_video(downloader, song, video_download_path, high_res=False):
+def download_one_video(downloader, song, video_download_path, high_res=False, window=None, target=None):
+    clip_name = f"{song['id']}-{song['level_index']}"
+    video_path = os.path.join(video_download_path, f"{clip_name}.mp4")
+    # 多个会话/进程同时下载同一谱面时，只有一个实际下载，其余等待后直接复用缓存
+    with FileLock(video_path):
+        return _download_one_video(downloader, song, video_download_path, high_res, window, target)
+
+
+def _download_one_video(downloader, song, video_download_path, high_res=False, window=None, target=None):
     clip_name = f"{song['id']}-{song['level_index']}"
     
     # Check if video already exists
     video_path = os.path.join(video_download_path, f"{clip_name}.mp4")
-    if os.path.exists(video_path):
+    # 已下载的视频低于当前渲染分辨率所需的规格时，重新下载更高分辨率的流
+    upgrade = high_res and os.path.exists(video_path) and \
+        needs_upgrade(get_download_record(video_download_path, clip_name), target)
+    if upgrade:
+        print(f"{clip_name} 的缓存分辨率低于当前渲染需要的 {target['height']}p，将重新下载")
+    elif os.path.exists(video_path) and not is_cached_complete(video_download_path, clip_name):
+        print(f"{clip_name} 的缓存文件不完整，将重新下载")
+    elif os.path.exists(video_path) and not window_covers(video_path, window):
+        # 缓存只包含之前下载的片段窗口，不覆盖当前的起止时间或需要完整视频
+        print(f"{clip_name} 的缓存未覆盖当前需要的时间范围，将重新下载")
+    elif os.path.exists(video_path):
+        touch_download(video_download_path, clip_name)
         print(f"已找到 {song['song_name']} 的缓存: {clip_name}".encode('gbk', errors='replace').decode('gbk'))
         return {"status": "skip", "info": f"已找到 {song['song_name']} 的缓存: {clip_name}"}
         
@@ -134,43 +180,45 @@ def download_one_video(downloader, song, video_download_path, high_res=False):
     
     video_info = song['video_info_match']
     v_id = video_info['id'] 
-    downloader.download_video(v_id, 
-                              clip_name, 
-                              video_download_path, 
-                              high_res=high_res)
+    try:
+        output_file = downloader.download_video(v_id, 
+                                                clip_name, 
+                                                video_download_path, 
+                                                high_res=high_res,
+                                                window=window,
+                                                target=target)
+    except RiskControlError as e:
+        print(f"下载{clip_name}被风控: {e}")
+        return {"status": "error", "info": f"下载{clip_name}被风控，请稍后重试"}
+    if not output_file:
+        return {"status": "error", "info": f"下载{clip_name}失败"}
     return {"status": "success", "info": f"下载{clip_name}完成"}
 
     
-def download_b30_videos(downloader, b30_data, video_download_path, download_wait_time=(0,0)):
+def download_b30_videos(downloader, b30_data, video_download_path, download_wait_time=(0,0),
+                        max_workers=DEFAULT_DOWNLOAD_WORKERS, host_concurrency=None, window_for=None,
+                        target=None, cache_quota_gb=DEFAULT_CACHE_QUOTA_GB):
     global download_high_res
 
-    i = 0
-    for song in b30_data:
-        i += 1
-        # 视频命名为song['song_id']-song['level_index']-song['type']，以便查找复用
+    def on_progress(event, index, song, info):
         clip_name = f"{song['id']}-{song['level_index']}"
-        
-        # Check if video already exists
-        video_path = os.path.join(video_download_path, f"{clip_name}.mp4")
-        if os.path.exists(video_path):
-            print(f"已找到谱面视频的缓存({i}/30): {clip_name}")
-            continue
-            
-        print(f"正在下载视频({i}/30): {clip_name}……")
-        if 'video_info_match' not in song or not song['video_info_match']:
-            print(f"Error: 没有{song['title']}-{song['level_label']}-{song['type']}的视频信息，Skipping………")
-            continue
-        video_info = song['video_info_match']
-        v_id = video_info['id'] 
-        downloader.download_video(v_id, 
-                                  clip_name, 
-                                  video_download_path, 
-                                  high_res=download_high_res)
-        
-        # 等待几秒，以减少被检测为bot的风险
-        if download_wait_time[0] > 0 and download_wait_time[1] > download_wait_time[0]:
-            time.sleep(random.randint(download_wait_time[0], download_wait_time[1]))
-        print("\n")
+        if event == "start" and info['attempt'] == 0:
+            print(f"正在下载视频({index + 1}/30): {clip_name}……")
+        elif event == "retry":
+            print(f"下载失败({index + 1}/30): {clip_name}，{info['delay']} 秒后进行第 {info['attempt']} 次重试")
+        elif event == "done":
+            print(f"【{index + 1}/30】{info['info']}")
+
+    # 视频命名为song['song_id']-song['level_index']，以便查找复用
+    scheduler = DownloadScheduler(downloader, video_download_path, 
+                                  high_res=download_high_res,
+                                  max_workers=max_workers,
+                                  host_concurrency=host_concurrency,
+                                  wait_time=download_wait_time,
+                                  window_for=window_for,
+                                  target=target,
+                                  cache_quota_gb=cache_quota_gb)
+    return scheduler.run(b30_data, on_progress=on_progress)
 
 
 # def gene_resource_config(b30_data, images_path, videoes_path, ouput_file):
@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import shutil
 import random
@@ -9,7 +8,8 @@ from datetime import datetime
 from utils.PageUtils import load_config, save_config, read_global_config, write_global_config
 from utils.PathUtils import get_data_paths, get_user_versions
 from utils.video_crawler import PurePytubefixDownloader, BilibiliDownloader
-from pre_gen import merge_b30_data, search_one_video
+from pre_gen import merge_b30_data, search_one_video, MAX_SEARCH_RETRY_ROUNDS
+from utils.circuit_breaker import RiskControlError, get_all_breaker_stats
 
 G_config = read_global_config()
 _downloader = G_config.get('DOWNLOADER', 'bilibili')
@@ -159,7 +159,8 @@ def st_init_downloader():
             use_potoken=use_potoken,
             use_oauth=use_oauth,
             auto_get_potoken=use_auto_po_token,
-            search_max_results=search_max_results
+            search_max_results=search_max_results,
+            po_token_ttl=G_config.get('PO_TOKEN_CACHE_TTL', 21600)
         )
 
     elif downloader == "bilibili":
@@ -214,24 +215,45 @@ def st_search_b30_videoes(dl_instance, placeholder, search_wait_time):
         with st.spinner("正在搜索b30视频信息..."):
             progress_bar = st.progress(0)
             write_container = st.container(border=True, height=400)
-            i = 0
-            for song in b30_config:
-                i += 1
-                progress_bar.progress(i / 30, text=f"正在搜索({i}/30): {song['song_name']}")
-                if 'video_info_match' in song and song['video_info_match']:
-                    write_container.write(f"跳过({i}/30): {song['song_name']} ，已储存有相关视频信息")
-                    continue
-                
-                song_data, ouput_info = search_one_video(dl_instance, song)
-                write_container.write(f"【{i}/30】{ouput_info}")
+            # 被风控的谱面不写入空结果，留待后续轮次重试
+            pending = list(range(len(b30_config)))
+            for retry_round in range(MAX_SEARCH_RETRY_ROUNDS + 1):
+                if retry_round > 0:
+                    write_container.write(f"第 {retry_round} 轮重试：共有 {len(pending)} 个谱面因风控搜索失败")
+                failed = []
+                for index in pending:
+                    song = b30_config[index]
+                    i = index + 1
+                    progress_bar.progress(i / 30, text=f"正在搜索({i}/30): {song['song_name']}")
+                    if 'video_info_match' in song and song['video_info_match']:
+                        write_container.write(f"跳过({i}/30): {song['song_name']} ，已储存有相关视频信息")
+                        continue
+                    
+                    try:
+                        song_data, ouput_info = search_one_video(dl_instance, song)
+                    except RiskControlError as e:
+                        write_container.write(f"【{i}/30】搜索被风控，稍后重试: {e}")
+                        failed.append(index)
+                        continue
+                    write_container.write(f"【{i}/30】{ouput_info}")
+
+                    # 每次搜索后都写入b30_data_file
+                    save_config(b30_config_file, b30_config)
+                    
+                    # 等待几秒，以减少被检测为bot的风险
+                    if search_wait_time[0] > 0 and search_wait_time[1] > search_wait_time[0]:
+                        time.sleep(random.randint(search_wait_time[0], search_wait_time[1]))
+
+                pending = failed
+                if not pending:
+                    break
 
-                # 每次搜索后都写入b30_data_file
-                with open(b30_config_file, "w", encoding="utf-8") as f:
-                    json.dump(b30_config, f, ensure_ascii=False, indent=4)
-                
-                # 等待几秒，以减少被检测为bot的风险
-                if search_wait_time[0] > 0 and search_wait_time[1] > search_wait_time[0]:
-                    time.sleep(random.randint(search_wait_time[0], search_wait_time[1]))
+            for stats in get_all_breaker_stats():
+                if stats['trips'] > 0:
+                    st.info(f"[{stats['name']}] 请求 {stats['calls']} 次，触发风控 {stats['trips']} 次，"
+                            f"累计暂停 {stats['total_wait_time']:.0f} 秒", icon="ℹ️")
+            if pending:
+                raise RiskControlError(f"仍有 {len(pending)} 个谱面因风控未能完成搜索")
 
 # 仅在配置已保存时显示"开始预生成"按钮
 if st.session_state.get('config_saved_step2', False):
@@ -1,17 +1,23 @@
-import asyncio
-import time
-import random
 import traceback
 import os
 import streamlit as st
 from datetime import datetime
 from utils.PageUtils import *
 from utils.PathUtils import get_data_paths, get_user_versions
-from pre_gen import search_one_video, download_one_video
+from pre_gen import search_one_video
+from utils.download_scheduler import DownloadScheduler, DEFAULT_DOWNLOAD_WORKERS, DEFAULT_DOWNLOAD_RETRIES
 from gene_images import diff_bg_change
-from utils.video_crawler import get_bilibili_video_info, get_youtube_video_info, parse_video_id
+from utils.video_crawler import parse_video_id
+from utils.video_info_resolver import get_video_info_resolver
+from utils.clip_window import compute_download_window, DEFAULT_WINDOW_PADDING
+from utils.stream_selection import get_stream_target
+from utils.download_cache import DEFAULT_CACHE_QUOTA_GB
+from utils.download_telemetry import format_platform_summary, format_host_summary
+from utils.scratch import configure_scratch, DEFAULT_SCRATCH_LIMIT_GB
 
 G_config = read_global_config()
+# 中间文件的临时空间（SCRATCH_DIR 为空时自动选择 tmpfs 或磁盘目录）
+configure_scratch(G_config.get('SCRATCH_DIR'), G_config.get('SCRATCH_LIMIT_GB', DEFAULT_SCRATCH_LIMIT_GB))
 
 st.header("Step 3: 视频信息检查和下载")
 
@@ -69,24 +75,51 @@ def st_download_video(placeholder, dl_instance, G_config, b30_config):
         with st.spinner("正在下载视频……"):
             progress_bar = st.progress(0)
             write_container = st.container(border=True, height=400)
-            i = 0
-            for song in b30_config:
-                i += 1
-                if 'video_info_match' not in song or not song['video_info_match']:
-                    st.warning(f"没有找到({i}/30): {song['song_name']} 的视频信息，无法下载，请检查前置步骤是否完成")
-                    write_container.write(f"跳过({i}/30): {song['song_name']} ，没有视频信息")
-                    continue
-                
-                video_info = song['video_info_match']
-                progress_bar.progress(i / 30, text=f"正在下载视频({i}/30): {video_info['title']}")
-                
-                result = download_one_video(dl_instance, song, video_download_path, download_high_res)
-                write_container.write(f"【{i}/30】{result['info']}")
-
-                # 等待几秒，以减少被检测为bot的风险
-                if search_wait_time[0] > 0 and search_wait_time[1] > search_wait_time[0]:
-                    time.sleep(random.randint(search_wait_time[0], search_wait_time[1]))
-
+            finished = 0
+
+            def on_progress(event, index, song, info):
+                nonlocal finished
+                i = index + 1
+                if event == "start" and info['attempt'] == 0:
+                    if song.get('video_info_match'):
+                        write_container.write(f"开始下载({i}/30): {song['video_info_match']['title']}")
+                elif event == "retry":
+                    write_container.write(f"【{i}/30】{info['info']}，{info['delay']} 秒后进行第 {info['attempt']} 次重试")
+                elif event == "done":
+                    finished += 1
+                    progress_bar.progress(finished / len(b30_config), text=f"已完成({finished}/{len(b30_config)}): {song['song_name']}")
+                    if not song.get('video_info_match'):
+                        st.warning(f"没有找到({i}/30): {song['song_name']} 的视频信息，无法下载，请检查前置步骤是否完成")
+                    write_container.write(f"【{i}/30】{info['info']}")
+
+            # 仅下载片段窗口模式：根据视频配置（若已生成）或起始时间区间计算每个谱面需要的时间窗口
+            window_for = None
+            if G_config.get('DOWNLOAD_WINDOW_ONLY', False):
+                video_config = load_config(current_paths['video_config'])
+                window_for = lambda song: compute_download_window(
+                    song, video_config,
+                    clip_start_interval=G_config['CLIP_START_INTERVAL'],
+                    clip_play_time=G_config['CLIP_PLAY_TIME'],
+                    padding=G_config.get('DOWNLOAD_WINDOW_PADDING', DEFAULT_WINDOW_PADDING))
+
+            scheduler = DownloadScheduler(dl_instance, video_download_path,
+                                          high_res=download_high_res,
+                                          max_workers=G_config.get('DOWNLOAD_WORKERS', DEFAULT_DOWNLOAD_WORKERS),
+                                          host_concurrency=G_config.get('DOWNLOAD_HOST_CONCURRENCY', None),
+                                          max_retries=G_config.get('DOWNLOAD_MAX_RETRIES', DEFAULT_DOWNLOAD_RETRIES),
+                                          wait_time=search_wait_time,
+                                          window_for=window_for,
+                                          target=get_stream_target(G_config['VIDEO_RES']),
+                                          cache_quota_gb=G_config.get('DOWNLOAD_CACHE_QUOTA_GB', DEFAULT_CACHE_QUOTA_GB))
+            results = scheduler.run(b30_config, on_progress=on_progress)
+            for platform, stats in (scheduler.last_summary or {}).items():
+                write_container.write(format_platform_summary(platform, stats))
+            for host, stats in (scheduler.last_host_summary or {}).items():
+                write_container.write(format_host_summary(host, stats))
+
+            failed_count = sum(1 for result in results if result['status'] == "error")
+            if failed_count > 0:
+                st.warning(f"有 {failed_count} 个视频下载失败，可再次点击下载按钮重试（已下载的视频会自动跳过）。")
             st.success("下载完成！请点击下一步按钮核对视频素材的详细信息。")
 
 # 在显示数据框之前，将数据转换为兼容的格式
@@ -280,10 +313,9 @@ def update_editor(placeholder, config, current_index, dl_instance=None):
             if extra_search_button:
                 video_id, page = parse_video_id(replace_id.strip())
                 try:
-                    if selected_platform == "bilibili":
-                        video_info = get_bilibili_video_info(video_id, page)
-                    elif selected_platform == "youtube":
-                        video_info = get_youtube_video_info(video_id)
+                    # 优先使用缓存的元数据，未命中时才联网查询
+                    video_info = get_video_info_resolver().resolve(selected_platform, video_id, 
+                                                                   page if selected_platform == "bilibili" else 1)
 
                     to_replace_video_info = video_info
                     # 显示
@@ -327,6 +359,12 @@ if not os.path.exists(b30_config_file):
     st.stop()
 b30_config = load_config(b30_config_file)
 
+# 备选视频的元数据已在存档中，只写入缓存，不联网预取；每个配置文件只处理一次
+seed_key = f"video_info_seeded_{b30_config_file}"
+if b30_config and not st.session_state.get(seed_key, False):
+    get_video_info_resolver().seed_candidates(b30_config, downloader_type)
+    st.session_state[seed_key] = True
+
 if b30_config:
     for song in b30_config:
         if not song['video_info_match'] or not song['video_info_list'] or not song['clip_id']:
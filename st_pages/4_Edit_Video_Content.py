@@ -1,12 +1,16 @@
 import time
 import streamlit as st
 import os
+import math
 import json
 import traceback
 from datetime import datetime
 from utils.PageUtils import *
 from utils.PathUtils import get_data_paths, get_user_versions
 from pre_gen import st_gene_resource_config
+from utils.clip_window import get_source_offset
+from utils.download_cache import verify_cache
+from utils.filmstrip import get_filmstrip, get_filmstrip_frames, DEFAULT_FILMSTRIP_QUOTA_GB
 
 DEFAULT_VIDEO_MAX_DURATION = 180
 
@@ -159,7 +163,9 @@ def update_preview(preview_placeholder, config, current_index):
             st.image(item['main_image'], caption="成绩图（中间的视频预览窗是透明的）")
         with main_col2:
             if os.path.exists(item['video']):
-                st.video(item['video'])
+                # 选择片段范围使用下方的缩略图，完整视频只在需要时加载播放
+                if st.checkbox("播放完整视频", value=False, key=f"play_video_{item['id']}"):
+                    st.video(item['video'])
                 col1, col2 = st.columns([3, 1], vertical_alignment="center")
                 with col1:
                     st.info(f"不是想要的？", icon="ℹ️")
@@ -173,8 +179,11 @@ def update_preview(preview_placeholder, config, current_index):
 
         # 从文件中获取视频的时长
         video_path = item['video']
+        source_offset = 0
         if os.path.exists(video_path):
-            video_duration = int(get_video_duration(video_path))
+            # 仅下载了片段窗口的视频只能在窗口范围内选择时间（时间以原视频为基准）
+            source_offset = get_source_offset(video_path)
+            video_duration = int(source_offset + get_video_duration(video_path))
         else:
             video_duration = DEFAULT_VIDEO_MAX_DURATION
 
@@ -225,11 +234,26 @@ def update_preview(preview_placeholder, config, current_index):
             st.warning("结束时间必须大于起始时间")
             end_time = start_time + 5
 
+        # 在本地文件的时间轴上检查范围（仅下载了片段窗口的视频，本地 0 秒对应原视频的 source_offset 秒）
+        local_start = start_time - source_offset
+        local_end = end_time - source_offset
+        local_duration = video_duration - source_offset
+        clip_length = end_time - start_time
+
+        # 确保起始时间不早于已下载的片段窗口，保持片段长度不变
+        if local_start < 0:
+            st.warning(f"已下载的视频只包含 {int(source_offset // 60)}分{int(source_offset % 60)}秒 之后的内容")
+            local_start, local_end = 0, clip_length
+
         # 确保结束时间不超过视频时长
-        if end_time > video_duration:
+        if local_end > local_duration:
             st.warning(f"结束时间不能超过视频时长: {int(video_duration // 60)}分{int(video_duration % 60)}秒")
-            end_time = video_duration
-            start_time = end_time - 5
+            local_end = local_duration
+            local_start = max(0, local_end - 5)
+
+        # 换算回原视频时间，取整秒（起始时间向上取整，不早于窗口起点）
+        start_time = math.ceil(local_start + source_offset)
+        end_time = min(start_time + round(local_end - local_start), video_duration)
 
         # 计算总秒数并更新config
         item['start'] = start_time
@@ -247,6 +271,20 @@ def update_preview(preview_placeholder, config, current_index):
         with time_col3:
             st.subheader(f"长度为 {item['duration']} 秒")
 
+        # 所选片段的缩略图预览，由缓存的拼图裁出，无需在浏览器中加载视频
+        if os.path.exists(video_path):
+            with st.spinner("正在生成缩略图……"):
+                sprite_file, filmstrip_index = get_filmstrip(
+                    video_path, quota_gb=G_config.get('FILMSTRIP_CACHE_QUOTA_GB', DEFAULT_FILMSTRIP_QUOTA_GB))
+            if sprite_file:
+                frames = get_filmstrip_frames(sprite_file, filmstrip_index,
+                                              start_time - source_offset, end_time - source_offset)
+                st.image([frame for _, frame in frames],
+                         caption=[f"{minutes(t + source_offset):02d}:{seconds(t + source_offset):02d}"
+                                  for t, _ in frames])
+                with st.expander("查看完整视频缩略图（每秒一帧）"):
+                    st.image(sprite_file)
+
 # 读取下载器配置
 if 'downloader_type' in st.session_state:
     downloader_type = st.session_state.downloader_type
@@ -422,7 +460,9 @@ with st.container(border=True):
                 if st.button("是的！我确定要删除所有视频", key=f"confirm_delete_videoes"):
                     try:
                         for file in os.listdir(file_path):
-                            os.remove(os.path.join(file_path, file))
+                            # 跳过下载任务的临时目录等子目录
+                            if os.path.isfile(os.path.join(file_path, file)):
+                                os.remove(os.path.join(file_path, file))
                         st.toast("所有已下载视频已清空！", icon="✅")
                         st.rerun()
                     except Exception as e:
@@ -431,6 +471,13 @@ with st.container(border=True):
             if os.path.exists(video_download_path):
                 if st.button("删除所有已下载视频", key=f"delete_btn_videoes"):
                     delete_videoes_dialog(video_download_path)
+                if st.button("校验已下载视频", key=f"verify_btn_videoes", help="删除校验失败的视频，之后可在第3步重新下载"):
+                    with st.spinner("正在校验已下载视频……"):
+                        corrupted = verify_cache(video_download_path)
+                    if corrupted:
+                        st.warning(f"已删除 {len(corrupted)} 个损坏的视频: {', '.join(corrupted)}", icon="⚠️")
+                    else:
+                        st.success("所有已下载视频均完整", icon="✅")
             else:
                 st.info("当前还没有下载任何视频")
 
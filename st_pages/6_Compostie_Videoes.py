@@ -6,12 +6,18 @@ from utils.PageUtils import *
 from utils.PathUtils import get_data_paths, get_user_versions
 from main_gen import generate_complete_video
 from gene_video import render_all_video_clips, combine_full_video_direct
+from utils.mezzanine import prepare_mezzanines, DEFAULT_MEZZANINE_QUOTA_GB
+from utils.clip_extract import prune_extracts, DEFAULT_EXTRACT_QUOTA_GB
+from utils.render_validation import validate_video_configs
+from utils.scratch import configure_scratch, get_scratch_manager, DEFAULT_SCRATCH_LIMIT_GB
 
 st.header("Step 5: 视频渲染")
 
 st.info("渲染视频前，请确保已完成 4-1 和 4-2，并且所有配置无误。", icon="ℹ️")
 
 G_config = read_global_config()
+# 中间文件的临时空间（SCRATCH_DIR 为空时自动选择 tmpfs 或磁盘目录）
+configure_scratch(G_config.get('SCRATCH_DIR'), G_config.get('SCRATCH_LIMIT_GB', DEFAULT_SCRATCH_LIMIT_GB))
 FONT_PATH = "./font/SOURCEHANSANSSC-BOLD.OTF"
 
 if 'global_rendering' not in st.session_state:
@@ -84,6 +90,8 @@ with st.container(border=True):
                         captions=["仅渲染所有片段（包括开头结尾）不拼接", "拼接所有片段（包括开头结尾）并同步渲染"]
                         )
     force_render_clip = st.checkbox("覆盖已存在的视频", value=False, help="强制对所有片段重新渲染，不论其是否存在。")
+    use_mezzanine = st.checkbox("预处理源视频", value=G_config.get('USE_MEZZANINE', False),
+                                help="渲染前将源视频统一转换为恒定帧率、预缩放的中间文件（每个分辨率只转换一次），可加快后续渲染")
 
     st.divider()
     st.write("画面设置")
@@ -199,9 +207,29 @@ def save_video_render_config():
     G_config['VIDEO_BITRATE'] = v_bitrate
     G_config['VIDEO_TRANS_ENABLE'] = trans_enable
     G_config['VIDEO_TRANS_TIME'] = trans_time
+    G_config['USE_MEZZANINE'] = use_mezzanine
     write_global_config(G_config)
     st.toast("配置已保存！", icon="✅")
 
+def prepare_render(video_res):
+    """渲染前检查所有片段的配置并准备中间文件，检查未通过时不做准备，直接返回检查结果"""
+    # 渲染前检查所有片段的配置，避免渲染到一半才失败
+    report = validate_video_configs(video_configs, video_res, FONT_PATH, video_output_path, v_bitrate_kbps)
+    if not report.ok:
+        return report
+    for item in report.warnings:
+        st.warning(f"{item['clip_id']}: {item['message']}", icon="⚠️")
+    if use_mezzanine:
+        # 预先将源视频转换为渲染友好的中间文件，所有渲染共用
+        with st.spinner("正在准备渲染用的中间文件……"):
+            prepare_mezzanines(video_configs.get('main', []), video_res,
+                               max_workers=G_config.get('MEZZANINE_WORKERS', 2),
+                               quota_gb=G_config.get('MEZZANINE_CACHE_QUOTA_GB', DEFAULT_MEZZANINE_QUOTA_GB))
+    # 清理起止时间已修改的旧截取文件，并将截取文件控制在配额以内
+    prune_extracts(video_configs.get('main', []), video_res,
+                   quota_gb=G_config.get('EXTRACT_CACHE_QUOTA_GB', DEFAULT_EXTRACT_QUOTA_GB))
+    return report
+
 col1, col2 = st.columns(2)
 with col1:
     if st.button("开始渲染", help="输出为 60fps 视频", disabled=button_disable_stat):
@@ -209,6 +237,14 @@ with col1:
         video_res = (v_res_width, v_res_height)
         st.session_state.global_rendering = True
         placeholder = st.empty()
+        report = prepare_render(video_res)
+        if not report.ok:
+            st.session_state.global_rendering = False
+            with placeholder.container(border=True):
+                st.error(f"配置检查未通过：共 {len(report.errors)} 个错误，请修正后再渲染", icon="❌")
+                for line in report.format_lines():
+                    st.write(line)
+            st.stop()
         if v_mode_index == 0:
             try:
                 with placeholder.container(border=True, height=560):
@@ -238,7 +274,8 @@ with col1:
                                                         video_bitrate=v_bitrate_kbps,
                                                         video_trans_enable=trans_enable, 
                                                         video_trans_time=trans_time, 
-                                                        full_last_clip=False)
+                                                        full_last_clip=False,
+                                                        validate=False)
                         st.write(f"【{output_info['info']}")
                 st.success("渲染成功。点击下方按钮打开视频所在文件夹", icon="✅")
             except Exception as e:
@@ -322,28 +359,38 @@ if mode_str == "完整视频":
                         save_video_render_config()
                         video_res = (v_res_width, v_res_height)
                         
-                        # 阶段1：渲染片段
-                        render_all_video_clips(
-                            video_configs, 
-                            video_output_path,
-                            video_res,
-                            v_bitrate_kbps,
-                            font_path=FONT_PATH,
-                            auto_add_transition=trans_enable,
-                            trans_time=trans_time,
-                            force_render=force_render_clip
-                        )
+                        # 渲染前检查配置，未通过时不开始渲染
+                        report = prepare_render(video_res)
+                        if not report.ok:
+                            state['message'] = {
+                                'type': 'error',
+                                'content': "  \n".join([f"配置检查未通过：共 {len(report.errors)} 个错误，请修正后再渲染"]
+                                                       + report.format_lines())
+                            }
+                        else:
+                            # 阶段1：渲染片段
+                            render_all_video_clips(
+                                video_configs, 
+                                video_output_path,
+                                video_res,
+                                v_bitrate_kbps,
+                                font_path=FONT_PATH,
+                                auto_add_transition=trans_enable,
+                                trans_time=trans_time,
+                                force_render=force_render_clip
+                            )
                         
-                        # 阶段2：视频拼接
-                        combine_full_video_direct(video_output_path, username=username)
+                            # 阶段2：视频拼接
+                            combine_full_video_direct(video_output_path, username=username)
                         
-                        # 显示完成信息
-                        st.success(f"""
-                        视频生成完成！  
-                        - 输出路径: `{video_output_path}`  
-                        - 分辨率: （使用拼接片段分辨率）
-                        - 码率: {v_bitrate_kbps}bps
-                        """, icon="✅")
+                            # 显示完成信息
+                            st.success(f"""
+                            视频生成完成！  
+                            - 输出路径: `{video_output_path}`  
+                            - 分辨率: （使用拼接片段分辨率）
+                            - 码率: {v_bitrate_kbps}bps
+                            - {get_scratch_manager().report()}
+                            """, icon="✅")
                         
                     except Exception as e:
                         st.error(f"""
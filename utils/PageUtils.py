@@ -4,7 +4,8 @@ import json
 import yaml
 import subprocess
 import platform
-from moviepy import VideoFileClip
+from utils.media_index import get_media_info
+from utils.file_lock import FileLock, atomic_write
 
 LEVEL_LABELS = {
     0: "BASIC",
@@ -25,8 +26,10 @@ def load_config(config_file):
     return None
 
 def save_config(config_file, config_data):
-    with open(config_file, 'w', encoding='utf-8') as f:
-        json.dump(config_data, f, ensure_ascii=False, indent=4)
+    # 加锁并原子替换，避免多个会话同时写入同一存档导致文件损坏
+    with FileLock(config_file):
+        with atomic_write(config_file, 'w', encoding='utf-8') as f:
+            json.dump(config_data, f, ensure_ascii=False, indent=4)
 
 def read_global_config():
     if os.path.exists("global_config.yaml"):
@@ -45,8 +48,9 @@ def write_global_config(config):
 def get_video_duration(video_path):
     """Returns the duration of a video file in seconds"""
     try:
-        with VideoFileClip(video_path) as clip:
-            return clip.duration
+        # 通过媒体索引读取，文件未变化时不会重复启动 ffprobe
+        info = get_media_info(video_path)
+        return (info or {}).get('duration') or 0
     except Exception as e:
         print(f"Error getting video duration: {e}")
         return 0
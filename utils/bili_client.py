@@ -0,0 +1,113 @@
+import asyncio
+import atexit
+import threading
+import concurrent.futures
+import httpx
+from bilibili_api import HEADERS
+
+# 下载流时使用的 httpx 连接池配置
+HTTP_CLIENT_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8)
+HTTP_CLIENT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+
+class BiliEventLoop:
+    """
+    常驻后台线程的事件循环，所有 bilibili-api 的异步调用都提交到这里执行。
+
+    bilibili-api 会按事件循环缓存其内部的 httpx 会话，
+    原先每次 `sync(...)` 都新建并销毁一个事件循环，会话无法复用。
+    统一使用同一个事件循环后，连接与会话状态在多次调用之间都可以保留，
+    同步代码只需通过 `run` 提交协程并等待结果。
+    """
+    def __init__(self, name="bilibili-api-loop"):
+        self._name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._http_client = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and self._thread.is_alive():
+                return self._loop
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def runner():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=runner, name=self._name, daemon=True)
+            thread.start()
+            ready.wait()
+
+            self._loop = loop
+            self._thread = thread
+            self._http_client = None
+            return loop
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """将协程提交到后台事件循环，立即返回 Future，可用于并发执行多个请求"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro, timeout=None):
+        """同步等待协程在后台事件循环中执行完毕并返回结果"""
+        if self.in_loop_thread():
+            # 在事件循环线程内同步等待自己会造成死锁
+            coro.close()
+            raise RuntimeError("不能在 bilibili 事件循环线程内同步等待协程，请直接 await")
+        return self.submit(coro).result(timeout)
+
+    async def get_http_client(self) -> httpx.AsyncClient:
+        """获取绑定在后台事件循环上的共享 httpx.AsyncClient（必须在事件循环内调用）"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(headers=HEADERS,
+                                                  limits=HTTP_CLIENT_LIMITS,
+                                                  timeout=HTTP_CLIENT_TIMEOUT,
+                                                  follow_redirects=True)
+        return self._http_client
+
+    async def _aclose(self):
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+    def close(self):
+        """关闭共享会话并停止后台事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop is None or not thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._aclose(), loop).result(5)
+        except Exception as e:
+            print(f"关闭 bilibili 会话时出错: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+
+
+_bili_loop = BiliEventLoop()
+atexit.register(_bili_loop.close)
+
+
+def bili_sync(coro, timeout=None):
+    """替代 bilibili_api.sync：在共享的后台事件循环中执行协程并返回结果"""
+    return _bili_loop.run(coro, timeout)
+
+
+def bili_submit(coro) -> concurrent.futures.Future:
+    """在共享的后台事件循环中并发执行协程，返回 concurrent.futures.Future"""
+    return _bili_loop.submit(coro)
+
+
+async def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 httpx.AsyncClient，只能在 bilibili 事件循环中 await"""
+    return await _bili_loop.get_http_client()
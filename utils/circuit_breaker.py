@@ -0,0 +1,135 @@
+import time
+import threading
+
+RISK_CONTROL_BASE_DELAY = 30  # 首次触发风控后的暂停时间（秒）
+RISK_CONTROL_MAX_DELAY = 600  # 指数退避的最大暂停时间（秒）
+
+
+class RiskControlError(Exception):
+    """平台风控（如 HTTP 412、需要人机验证）导致请求失败"""
+    pass
+
+
+def is_risk_control_response(data) -> bool:
+    """判断 bilibili 接口返回的数据是否为风控响应"""
+    if not isinstance(data, dict):
+        return False
+    # 搜索接口被风控时不返回 result，而是返回人机验证凭据 v_voucher
+    if 'v_voucher' in data:
+        return True
+    return data.get('code') == -412
+
+
+def is_risk_control_error(e: Exception) -> bool:
+    """
+    判断异常是否由平台风控导致
+
+    只依据结构化信息：业务码 -412（ResponseCodeException.code）、HTTP 状态码 412，
+    或响应数据中的 v_voucher；不匹配异常文本，避免 BV 号、地址等内容中的 "412" 被误判。
+    """
+    if isinstance(e, RiskControlError):
+        return True
+    if getattr(e, 'code', None) == -412:
+        return True
+    for attr in ('status', 'status_code'):
+        if getattr(e, attr, None) == 412:
+            return True
+    response = getattr(e, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) == 412:
+        return True
+    # bilibili_api 的 ResponseCodeException 在 raw 中保存完整的响应数据
+    return is_risk_control_response(getattr(e, 'raw', None))
+
+
+class CircuitBreaker:
+    """
+    按接口划分的熔断器。
+
+    请求触发风控后进入熔断状态，按指数退避暂停后续请求；
+    暂停结束后放行一次试探请求，成功则恢复，失败则加倍暂停时间。
+    同时记录调用、失败、熔断次数等统计信息，便于调整搜索间隔。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, base_delay=RISK_CONTROL_BASE_DELAY, max_delay=RISK_CONTROL_MAX_DELAY):
+        self.name = name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_until = 0
+        self.stats = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'trips': 0,
+            'total_wait_time': 0.0,
+        }
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.time() >= self._open_until:
+                return self.HALF_OPEN
+            return self._state
+
+    def remaining_delay(self) -> float:
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0
+            return max(0, self._open_until - time.time())
+
+    def wait_if_open(self) -> float:
+        """熔断期间阻塞等待，返回实际等待的秒数"""
+        delay = self.remaining_delay()
+        if delay > 0:
+            print(f"[{self.name}] 检测到风控，暂停请求 {delay:.0f} 秒后重试……")
+            time.sleep(delay)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['total_wait_time'] += delay
+            if self._state == self.OPEN:
+                self._state = self.HALF_OPEN
+        return delay
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self._consecutive_failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self) -> float:
+        """记录一次风控失败并进入熔断，返回本次的暂停时间"""
+        with self._lock:
+            self.stats['failures'] += 1
+            if self._state != self.OPEN:
+                # 只在从关闭/半开状态进入熔断时计为一次熔断，熔断期间其他请求的失败不重复计数
+                self.stats['trips'] += 1
+            self._consecutive_failures += 1
+            delay = min(self.base_delay * 2 ** (self._consecutive_failures - 1), self.max_delay)
+            self._open_until = time.time() + delay
+            self._state = self.OPEN
+            return delay
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {'name': self.name, 'state': self._state, **self.stats}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name) -> CircuitBreaker:
+    """获取指定接口的熔断器（进程内共享）"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def get_all_breaker_stats() -> list:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.get_stats() for breaker in breakers]
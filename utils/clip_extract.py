@@ -0,0 +1,136 @@
+import os
+import re
+from utils.file_lock import single_flight, get_temp_output_path
+from utils.clip_window import save_window_info, get_source_offset, get_window_info_path, to_local_time
+from utils.fingerprint import short_fingerprint
+from utils.media_index import get_keyframes
+from utils.ffmpeg_runner import run_ffmpeg, timeout_for_duration
+from utils.mezzanine import get_render_source
+from utils.download_cache import enforce_derived_quota, touch_derived
+
+FFMPEG_PATH = 'ffmpeg'
+EXTRACT_DIR = "./videos/extracts"
+DEFAULT_EXTRACT_PAD = 1  # 截取范围在片段前后额外保留的秒数
+MAX_COPY_LEAD = 5  # 关键帧距窗口起点不超过该秒数时直接流复制，否则重新编码窗口
+DEFAULT_EXTRACT_QUOTA_GB = 5
+EXTRACT_NAME_PATTERN = re.compile(r"^(?P<stem>.+)_(?P<fingerprint>[0-9a-f]{12})_\d+-\d+\.mp4$")
+
+
+def find_keyframe_before(source_path, time_point, search_range=MAX_COPY_LEAD):
+    """查找 time_point 之前 search_range 秒内最近的关键帧时间（关键帧表来自媒体索引）"""
+    candidates = [pts for pts in get_keyframes(source_path)
+                  if time_point - search_range <= pts <= time_point + 0.001]
+    return max(candidates) if candidates else None
+
+
+def get_extract_path(source_path, window_start, window_end, extract_dir=EXTRACT_DIR):
+    """截取文件按 (源文件指纹, 时间窗口) 缓存"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    fingerprint = short_fingerprint(source_path)
+    return os.path.join(extract_dir, f"{stem}_{fingerprint}_{int(window_start * 1000)}-{int(window_end * 1000)}.mp4")
+
+
+def get_padded_window(start, end, pad=DEFAULT_EXTRACT_PAD):
+    return max(0, start - pad), end + pad
+
+
+def _run_ffmpeg(cmd, duration):
+    run_ffmpeg(cmd, "ffmpeg 截取失败", timeout=timeout_for_duration(duration))
+
+
+def extract_clip_window(source_path, start, end, pad=DEFAULT_EXTRACT_PAD, extract_dir=EXTRACT_DIR):
+    """
+    从源文件中截取 [start - pad, end + pad] 到单独的小文件，渲染时只需解码这几秒
+
+    窗口起点前 MAX_COPY_LEAD 秒内有关键帧时从该关键帧开始流复制；否则以快速预设重新编码整个窗口。
+    截取文件的 0 秒对应源文件中的时间记录在窗口信息中（见 clip_window），可用 to_local_time 换算。
+
+    Args:
+        source_path(path): 源文件（时间以该文件为基准）
+        start(float): 片段开始时间
+        end(float): 片段结束时间
+
+    Returns:
+        str: 截取文件路径
+    """
+    window_start, window_end = get_padded_window(start, end, pad)
+    output_file = get_extract_path(source_path, window_start, window_end, extract_dir)
+    os.makedirs(extract_dir, exist_ok=True)
+
+    def produce():
+        temp_file = get_temp_output_path(output_file)
+        keyframe = find_keyframe_before(source_path, window_start)
+        try:
+            if keyframe is not None:
+                offset = keyframe
+                _run_ffmpeg([FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error',
+                             '-ss', str(offset), '-i', source_path, '-t', str(window_end - offset),
+                             '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+                             '-avoid_negative_ts', 'make_zero', temp_file], window_end - offset)
+            else:
+                offset = window_start
+                _run_ffmpeg([FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error',
+                             '-ss', str(offset), '-i', source_path, '-t', str(window_end - offset),
+                             '-map', '0:v:0', '-map', '0:a:0?',
+                             '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p',
+                             '-c:a', 'aac', '-b:a', '192k', temp_file], window_end - offset)
+            # 先写入窗口信息再替换截取文件，其他进程看到截取文件时偏移量一定已可用
+            save_window_info(output_file, offset, window_end)
+            os.replace(temp_file, output_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    single_flight(output_file, produce,
+                  is_ready=lambda: os.path.isfile(output_file) and os.path.isfile(get_window_info_path(output_file)))
+    return output_file
+
+
+def get_extracted_window(source_path, start, end, pad=DEFAULT_EXTRACT_PAD, extract_dir=EXTRACT_DIR):
+    """
+    获取覆盖 [start, end] 的截取文件，失败时退回源文件
+
+    Returns:
+        tuple: (使用的文件路径, 该文件 0 秒在源文件中的时间)
+    """
+    try:
+        extract = extract_clip_window(source_path, start, end, pad, extract_dir)
+        touch_derived(extract)
+        return extract, get_source_offset(extract)
+    except Exception as e:
+        print(f"截取片段失败，将直接使用源文件: {e}")
+        return source_path, 0
+
+
+def prune_extracts(clip_configs, resolution, quota_gb=DEFAULT_EXTRACT_QUOTA_GB, pad=DEFAULT_EXTRACT_PAD,
+                   extract_dir=EXTRACT_DIR):
+    """
+    清理截取文件：配置中片段的起止时间修改后，同一源文件的旧窗口截取文件不会再被使用，直接删除；
+    其余截取文件按最近使用时间淘汰到配额以内。截取文件的源与渲染时一致（中间文件或源文件）。
+
+    Returns:
+        list: 被删除的截取文件
+    """
+    expected = set()
+    for config in clip_configs:
+        video = config.get('video')
+        if not video or not os.path.isfile(video) or 'start' not in config or 'end' not in config:
+            continue
+        try:
+            render_source = get_render_source(video, resolution)
+            window_start, window_end = get_padded_window(to_local_time(video, config['start']),
+                                                         to_local_time(video, config['end']), pad)
+            expected.add(os.path.abspath(get_extract_path(render_source, window_start, window_end, extract_dir)))
+        except OSError:
+            continue
+    # 当前配置用到的源文件，其不在 expected 中的截取文件对应已修改的窗口
+    sources_in_use = set()
+    for path in expected:
+        match = EXTRACT_NAME_PATTERN.match(os.path.basename(path))
+        sources_in_use.add((match.group('stem'), match.group('fingerprint')))
+
+    def is_obsolete(artifact):
+        return (artifact['stem'], artifact['fingerprint']) in sources_in_use and artifact['path'] not in expected
+
+    return enforce_derived_quota(extract_dir, EXTRACT_NAME_PATTERN, quota_gb, keep_paths=expected,
+                                 is_obsolete=is_obsolete)
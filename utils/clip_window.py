@@ -0,0 +1,86 @@
+import os
+import json
+
+DEFAULT_WINDOW_PADDING = 30  # 仅下载片段窗口时，在窗口前后额外保留的秒数，便于之后调整起止时间
+
+
+def get_window_info_path(video_path):
+    """窗口信息记录在视频旁的 <视频名>.window.json 中"""
+    return os.path.splitext(video_path)[0] + ".window.json"
+
+
+def compute_download_window(song, video_config=None, clip_start_interval=(15, 75), clip_play_time=10,
+                            padding=DEFAULT_WINDOW_PADDING):
+    """
+    计算一个谱面需要下载的时间窗口 (开始秒数, 结束秒数)
+
+    已有视频配置时使用配置中的 start/end，否则使用随机起始时间区间可能覆盖的全部范围；
+    两者都会在前后加上 padding。
+    """
+    start, end = clip_start_interval[0], clip_start_interval[1] + clip_play_time
+    if video_config:
+        for clip in video_config.get('main', []):
+            if clip.get('id') == song['id'] and clip.get('level_index') == song['level_index']:
+                start, end = clip['start'], clip['end']
+                break
+    return max(0, start - padding), end + padding
+
+
+def save_window_info(video_path, window_start, window_end, source_duration=None):
+    info = {
+        'source_offset': window_start,
+        'window_start': window_start,
+        'window_end': window_end,
+        'source_duration': source_duration,
+    }
+    with open(get_window_info_path(video_path), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=4)
+    return info
+
+
+def load_window_info(video_path):
+    """读取窗口信息，完整下载的视频没有窗口信息，返回 None"""
+    info_path = get_window_info_path(video_path)
+    if not os.path.isfile(info_path):
+        return None
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def remove_window_info(video_path):
+    info_path = get_window_info_path(video_path)
+    if os.path.exists(info_path):
+        os.remove(info_path)
+
+
+def window_covers(video_path, window) -> bool:
+    """
+    已下载的视频是否覆盖请求的时间窗口
+
+    完整下载的视频覆盖任意窗口；只下载了窗口的视频在请求完整视频（window 为 None）时视为不覆盖。
+    """
+    info = load_window_info(video_path)
+    if info is None:
+        return True
+    if window is None:
+        return False
+    start, end = window
+    source_duration = info.get('source_duration')
+    if source_duration:
+        # 下载时窗口会被限制在原视频长度以内，比较时做同样的处理
+        start, end = min(start, max(0, source_duration - 1)), min(end, source_duration)
+    return info['window_start'] <= start and info['window_end'] >= end
+
+
+def get_source_offset(video_path) -> float:
+    """本地文件的 0 秒对应原视频中的秒数（完整下载的视频为 0）"""
+    info = load_window_info(video_path)
+    return info['source_offset'] if info else 0
+
+
+def to_local_time(video_path, source_time) -> float:
+    """将 video_configs.json 中以原视频为基准的时间换算为本地文件中的时间"""
+    return source_time - get_source_offset(video_path)
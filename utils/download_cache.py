@@ -0,0 +1,369 @@
+import os
+import json
+import time
+import glob
+import sqlite3
+import contextlib
+from utils.clip_window import get_window_info_path
+from utils.fingerprint import fingerprint
+from utils.file_lock import FileLock
+
+DOWNLOAD_CACHE_DB = "download_cache.db"
+DEFAULT_CACHE_QUOTA_GB = 30  # 下载缓存的默认磁盘配额，0 表示不限制
+SAVE_BASE_DIR = "b30_datas"
+PINNED_VERSIONS_PER_USER = 1  # 每个用户最近的若干个存档引用的视频不会被淘汰
+DERIVED_GRACE_SECONDS = 60 * 60  # 派生文件（中间文件、截取文件、缩略图）在最近使用后的该时间内不会被淘汰
+
+# 作为独立列存储的字段，其余字段存入 extra
+RECORD_COLUMNS = ('size', 'checksum', 'codec', 'height', 'fps', 'quality', 'platform',
+                  'high_res', 'is_best_available', 'pinned', 'created_at', 'last_access', 'updated_at')
+BOOL_COLUMNS = ('high_res', 'is_best_available', 'pinned')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    checksum TEXT,
+    codec TEXT,
+    height INTEGER,
+    fps INTEGER,
+    quality TEXT,
+    platform TEXT,
+    high_res INTEGER,
+    is_best_available INTEGER,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    created_at REAL,
+    last_access REAL,
+    updated_at REAL,
+    extra TEXT
+)
+"""
+
+
+def get_db_path(video_download_path):
+    return os.path.join(video_download_path, DOWNLOAD_CACHE_DB)
+
+
+def get_clip_path(video_download_path, clip_name):
+    return os.path.join(video_download_path, f"{clip_name}.mp4")
+
+
+@contextlib.contextmanager
+def _connect(video_download_path):
+    """打开下载目录的缓存索引，每次调用使用独立连接，可在多线程中使用"""
+    os.makedirs(video_download_path, exist_ok=True)
+    conn = sqlite3.connect(get_db_path(video_download_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _row_to_record(row):
+    if row is None:
+        return None
+    record = {k: row[k] for k in row.keys() if k not in ('key', 'extra') and row[k] is not None}
+    for column in BOOL_COLUMNS:
+        if column in record:
+            record[column] = bool(record[column])
+    if row['extra']:
+        record.update(json.loads(row['extra']))
+    return record
+
+
+def _upsert(conn, clip_name, fields):
+    row = conn.execute("SELECT * FROM downloads WHERE key = ?", (clip_name,)).fetchone()
+    record = _row_to_record(row) or {'created_at': time.time()}
+    record.update(fields)
+    record['updated_at'] = time.time()
+    record.setdefault('last_access', record['updated_at'])
+
+    columns = {k: record.get(k) for k in RECORD_COLUMNS}
+    for column in BOOL_COLUMNS:
+        if columns[column] is not None:
+            columns[column] = int(bool(columns[column]))
+    columns['pinned'] = columns['pinned'] or 0
+    extra = {k: v for k, v in record.items() if k not in RECORD_COLUMNS}
+    conn.execute(
+        f"INSERT OR REPLACE INTO downloads (key, {', '.join(RECORD_COLUMNS)}, extra) "
+        f"VALUES (?, {', '.join('?' * len(RECORD_COLUMNS))}, ?)",
+        (clip_name, *columns.values(), json.dumps(extra, ensure_ascii=False) if extra else None))
+    return record
+
+
+def compute_checksum(file_path) -> str:
+    return fingerprint(file_path, full=True)
+
+
+def get_download_record(video_download_path, clip_name):
+    """读取已下载视频的记录（所选流的分辨率、编码、大小、校验和等），没有记录时返回 None"""
+    if not os.path.isfile(get_db_path(video_download_path)):
+        return None
+    with _connect(video_download_path) as conn:
+        row = conn.execute("SELECT * FROM downloads WHERE key = ?", (clip_name,)).fetchone()
+        return _row_to_record(row)
+
+
+def update_download_record(video_download_path, clip_name, **fields):
+    """更新已下载视频的记录"""
+    with _connect(video_download_path) as conn:
+        return _upsert(conn, clip_name, fields)
+
+
+def record_download(video_download_path, clip_name, **fields):
+    """视频文件写入完成后调用：记录文件大小与校验和，以及所选流的信息"""
+    clip_path = get_clip_path(video_download_path, clip_name)
+    fields['size'] = os.path.getsize(clip_path)
+    fields['checksum'] = compute_checksum(clip_path)
+    fields['fingerprint'] = fingerprint(clip_path)
+    fields['last_access'] = time.time()
+    return update_download_record(video_download_path, clip_name, **fields)
+
+
+def remove_download_record(video_download_path, clip_name):
+    with _connect(video_download_path) as conn:
+        conn.execute("DELETE FROM downloads WHERE key = ?", (clip_name,))
+
+
+def touch_download(video_download_path, clip_name):
+    """更新最近访问时间，用于 LRU 淘汰"""
+    with _connect(video_download_path) as conn:
+        conn.execute("UPDATE downloads SET last_access = ? WHERE key = ?", (time.time(), clip_name))
+
+
+def set_pinned(video_download_path, clip_name, pinned=True):
+    """手动固定的视频不会被配额淘汰"""
+    update_download_record(video_download_path, clip_name, pinned=pinned)
+
+
+def is_cached_complete(video_download_path, clip_name, full_check=False) -> bool:
+    """
+    检查缓存中的视频是否完整
+
+    有记录时比对文件大小与采样指纹（full_check 时再比对完整校验和）；没有记录的旧文件只要存在即视为完整，
+    并补录其大小以便之后检查。
+    """
+    clip_path = get_clip_path(video_download_path, clip_name)
+    if not os.path.isfile(clip_path):
+        return False
+    record = get_download_record(video_download_path, clip_name)
+    size = os.path.getsize(clip_path)
+    if not record or record.get('size') is None:
+        update_download_record(video_download_path, clip_name, size=size,
+                               last_access=os.path.getmtime(clip_path))
+        return size > 0
+    if record['size'] != size:
+        return False
+    if record.get('fingerprint') and fingerprint(clip_path) != record['fingerprint']:
+        return False
+    if full_check and record.get('checksum'):
+        return compute_checksum(clip_path) == record['checksum']
+    return True
+
+
+def verify_cache(video_download_path, remove_corrupted=True):
+    """完整校验下载目录中所有有记录的视频，返回损坏或丢失的视频名列表"""
+    with _connect(video_download_path) as conn:
+        keys = [row['key'] for row in conn.execute("SELECT key FROM downloads")]
+    corrupted = [key for key in keys if not is_cached_complete(video_download_path, key, full_check=True)]
+    if remove_corrupted:
+        for key in corrupted:
+            clip_path = get_clip_path(video_download_path, key)
+            if os.path.exists(clip_path):
+                os.remove(clip_path)
+            remove_download_record(video_download_path, key)
+    return corrupted
+
+
+def collect_pinned_clips(base_dir=SAVE_BASE_DIR, versions_per_user=PINNED_VERSIONS_PER_USER):
+    """收集每个用户最近的存档中引用的视频名，这些视频不会被淘汰"""
+    pinned = set()
+    if not os.path.isdir(base_dir):
+        return pinned
+    for username in os.listdir(base_dir):
+        user_dir = os.path.join(base_dir, username)
+        if not os.path.isdir(user_dir):
+            continue
+        versions = sorted([d for d in os.listdir(user_dir) if os.path.isdir(os.path.join(user_dir, d))],
+                          reverse=True)[:versions_per_user]
+        for version in versions:
+            version_dir = os.path.join(user_dir, version)
+            for config_file in glob.glob(os.path.join(version_dir, "b30_config*.json")) + \
+                    [os.path.join(version_dir, "video_configs.json")]:
+                pinned |= _clips_in_config(config_file)
+    return pinned
+
+
+def _clips_in_config(config_file):
+    clips = set()
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return clips
+    entries = data.get('main', []) if isinstance(data, dict) else data
+    for entry in entries if isinstance(entries, list) else []:
+        if isinstance(entry, dict) and 'id' in entry and 'level_index' in entry:
+            clips.add(f"{entry['id']}-{entry['level_index']}")
+    return clips
+
+
+def enforce_quota(video_download_path, quota_gb=DEFAULT_CACHE_QUOTA_GB, pinned_keys=()):
+    """
+    按最近访问时间淘汰视频，使下载目录的总大小不超过配额
+
+    固定的视频以及 pinned_keys 中的视频不会被淘汰；其他会话持有文件锁（正在下载或渲染）的视频同样跳过，
+    删除文件与记录时持有该视频的锁。
+
+    Returns:
+        list: 被淘汰的视频名
+    """
+    if not quota_gb or quota_gb <= 0 or not os.path.isdir(video_download_path):
+        return []
+    quota_bytes = quota_gb * 1024 ** 3
+
+    # 补录没有记录的旧文件
+    with _connect(video_download_path) as conn:
+        known = {row['key'] for row in conn.execute("SELECT key FROM downloads")}
+        for clip_path in glob.glob(os.path.join(video_download_path, "*.mp4")):
+            clip_name = os.path.splitext(os.path.basename(clip_path))[0]
+            if clip_name not in known:
+                _upsert(conn, clip_name, {'size': os.path.getsize(clip_path),
+                                          'last_access': os.path.getmtime(clip_path)})
+        rows = conn.execute("SELECT key, size, pinned FROM downloads ORDER BY last_access ASC").fetchall()
+
+    entries = [(row['key'], row['size'] or 0, row['pinned']) for row in rows
+               if os.path.isfile(get_clip_path(video_download_path, row['key']))]
+    total = sum(size for _, size, _ in entries)
+    pinned_keys = set(pinned_keys)
+    evicted = []
+    for key, size, pinned in entries:
+        if total <= quota_bytes:
+            break
+        if pinned or key in pinned_keys:
+            continue
+        clip_path = get_clip_path(video_download_path, key)
+        # 其他会话正在下载或使用该视频时锁被占用，跳过而不是等待
+        lock = FileLock(clip_path)
+        if not lock.try_acquire():
+            print(f"视频 {key} 正在被使用，跳过淘汰")
+            continue
+        try:
+            if os.path.exists(clip_path):
+                os.remove(clip_path)
+            window_info = get_window_info_path(clip_path)
+            if os.path.exists(window_info):
+                os.remove(window_info)
+            remove_download_record(video_download_path, key)
+        finally:
+            lock.release()
+        total -= size
+        evicted.append(key)
+    if evicted:
+        print(f"下载缓存超出配额 {quota_gb}GB，已淘汰 {len(evicted)} 个最久未使用的视频")
+    return evicted
+
+
+def touch_derived(path):
+    """派生文件被使用时更新修改时间，用于 LRU 淘汰"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _scan_derived(directory, name_pattern):
+    """
+    扫描派生文件目录，按产物分组（同名不同扩展名的附属文件，如窗口信息、索引，与产物一起计算与删除）
+
+    name_pattern 为匹配产物主文件名的正则，需包含 stem（源文件名）与 fingerprint（源文件短指纹）两个命名组。
+    """
+    artifacts = []
+    for name in os.listdir(directory):
+        match = name_pattern.match(name)
+        path = os.path.join(directory, name)
+        if not match or not os.path.isfile(path):
+            continue
+        base = os.path.splitext(path)[0]
+        files = [p for p in glob.glob(glob.escape(base) + ".*") if os.path.isfile(p)]
+        try:
+            stats = [os.stat(p) for p in files]
+        except OSError:
+            continue
+        artifacts.append({
+            'path': os.path.abspath(path),
+            'files': files,
+            'size': sum(stat.st_size for stat in stats),
+            'last_access': max(stat.st_mtime for stat in stats),
+            'stem': match.group('stem'),
+            'fingerprint': match.group('fingerprint'),
+        })
+    return artifacts
+
+
+def _remove_artifact(artifact):
+    """持有产物的锁时删除其所有文件，锁被占用（正在生成）时返回 False"""
+    lock = FileLock(artifact['path'])
+    if not lock.try_acquire():
+        return False
+    try:
+        for file_path in artifact['files']:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    finally:
+        lock.release()
+    return True
+
+
+def enforce_derived_quota(directory, name_pattern, quota_gb, keep_paths=(), is_obsolete=None,
+                          grace_seconds=DERIVED_GRACE_SECONDS):
+    """
+    淘汰由下载视频派生的缓存文件（中间文件、截取文件、缩略图）
+
+    1. 同一源文件名下存在多个源文件指纹时，只保留最新指纹的产物（源文件已被重新下载，旧产物不会再被使用）；
+    2. is_obsolete(artifact) 返回 True 的产物（如配置中的时间窗口已修改）；
+    3. 其余产物按最近使用时间淘汰，直到总大小不超过配额。
+    keep_paths 中的产物、最近 grace_seconds 秒内使用过的产物以及正在生成（锁被占用）的产物不会被删除。
+
+    Returns:
+        list: 被淘汰的产物路径
+    """
+    if not os.path.isdir(directory):
+        return []
+    artifacts = sorted(_scan_derived(directory, name_pattern), key=lambda a: a['last_access'])
+    keep_paths = {os.path.abspath(path) for path in keep_paths}
+    now = time.time()
+
+    newest_fingerprint = {}
+    for artifact in artifacts:
+        newest_fingerprint[artifact['stem']] = artifact['fingerprint']
+
+    def removable(artifact):
+        return artifact['path'] not in keep_paths and now - artifact['last_access'] >= grace_seconds
+
+    evicted = []
+    remaining = []
+    for artifact in artifacts:
+        stale = artifact['fingerprint'] != newest_fingerprint[artifact['stem']] or \
+            (is_obsolete is not None and is_obsolete(artifact))
+        if stale and removable(artifact) and _remove_artifact(artifact):
+            evicted.append(artifact['path'])
+        else:
+            remaining.append(artifact)
+
+    if quota_gb and quota_gb > 0:
+        quota_bytes = quota_gb * 1024 ** 3
+        total = sum(artifact['size'] for artifact in remaining)
+        for artifact in remaining:
+            if total <= quota_bytes:
+                break
+            if removable(artifact) and _remove_artifact(artifact):
+                total -= artifact['size']
+                evicted.append(artifact['path'])
+    if evicted:
+        print(f"已清理 {directory} 中 {len(evicted)} 个过期或超出配额的缓存文件")
+    return evicted
@@ -0,0 +1,155 @@
+import os
+import time
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.video_crawler import PurePytubefixDownloader, BilibiliDownloader
+from utils.download_cache import enforce_quota, collect_pinned_clips, get_download_record, DEFAULT_CACHE_QUOTA_GB
+from utils.download_telemetry import DownloadRun, format_platform_summary, format_host_summary
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+# 各站点的最大并发下载数，过高容易触发风控或被 CDN 限速
+DEFAULT_HOST_CONCURRENCY = {
+    "bilibili": 2,
+    "youtube": 3,
+}
+DEFAULT_DOWNLOAD_RETRIES = 2
+RETRY_BASE_DELAY = 5  # 重试前的基础等待时间（秒），按重试次数指数增长
+
+
+def get_downloader_platform(downloader) -> str:
+    if isinstance(downloader, BilibiliDownloader):
+        return "bilibili"
+    if isinstance(downloader, PurePytubefixDownloader):
+        return "youtube"
+    return "unknown"
+
+
+class DownloadScheduler:
+    """
+    并行下载调度器。
+
+    使用线程池并行执行下载任务，并按站点限制并发数；失败的任务会按指数退避重试。
+    进度回调始终在调用 `run` 的线程中执行，因此可以直接在回调里更新 streamlit 组件。
+    """
+    def __init__(self, downloader, video_download_path, high_res=False,
+                 max_workers=DEFAULT_DOWNLOAD_WORKERS, host_concurrency=None,
+                 max_retries=DEFAULT_DOWNLOAD_RETRIES, wait_time=(0, 0), window_for=None, target=None,
+                 cache_quota_gb=DEFAULT_CACHE_QUOTA_GB):
+        self.downloader = downloader
+        self.video_download_path = video_download_path
+        self.high_res = high_res
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.wait_time = wait_time
+        # window_for(song) 返回需要下载的时间窗口，为 None 时下载完整视频
+        self.window_for = window_for
+        # 渲染所需的最低流规格，用于选择下载的流以及判断缓存是否需要升级
+        self.target = target
+        # 下载缓存的磁盘配额（GB），全部任务结束后按 LRU 淘汰超出的视频
+        self.cache_quota_gb = cache_quota_gb
+        # 最近一次 run 的下载统计汇总（按站点，以及按流地址的主机名）
+        self.last_summary = None
+        self.last_host_summary = None
+        self.platform = get_downloader_platform(downloader)
+
+        host_concurrency = {**DEFAULT_HOST_CONCURRENCY, **(host_concurrency or {})}
+        self._host_semaphore = threading.Semaphore(max(1, host_concurrency.get(self.platform, 1)))
+
+    def _wait_before_start(self):
+        # 随机错开任务的开始时间，以减少被检测为bot的风险
+        if self.wait_time[0] > 0 and self.wait_time[1] > self.wait_time[0]:
+            time.sleep(random.uniform(self.wait_time[0], self.wait_time[1]))
+
+    def _run_job(self, index, song, events, telemetry):
+        clip_name = f"{song['id']}-{song['level_index']}"
+        metrics = None
+        attempt = 0
+        result = {"status": "error", "info": f"下载{song['id']}-{song['level_index']}时发生未知错误"}
+        try:
+            # 延迟导入，避免与 pre_gen 循环引用
+            from pre_gen import download_one_video
+            metrics = telemetry.start_job(clip_name, self.platform)
+            for attempt in range(self.max_retries + 1):
+                # 错开开始时间的等待在获取主机并发名额之前进行，等待期间不占用名额
+                clip_path = os.path.join(self.video_download_path, f"{song['id']}-{song['level_index']}.mp4")
+                if attempt == 0 and not os.path.exists(clip_path):
+                    self._wait_before_start()
+                with self._host_semaphore:
+                    events.put(("start", index, song, {"attempt": attempt}))
+                    try:
+                        window = self.window_for(song) if self.window_for else None
+                        result = download_one_video(self.downloader, song, self.video_download_path, 
+                                                    self.high_res, window=window, target=self.target)
+                    except Exception as e:
+                        result = {"status": "error", "info": f"下载{song['id']}-{song['level_index']}时发生异常: {e}"}
+
+                # 没有视频信息的任务重试也无意义
+                has_video_info = bool(song.get('video_info_match'))
+                if result['status'] != "error" or not has_video_info or attempt == self.max_retries:
+                    break
+                delay = RETRY_BASE_DELAY * 2 ** attempt
+                events.put(("retry", index, song, {**result, "attempt": attempt + 1, "delay": delay}))
+                time.sleep(delay)
+        except Exception as e:
+            result = {"status": "error", "info": f"下载{song['id']}-{song['level_index']}时发生异常: {e}"}
+        finally:
+            # 无论成功与否都要通知调用方，否则 run 会一直等待
+            try:
+                if metrics:
+                    selection = None
+                    if result['status'] == "success":
+                        try:
+                            selection = get_download_record(self.video_download_path, clip_name)
+                        except Exception:
+                            pass
+                    telemetry.finish_job(metrics, result['status'], retries=attempt, selection=selection)
+            finally:
+                events.put(("done", index, song, result))
+        return result
+
+    def run(self, songs, on_progress=None):
+        """
+        下载所有谱面的视频
+
+        Args:
+            songs(list): b30 数据列表
+            on_progress(callable): 进度回调 on_progress(event, index, song, info)，
+                event 为 "start" / "retry" / "done"
+
+        Returns:
+            list: 与 songs 一一对应的下载结果字典
+        """
+        events = queue.Queue()
+        results = [None] * len(songs)
+        telemetry = DownloadRun()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for index, song in enumerate(songs):
+                executor.submit(self._run_job, index, song, events, telemetry)
+
+            finished = 0
+            while finished < len(songs):
+                event, index, song, info = events.get()
+                if event == "done":
+                    results[index] = info
+                    finished += 1
+                if on_progress:
+                    on_progress(event, index, song, info)
+
+        # 本次下载的谱面与各用户最近存档引用的谱面不参与淘汰
+        pinned = {f"{song['id']}-{song['level_index']}" for song in songs} | collect_pinned_clips()
+        try:
+            enforce_quota(self.video_download_path, self.cache_quota_gb, pinned)
+        except Exception as e:
+            print(f"清理下载缓存时出错: {e}")
+
+        summary = telemetry.write({'max_workers': self.max_workers, 'high_res': self.high_res,
+                                   'target': self.target})
+        self.last_summary = summary['platforms']
+        self.last_host_summary = summary['hosts']
+        for platform, stats in self.last_summary.items():
+            print(format_platform_summary(platform, stats))
+        for host, stats in self.last_host_summary.items():
+            print(format_host_summary(host, stats))
+        return results
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import threading
+import contextlib
+from datetime import datetime
+from urllib.parse import urlparse
+from utils.file_lock import FileLock
+
+DOWNLOAD_METRICS_FILE = "./videos/download_metrics.jsonl"  # 每次下载运行追加一行 JSON
+
+# 正在进行的下载任务，按视频名索引；同一视频的下载由文件锁串行化，因此视频名在进程内唯一
+_active_jobs = {}
+_active_lock = threading.Lock()
+
+
+def get_url_host(url) -> str:
+    """流地址的主机名（CDN 节点），用于按主机统计吞吐量"""
+    try:
+        return urlparse(url).hostname or "unknown"
+    except (TypeError, ValueError):
+        return "unknown"
+
+
+class JobMetrics:
+    """
+    单个下载任务的统计：传输字节数、首字节时间、吞吐量、合并耗时、重试次数与所选流
+
+    platform 为下载器对应的站点（bilibili/youtube），传输统计另按流地址的主机名记录在 transfers 中。
+    """
+    def __init__(self, clip_name, platform):
+        self.clip_name = clip_name
+        self.platform = platform
+        self.status = None
+        self.retries = 0
+        self.bytes = 0
+        self.transfer_time = 0.0
+        self.ttfb = None
+        self.merge_time = 0.0
+        self.selection = {}
+        self.transfers = {}
+        self.started_at = time.time()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_transfer(self, num_bytes, seconds, ttfb=None, host=None):
+        with self._lock:
+            self.bytes += num_bytes
+            self.transfer_time += seconds
+            if ttfb is not None:
+                self.ttfb = ttfb if self.ttfb is None else min(self.ttfb, ttfb)
+            transfer = self.transfers.setdefault(host or "unknown",
+                                                 {'count': 0, 'bytes': 0, 'transfer_time': 0.0, 'ttfb': None})
+            transfer['count'] += 1
+            transfer['bytes'] += num_bytes
+            transfer['transfer_time'] += seconds
+            if ttfb is not None:
+                transfer['ttfb'] = ttfb if transfer['ttfb'] is None else min(transfer['ttfb'], ttfb)
+
+    def add_merge(self, seconds):
+        with self._lock:
+            self.merge_time += seconds
+
+    @property
+    def throughput(self):
+        """字节/秒"""
+        return self.bytes / self.transfer_time if self.transfer_time > 0 else None
+
+    def to_dict(self):
+        return {
+            'clip_name': self.clip_name,
+            'platform': self.platform,
+            'status': self.status,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'transfer_time': round(self.transfer_time, 3),
+            'ttfb': round(self.ttfb, 3) if self.ttfb is not None else None,
+            'throughput': round(self.throughput) if self.throughput else None,
+            'merge_time': round(self.merge_time, 3),
+            'elapsed': round(self.elapsed, 3),
+            'selection': self.selection,
+            'transfers': {host: {**transfer, 'transfer_time': round(transfer['transfer_time'], 3)}
+                          for host, transfer in self.transfers.items()},
+        }
+
+
+def get_job_metrics(clip_name):
+    with _active_lock:
+        return _active_jobs.get(clip_name)
+
+
+def record_transfer(clip_name, num_bytes, seconds, ttfb=None, host=None):
+    """由下载器在一个流传输完成后调用，host 为流地址的主机名；没有正在统计的任务时忽略"""
+    metrics = get_job_metrics(clip_name)
+    if metrics:
+        metrics.add_transfer(num_bytes, seconds, ttfb, host)
+
+
+def record_merge(clip_name, seconds):
+    metrics = get_job_metrics(clip_name)
+    if metrics:
+        metrics.add_merge(seconds)
+
+
+@contextlib.contextmanager
+def measure_transfer(clip_name, output_file, host=None):
+    """统计一段按文件落盘的传输（如 pytubefix 或 ffmpeg 窗口下载），以输出文件大小作为字节数"""
+    start = time.monotonic()
+    yield
+    if os.path.isfile(output_file):
+        record_transfer(clip_name, os.path.getsize(output_file), time.monotonic() - start, host=host)
+
+
+@contextlib.contextmanager
+def measure_merge(clip_name):
+    start = time.monotonic()
+    yield
+    record_merge(clip_name, time.monotonic() - start)
+
+
+class DownloadRun:
+    """一次批量下载的统计，结束后按站点与流地址主机名汇总并写入指标文件"""
+    def __init__(self, metrics_file=DOWNLOAD_METRICS_FILE):
+        self.metrics_file = metrics_file
+        self.started_at = time.time()
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def start_job(self, clip_name, platform):
+        metrics = JobMetrics(clip_name, platform)
+        with _active_lock:
+            _active_jobs[clip_name] = metrics
+        return metrics
+
+    def finish_job(self, metrics, status, retries=0, selection=None):
+        metrics.status = status
+        metrics.retries = retries
+        metrics.selection = selection or {}
+        metrics.elapsed = time.time() - metrics.started_at
+        with _active_lock:
+            if _active_jobs.get(metrics.clip_name) is metrics:
+                del _active_jobs[metrics.clip_name]
+        with self._lock:
+            self.jobs.append(metrics)
+
+    def summarize(self):
+        """按站点汇总，吞吐量只统计实际发生了传输的任务"""
+        platforms = {}
+        for job in self.jobs:
+            stats = platforms.setdefault(job.platform, {
+                'jobs': 0, 'success': 0, 'skip': 0, 'error': 0, 'retries': 0,
+                'bytes': 0, 'transfer_time': 0.0, 'merge_time': 0.0, 'ttfb': [],
+            })
+            stats['jobs'] += 1
+            stats[job.status if job.status in ('success', 'skip', 'error') else 'error'] += 1
+            stats['retries'] += job.retries
+            stats['bytes'] += job.bytes
+            stats['transfer_time'] += job.transfer_time
+            stats['merge_time'] += job.merge_time
+            if job.ttfb is not None:
+                stats['ttfb'].append(job.ttfb)
+        for stats in platforms.values():
+            ttfb = stats.pop('ttfb')
+            stats['mean_ttfb'] = round(sum(ttfb) / len(ttfb), 3) if ttfb else None
+            stats['throughput'] = round(stats['bytes'] / stats['transfer_time']) if stats['transfer_time'] > 0 else None
+            stats['transfer_time'] = round(stats['transfer_time'], 3)
+            stats['merge_time'] = round(stats['merge_time'], 3)
+        return platforms
+
+    def summarize_hosts(self):
+        """按流地址的主机名（CDN 节点）汇总传输，用于发现被限速的节点"""
+        hosts = {}
+        for job in self.jobs:
+            for host, transfer in job.transfers.items():
+                stats = hosts.setdefault(host, {
+                    'platform': job.platform, 'jobs': 0, 'error': 0, 'retries': 0, 'transfers': 0,
+                    'bytes': 0, 'transfer_time': 0.0, 'ttfb': [],
+                })
+                stats['jobs'] += 1
+                stats['error'] += job.status not in ('success', 'skip')
+                stats['retries'] += job.retries
+                stats['transfers'] += transfer['count']
+                stats['bytes'] += transfer['bytes']
+                stats['transfer_time'] += transfer['transfer_time']
+                if transfer['ttfb'] is not None:
+                    stats['ttfb'].append(transfer['ttfb'])
+        for stats in hosts.values():
+            ttfb = stats.pop('ttfb')
+            stats['mean_ttfb'] = round(sum(ttfb) / len(ttfb), 3) if ttfb else None
+            stats['throughput'] = round(stats['bytes'] / stats['transfer_time']) if stats['transfer_time'] > 0 else None
+            stats['transfer_time'] = round(stats['transfer_time'], 3)
+        return hosts
+
+    def write(self, extra=None):
+        """追加写入指标文件并返回本次运行的汇总"""
+        summary = {
+            'run_started': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+            'wall_time': round(time.time() - self.started_at, 3),
+            **(extra or {}),
+            'platforms': self.summarize(),
+            'hosts': self.summarize_hosts(),
+            'jobs': [job.to_dict() for job in self.jobs],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.metrics_file) or ".", exist_ok=True)
+            with FileLock(self.metrics_file):
+                with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"写入下载指标失败: {e}")
+        return summary
+
+
+def format_platform_summary(platform, stats) -> str:
+    throughput = f"{stats['throughput'] / 1024 / 1024:.2f} MB/s" if stats['throughput'] else "-"
+    ttfb = f"{stats['mean_ttfb'] * 1000:.0f} ms" if stats['mean_ttfb'] is not None else "-"
+    return (f"[{platform}] 任务 {stats['jobs']}（成功 {stats['success']} / 跳过 {stats['skip']} / 失败 {stats['error']}），"
+            f"重试 {stats['retries']} 次，下载 {stats['bytes'] / 1024 / 1024:.1f} MB，"
+            f"平均吞吐 {throughput}，平均首字节 {ttfb}，合并耗时 {stats['merge_time']:.1f} 秒")
+
+
+def format_host_summary(host, stats) -> str:
+    throughput = f"{stats['throughput'] / 1024 / 1024:.2f} MB/s" if stats['throughput'] else "-"
+    ttfb = f"{stats['mean_ttfb'] * 1000:.0f} ms" if stats['mean_ttfb'] is not None else "-"
+    return (f"[{stats['platform']} {host}] 任务 {stats['jobs']}（失败 {stats['error']}），重试 {stats['retries']} 次，"
+            f"传输 {stats['transfers']} 次共 {stats['bytes'] / 1024 / 1024:.1f} MB，"
+            f"平均吞吐 {throughput}，平均首字节 {ttfb}")
@@ -1,11 +1,28 @@
 import os
-import subprocess
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.file_lock import FileLock, atomic_write
+from utils.media_index import get_media_info, get_media_info_many
+from utils.download_cache import get_download_record, record_download
+from utils.stream_selection import record_needs_transcode, CODECS_NEEDING_TRANSCODE
+from utils.ffmpeg_runner import run_ffmpeg, timeout_for_duration, FFmpegError
+
+VIDEO_EXTENSIONS = ['.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm']
+CONVERSION_STATE_FILE = ".conversion_state.json"  # 记录已处理文件的 [大小, 修改时间]
+# 时间预算 -> (x264 预设, crf)
+CONVERSION_BUDGETS = {
+    'fast': ('veryfast', 23),
+    'balanced': ('faster', 23),
+    'quality': ('medium', 23),
+}
+DEFAULT_CONVERSION_BUDGET = 'balanced'
+DEFAULT_THREADS_PER_JOB = 2
+PROBE_WORKERS = 8
 
 def get_video_codec(file_path: str) -> str:
     """
-    使用 ffprobe 获取视频的编码格式
+    获取视频的编码格式（通过媒体索引，文件未变化时不会重复调用 ffprobe）
     
     Args:
         file_path (str): 视频文件路径
@@ -13,26 +30,8 @@ def get_video_codec(file_path: str) -> str:
     Returns:
         str: 视频编码格式，如果获取失败则返回空字符串
     """
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',  # 只显示错误信息
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=codec_name',
-            '-of', 'json',
-            str(file_path)
-        ]
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        data = json.loads(result.stdout)
-        return data['streams'][0]['codec_name']
-    except Exception as e:
-        print(f"获取视频编码信息失败: {str(e)}")
-        return ""
+    info = get_media_info(str(file_path))
+    return (info or {}).get('vcodec') or ""
 
 def needs_conversion(file_path: Path) -> bool:
     """
@@ -49,82 +48,160 @@ def needs_conversion(file_path: Path) -> bool:
     if extension != '.mp4':
         return True
     
+    # 下载时已记录所选流的编码，无需再调用 ffprobe
+    recorded = record_needs_transcode(get_download_record(str(file_path.parent), file_path.stem))
+    if recorded is not None:
+        return recorded
+
     # 检查视频编码
     codec = get_video_codec(str(file_path))
-    # 需要转换的编码列表
-    codecs_to_convert = ['av1', 'vp8', 'vp9']
-    return codec.lower() in codecs_to_convert
+    return codec.lower() in CODECS_NEEDING_TRANSCODE
+
+def _probe_codecs(file_paths, max_workers) -> dict:
+    """通过媒体索引批量获取一批文件的视频编码，未命中索引的文件并行探测"""
+    if not file_paths:
+        return {}
+    infos = get_media_info_many([str(p) for p in file_paths], max_workers=max_workers)
+    return {p: (infos.get(str(p)) or {}).get('vcodec') or "" for p in file_paths}
+
+
+def _load_state(directory: Path) -> dict:
+    state_file = directory / CONVERSION_STATE_FILE
+    if not state_file.is_file():
+        return {}
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_state(directory: Path, state: dict) -> None:
+    state_file = str(directory / CONVERSION_STATE_FILE)
+    with FileLock(state_file):
+        with atomic_write(state_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=4)
+
+
+def _file_signature(file_path: Path) -> list:
+    stat = file_path.stat()
+    return [stat.st_size, stat.st_mtime]
+
+
+def _transcode(file_path: Path, preset: str, crf: int, threads: int) -> Path:
+    """将单个文件转码为 H.264/AAC 的 mp4，返回输出路径，失败时抛出异常"""
+    output_path = file_path.with_suffix('.mp4')
+    temp_output_path = file_path.with_suffix('.temp.mp4')
+    try:
+        duration = (get_media_info(str(file_path)) or {}).get('duration')
+        process = run_ffmpeg([
+            'ffmpeg',
+            '-hide_banner',  # 隐藏 ffmpeg 版本信息
+            '-loglevel', 'error',  # 只显示错误信息
+            '-i', str(file_path),
+            '-c:v', 'libx264',
+            '-preset', preset,
+            '-crf', str(crf),
+            '-threads', str(threads),  # 限制单个任务的线程数，多个 ffmpeg 进程并行运行
+            '-c:a', 'aac',
+            '-b:a', '192k',
+            '-y',
+            str(temp_output_path)
+        ], "转码失败", timeout=timeout_for_duration(duration))
+
+        # 如果有错误输出，打印警告信息
+        if process.stderr.strip():
+            print(f"转码警告: {process.stderr}")
 
-def convert_videos_to_avc1_mp4(directory_path: str) -> None:
+        if file_path != output_path:
+            file_path.unlink()
+        os.replace(temp_output_path, output_path)
+        if get_download_record(str(output_path.parent), output_path.stem):
+            record_download(str(output_path.parent), output_path.stem, codec='h264')
+        return output_path
+    finally:
+        # 清理临时文件
+        if temp_output_path.exists():
+            temp_output_path.unlink()
+
+
+def convert_videos_to_avc1_mp4(directory_path: str, budget: str = DEFAULT_CONVERSION_BUDGET,
+                               max_workers: int = None, threads_per_job: int = DEFAULT_THREADS_PER_JOB) -> None:
     """
     遍历指定目录，将非mp4格式或非H.264编码的视频文件转换为mp4格式（H.264编码）
-    
+
+    已处理过且大小、修改时间未变的文件记录在目录下的状态文件中，再次运行时直接跳过；
+    其余文件优先使用下载记录中的编码，没有记录的文件并行探测，需要转码的文件由线程池同时启动多个 ffmpeg 进程并行处理（编码在 ffmpeg 进程中进行，线程只负责等待）。
+
     Args:
         directory_path (str): 需要处理的目录路径
+        budget (str): 时间预算，决定 x264 预设，可选 CONVERSION_BUDGETS 中的键
+        max_workers (int): 并行转码的任务数，默认按 CPU 核数与单任务线程数计算
+        threads_per_job (int): 单个转码任务可使用的线程数
     """
     try:
         directory = Path(directory_path)
-        
+        preset, crf = CONVERSION_BUDGETS.get(budget, CONVERSION_BUDGETS[DEFAULT_CONVERSION_BUDGET])
+        threads_per_job = max(1, threads_per_job)
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 1) // threads_per_job)
+
+        state = _load_state(directory)
+        pending = []
         # 遍历目录下的所有文件
         for file_path in directory.rglob('*'):
-            # 跳过非视频文件
-            if not file_path.is_file() or file_path.suffix.lower() not in \
-                ['.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm']:
+            # 跳过非视频文件与转码中断遗留的临时文件
+            if not file_path.is_file() or file_path.suffix.lower() not in VIDEO_EXTENSIONS or \
+                    file_path.name.endswith('.temp.mp4'):
                 continue
-                
-            if needs_conversion(file_path):
-                print(f"正在处理文件: {file_path}")
-                
-                # 构建输出文件路径
-                output_path = file_path.with_suffix('.mp4')
-                temp_output_path = file_path.with_suffix('.temp.mp4')
-                
-                try:
-                    # 使用 ffmpeg 进行转码，重定向输出
-                    process = subprocess.run([
-                        'ffmpeg',
-                        '-hide_banner',  # 隐藏 ffmpeg 版本信息
-                        '-loglevel', 'error',  # 只显示错误信息
-                        '-i', str(file_path),
-                        '-c:v', 'libx264',     
-                        '-preset', 'medium',    
-                        '-crf', '23',          
-                        '-c:a', 'aac',         
-                        '-b:a', '192k',        
-                        '-y',                  
-                        str(temp_output_path)
-                    ], 
-                    stdout=subprocess.PIPE,  # 捕获标准输出
-                    stderr=subprocess.PIPE,  # 捕获错误输出
-                    text=True)
-                    
-                    # 如果有错误输出，打印错误信息
-                    if process.stderr:
-                        print(f"转码警告/错误: {process.stderr}")
-                    
-                    if process.returncode == 0:
-                        if file_path != output_path:
-                            file_path.unlink()
-                        if output_path.exists():
-                            output_path.unlink()
-                        temp_output_path.rename(output_path)
-                        print(f"成功转换: {file_path} -> {output_path}")
-                    else:
-                        raise subprocess.CalledProcessError(process.returncode, process.args)
-                    
-                except subprocess.CalledProcessError as e:
-                    print(f"转换失败 {file_path}: {str(e)}")
-                    # 清理临时文件
-                    if temp_output_path.exists():
-                        temp_output_path.unlink()
-                except Exception as e:
-                    print(f"处理文件时出错 {file_path}: {str(e)}")
-                    # 清理临时文件
-                    if temp_output_path.exists():
-                        temp_output_path.unlink()
+            key = file_path.relative_to(directory).as_posix()
+            if state.get(key) == _file_signature(file_path):
+                continue
+            pending.append(file_path)
+
+        # 扩展名或下载记录即可判断的文件无需探测
+        to_convert, to_probe = [], []
+        for file_path in pending:
+            if file_path.suffix.lower() != '.mp4':
+                to_convert.append(file_path)
+                continue
+            recorded = record_needs_transcode(get_download_record(str(file_path.parent), file_path.stem))
+            if recorded is None:
+                to_probe.append(file_path)
+            elif recorded:
+                to_convert.append(file_path)
             else:
-                print(f"跳过文件（无需转换）: {file_path}")
-                    
+                state[file_path.relative_to(directory).as_posix()] = _file_signature(file_path)
+
+        for file_path, codec in _probe_codecs(to_probe, PROBE_WORKERS).items():
+            if codec.lower() in CODECS_NEEDING_TRANSCODE:
+                to_convert.append(file_path)
+            elif codec:
+                state[file_path.relative_to(directory).as_posix()] = _file_signature(file_path)
+
+        skipped = len(pending) - len(to_convert)
+        print(f"共 {len(pending)} 个新文件，{len(to_convert)} 个需要转换，{skipped} 个跳过（无需转换）")
+
+        if to_convert:
+            print(f"使用 {max_workers} 个并行任务转换（预设 {preset}，每个任务 {threads_per_job} 线程）")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(_transcode, file_path, preset, crf, threads_per_job): file_path
+                           for file_path in to_convert}
+                for future in as_completed(futures):
+                    file_path = futures[future]
+                    try:
+                        output_path = future.result()
+                        state[output_path.relative_to(directory).as_posix()] = _file_signature(output_path)
+                        print(f"成功转换: {file_path} -> {output_path}")
+                    except FFmpegError as e:
+                        print(f"转换失败 {file_path}: {str(e)}")
+                    except Exception as e:
+                        print(f"处理文件时出错 {file_path}: {str(e)}")
+
+        # 移除已不存在的文件的记录
+        state = {key: value for key, value in state.items() if (directory / key).is_file()}
+        _save_state(directory, state)
+
     except Exception as e:
         print(f"遍历目录时出错: {str(e)}")
 
@@ -0,0 +1,165 @@
+import os
+import re
+import time
+import threading
+import subprocess
+
+DEFAULT_STALL_TIMEOUT = 60  # 进度停止更新超过该秒数视为卡死
+PROBE_TIMEOUT = 60  # ffprobe 的总时长上限
+POLL_INTERVAL = 0.5
+STDERR_TAIL_LINES = 20
+MIN_MEDIA_TIMEOUT = 300
+DEFAULT_TIMEOUT = 2 * 60 * 60  # 无法估算媒体时长时的总时长上限（秒）
+# -progress 输出的字段；其中表示处理位置的字段任一变化即视为有进展
+PROGRESS_FIELDS = re.compile(r"^(frame|fps|stream_\d+_\d+_q|bitrate|total_size|out_time_us|out_time_ms|out_time|"
+                             r"dup_frames|drop_frames|speed|progress)=")
+ADVANCE_KEYS = ('out_time_us', 'total_size', 'frame')
+
+
+class FFmpegError(RuntimeError):
+    """
+    ffmpeg/ffprobe 执行失败
+
+    Attributes:
+        reason(str): 'failed'（返回码非 0）、'timeout'（超过总时长）或 'stalled'（进度停止）
+        returncode(int): 进程返回码，被终止时为 None
+        stderr_tail(str): 错误输出的最后几行
+        attempts(int): 已尝试的次数
+    """
+    def __init__(self, description, cmd, reason, returncode=None, stderr_tail='', attempts=1, elapsed=0.0):
+        self.description = description
+        self.cmd = cmd
+        self.reason = reason
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        self.attempts = attempts
+        self.elapsed = elapsed
+        if reason == 'timeout':
+            detail = f"超过 {elapsed:.0f} 秒未完成，已终止"
+        elif reason == 'stalled':
+            detail = "进度长时间无变化，已终止"
+        else:
+            detail = f"返回码 {returncode}"
+        super().__init__(f"{description}（{detail}，共尝试 {attempts} 次）: {stderr_tail}")
+
+    def to_dict(self):
+        return {'description': self.description, 'reason': self.reason, 'returncode': self.returncode,
+                'attempts': self.attempts, 'elapsed': round(self.elapsed, 3), 'stderr_tail': self.stderr_tail,
+                'cmd': self.cmd}
+
+
+def timeout_for_duration(duration, min_speed=0.25, minimum=MIN_MEDIA_TIMEOUT):
+    """按媒体时长估算总时长上限：处理速度低于 min_speed 倍速时视为异常；时长未知时使用 DEFAULT_TIMEOUT"""
+    if not duration:
+        return DEFAULT_TIMEOUT
+    return max(minimum, duration / min_speed)
+
+
+def _is_ffmpeg(cmd):
+    name = os.path.splitext(os.path.basename(cmd[0]))[0].lower()
+    return name == 'ffmpeg'
+
+
+def _with_progress(cmd):
+    """在全局参数位置加入 -progress，进度以 key=value 行写入 stderr"""
+    return [cmd[0], '-progress', 'pipe:2', '-nostats'] + list(cmd[1:])
+
+
+class _Watch:
+    """读取子进程的输出，并记录最近一次有进展的时间"""
+    def __init__(self, process):
+        self.process = process
+        self.stdout = []
+        self.stderr = []
+        self.last_progress = time.monotonic()
+        self._progress = {}
+        self._threads = [threading.Thread(target=self._read_stdout, daemon=True),
+                         threading.Thread(target=self._read_stderr, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _read_stdout(self):
+        for chunk in iter(lambda: self.process.stdout.read(8192), ''):
+            self.stdout.append(chunk)
+            self.last_progress = time.monotonic()
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            if not PROGRESS_FIELDS.match(line):
+                self.stderr.append(line)
+                continue
+            key, _, value = line.strip().partition('=')
+            if key in ADVANCE_KEYS and self._progress.get(key) != value:
+                self._progress[key] = value
+                self.last_progress = time.monotonic()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def stderr_tail(self):
+        lines = [line.rstrip() for line in self.stderr if line.strip()]
+        return "\n".join(lines[-STDERR_TAIL_LINES:])
+
+
+def _run_once(cmd, timeout, stall_timeout, cwd=None):
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='replace', cwd=cwd)
+    watch = _Watch(process)
+    reason = None
+    while process.poll() is None:
+        now = time.monotonic()
+        if timeout and now - started > timeout:
+            reason = 'timeout'
+        elif stall_timeout and now - watch.last_progress > stall_timeout:
+            reason = 'stalled'
+        if reason:
+            process.kill()
+            break
+        time.sleep(POLL_INTERVAL)
+    process.wait()
+    watch.join()
+    return reason, process.returncode, watch, time.monotonic() - started
+
+
+def run_ffmpeg(cmd, description="ffmpeg 执行失败", timeout=DEFAULT_TIMEOUT, stall_timeout=DEFAULT_STALL_TIMEOUT,
+               retries=1, retry_on_failure=False, cwd=None) -> subprocess.CompletedProcess:
+    """
+    带看门狗的 ffmpeg/ffprobe 调用
+
+    ffmpeg 命令会自动加上 -progress，进度超过 stall_timeout 秒没有变化、或总时长超过 timeout 时终止进程；
+    被终止的任务最多重试 retries 次，retry_on_failure 为 True 时返回码非 0 也会重试（用于网络输入）。
+    ffprobe 等没有进度输出的命令以标准输出作为进展。
+
+    Args:
+        cmd(list): 命令与参数
+        description(str): 失败时错误信息的前缀
+        timeout(float): 单次执行的总时长上限（秒），已知媒体时长时应使用 timeout_for_duration 估算；
+            None 表示不限制
+        stall_timeout(float): 进度停止更新的时长上限（秒），None 表示不检测
+
+    Returns:
+        subprocess.CompletedProcess: stdout 为完整输出，stderr 为去掉进度信息后的输出
+
+    Raises:
+        FFmpegError: 所有尝试均失败
+    """
+    cmd = [str(arg) for arg in cmd]
+    run_cmd = _with_progress(cmd) if _is_ffmpeg(cmd) else cmd
+    attempt = 0
+    while True:
+        attempt += 1
+        reason, returncode, watch, elapsed = _run_once(run_cmd, timeout, stall_timeout, cwd)
+        if reason is None and returncode == 0:
+            return subprocess.CompletedProcess(cmd, returncode, "".join(watch.stdout), "".join(watch.stderr))
+        error = FFmpegError(description, cmd, reason or 'failed', None if reason else returncode,
+                            watch.stderr_tail(), attempt, elapsed)
+        if attempt > retries or (reason is None and not retry_on_failure):
+            raise error
+        print(f"{description}（{error.reason}），正在重试（{attempt}/{retries}）")
+
+
+def run_ffprobe(cmd, description="ffprobe 探测失败", timeout=PROBE_TIMEOUT, retries=1) -> str:
+    """ffprobe 调用，返回标准输出"""
+    return run_ffmpeg(cmd, description, timeout=timeout, stall_timeout=None, retries=retries).stdout
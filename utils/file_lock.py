@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+import contextlib
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+LOCK_DIR_NAME = ".locks"  # 锁文件统一放在产物所在目录的该子目录下，避免与产物混在一起
+LOCK_POLL_INTERVAL = 0.2
+DEFAULT_LOCK_TIMEOUT = 60 * 60  # 等待其他进程生成同一产物的最长时间（秒）
+
+
+class LockTimeoutError(TimeoutError):
+    pass
+
+
+def get_lock_path(artifact_path):
+    """产物 <dir>/<name> 对应的锁文件为 <dir>/.locks/<name>.lock"""
+    directory, name = os.path.split(os.path.abspath(artifact_path))
+    return os.path.join(directory, LOCK_DIR_NAME, f"{name}.lock")
+
+
+class FileLock:
+    """
+    基于文件的跨进程互斥锁（Windows 使用 msvcrt，其他平台使用 fcntl.flock）。
+
+    每次加锁都会单独打开锁文件，因此同一进程的不同线程之间同样互斥；
+    持有锁的进程退出时操作系统会自动释放锁，不会留下死锁。
+    """
+    def __init__(self, artifact_path, timeout=DEFAULT_LOCK_TIMEOUT, poll_interval=LOCK_POLL_INTERVAL):
+        self.lock_path = get_lock_path(artifact_path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = None
+
+    def _try_lock(self, f):
+        try:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        f = open(self.lock_path, 'a+b')
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_lock(f):
+            if deadline is not None and time.monotonic() >= deadline:
+                f.close()
+                raise LockTimeoutError(f"等待锁超时: {self.lock_path}")
+            time.sleep(self.poll_interval)
+        self._file = f
+        return self
+
+    def try_acquire(self) -> bool:
+        """不等待地尝试加锁，锁被占用时返回 False"""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        f = open(self.lock_path, 'a+b')
+        if not self._try_lock(f):
+            f.close()
+            return False
+        self._file = f
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == 'nt':
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def single_flight(artifact_path, produce, is_ready=None, timeout=DEFAULT_LOCK_TIMEOUT):
+    """
+    同一产物只由一个生产者生成，并发的请求者等待其完成后直接复用结果
+
+    Args:
+        artifact_path(path): 产物路径
+        produce(callable): 生成产物的函数，返回值作为结果
+        is_ready(callable): 判断产物是否已可用，默认检查文件是否存在
+        timeout(float): 等待其他生产者的最长时间
+
+    Returns:
+        tuple: (是否复用了已有产物, produce 的返回值或 None)
+    """
+    is_ready = is_ready or (lambda: os.path.exists(artifact_path))
+    if is_ready():
+        return True, None
+    with FileLock(artifact_path, timeout=timeout):
+        # 等待期间可能已有其他生产者完成
+        if is_ready():
+            return True, None
+        return False, produce()
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """写入临时文件后原子地替换目标文件，读取方不会看到写了一半的文件"""
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, mode, **kwargs) as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_temp_output_path(path):
+    """供 moviepy / PIL 等按扩展名识别格式的写入方使用的临时路径，扩展名保持不变"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
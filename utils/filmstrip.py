@@ -0,0 +1,123 @@
+import os
+import re
+import json
+import math
+from PIL import Image
+from utils.file_lock import single_flight, get_temp_output_path, atomic_write
+from utils.fingerprint import short_fingerprint
+from utils.media_index import get_media_info
+from utils.ffmpeg_runner import run_ffmpeg, timeout_for_duration
+from utils.download_cache import enforce_derived_quota, touch_derived
+
+FFMPEG_PATH = 'ffmpeg'
+FILMSTRIP_DIR = "./videos/filmstrips"
+FILMSTRIP_INTERVAL = 1  # 每隔多少秒取一帧
+FILMSTRIP_THUMB_HEIGHT = 72
+FILMSTRIP_COLUMNS = 20
+FILMSTRIP_QUALITY = 5  # mjpeg 的 -q:v，数值越大体积越小
+DEFAULT_FILMSTRIP_QUOTA_GB = 1
+FILMSTRIP_NAME_PATTERN = re.compile(r"^(?P<stem>.+)_(?P<fingerprint>[0-9a-f]{12})\.jpg$")
+
+
+def get_filmstrip_paths(source_path, filmstrip_dir=FILMSTRIP_DIR):
+    """缩略图拼图与索引按源文件指纹缓存，返回 (拼图路径, 索引路径)"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    base = os.path.join(filmstrip_dir, f"{stem}_{short_fingerprint(source_path)}")
+    return f"{base}.jpg", f"{base}.json"
+
+
+def build_filmstrip(source_path, interval=FILMSTRIP_INTERVAL, thumb_height=FILMSTRIP_THUMB_HEIGHT,
+                    columns=FILMSTRIP_COLUMNS, filmstrip_dir=FILMSTRIP_DIR):
+    """
+    调用一次 ffmpeg，每 interval 秒取一帧低分辨率缩略图，拼成一张拼图
+
+    索引中记录缩略图尺寸与网格排列，第 i 张缩略图对应文件中的 i * interval 秒（以文件自身为基准）。
+
+    Returns:
+        dict: 拼图索引
+    """
+    sprite_file, index_file = get_filmstrip_paths(source_path, filmstrip_dir)
+    info = get_media_info(source_path)
+    if not info or not info.get('duration') or not info.get('width') or not info.get('height'):
+        raise RuntimeError(f"无法读取视频信息: {source_path}")
+    thumb_width = round(thumb_height * info['width'] / info['height'] / 2) * 2
+    count = max(1, math.ceil(info['duration'] / interval))
+    columns = min(columns, count)
+    rows = math.ceil(count / columns)
+    index = {
+        'source': os.path.abspath(source_path),
+        'sprite': os.path.basename(sprite_file),
+        'interval': interval,
+        'count': count,
+        'columns': columns,
+        'rows': rows,
+        'thumb_width': thumb_width,
+        'thumb_height': thumb_height,
+    }
+    os.makedirs(filmstrip_dir, exist_ok=True)
+
+    def produce():
+        temp_file = get_temp_output_path(sprite_file)
+        cmd = [
+            FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error',
+            '-i', source_path,
+            '-an', '-sn',
+            '-vf', f"fps=1/{interval},scale={thumb_width}:{thumb_height},tile={columns}x{rows}",
+            '-frames:v', '1', '-q:v', str(FILMSTRIP_QUALITY),
+            temp_file
+        ]
+        try:
+            run_ffmpeg(cmd, "生成缩略图失败", timeout=timeout_for_duration(info['duration']))
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        os.replace(temp_file, sprite_file)
+        with atomic_write(index_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=4)
+
+    single_flight(sprite_file, produce,
+                  is_ready=lambda: os.path.isfile(sprite_file) and os.path.isfile(index_file))
+    return index
+
+
+def get_filmstrip(source_path, filmstrip_dir=FILMSTRIP_DIR, quota_gb=DEFAULT_FILMSTRIP_QUOTA_GB):
+    """
+    读取源文件的缩略图拼图（不存在时生成，生成后清理源文件已重新下载的旧拼图并按配额淘汰）
+
+    Returns:
+        tuple: (拼图路径, 索引)，生成失败时返回 (None, None)
+    """
+    try:
+        sprite_file, index_file = get_filmstrip_paths(source_path, filmstrip_dir)
+        if not (os.path.isfile(sprite_file) and os.path.isfile(index_file)):
+            build_filmstrip(source_path, filmstrip_dir=filmstrip_dir)
+            enforce_derived_quota(filmstrip_dir, FILMSTRIP_NAME_PATTERN, quota_gb, keep_paths=[sprite_file])
+        else:
+            touch_derived(sprite_file)
+        with open(index_file, 'r', encoding='utf-8') as f:
+            return sprite_file, json.load(f)
+    except Exception as e:
+        print(f"生成 {source_path} 的缩略图失败: {e}")
+        return None, None
+
+
+def get_filmstrip_frames(sprite_file, index, start, end, max_frames=10):
+    """
+    从拼图中裁出 [start, end] 范围内均匀分布的缩略图（时间以文件自身为基准）
+
+    Returns:
+        list: [(时间, PIL.Image)]
+    """
+    interval = index['interval']
+    first = max(0, min(index['count'] - 1, int(start // interval)))
+    last = max(first, min(index['count'] - 1, int(end // interval)))
+    step = max(1, math.ceil((last - first + 1) / max_frames))
+    width, height = index['thumb_width'], index['thumb_height']
+    frames = []
+    with Image.open(sprite_file) as sprite:
+        for i in range(first, last + 1, step):
+            row, column = divmod(i, index['columns'])
+            box = (column * width, row * height, (column + 1) * width, (row + 1) * height)
+            frames.append((i * interval, sprite.crop(box)))
+    return frames
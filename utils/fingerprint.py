@@ -0,0 +1,70 @@
+import os
+import hashlib
+import threading
+
+SAMPLE_BLOCK_SIZE = 64 * 1024  # 头、中、尾各采样的字节数
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+# (绝对路径, 大小, 修改时间, 模式) -> 指纹
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def _sample_hash(path, size) -> str:
+    """
+    采样头部、中部、尾部各一块，与文件大小一起做哈希
+
+    只读取固定的几百 KB，与文件大小无关；用于缓存键而非完整性校验。
+    采样量很小，哈希算法的速度差异可以忽略，因此直接使用标准库的 blake2b 而不引入额外依赖。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        if size <= SAMPLE_BLOCK_SIZE * 3:
+            digest.update(f.read())
+        else:
+            for offset in (0, size // 2 - SAMPLE_BLOCK_SIZE // 2, size - SAMPLE_BLOCK_SIZE):
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_BLOCK_SIZE))
+    return digest.hexdigest()
+
+
+def _full_hash(path) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FULL_HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def fingerprint(path, full=False) -> str:
+    """
+    媒体文件的内容指纹
+
+    默认为采样指纹，适合作为缓存键；full=True 时计算完整的 sha256，用于校验。
+    结果按 (路径, 大小, 修改时间) 缓存，文件未变化时只需一次 stat。
+
+    Args:
+        path(path): 文件路径
+        full(bool): 是否计算完整哈希
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, full)
+    with _memo_lock:
+        cached = _memo.get(key)
+    if cached is not None:
+        return cached
+    value = _full_hash(path) if full else _sample_hash(path, stat.st_size)
+    with _memo_lock:
+        _memo[key] = value
+    return value
+
+
+def short_fingerprint(path, length=12) -> str:
+    """用于文件名的短指纹"""
+    return fingerprint(path)[:length]
+
+
+def clear_fingerprint_cache():
+    with _memo_lock:
+        _memo.clear()
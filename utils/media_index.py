@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from utils.ffmpeg_runner import run_ffmpeg, run_ffprobe, timeout_for_duration
+
+FFPROBE_PATH = 'ffprobe'
+FFMPEG_PATH = 'ffmpeg'
+MEDIA_INDEX_DB = "./videos/media_index.db"
+PROBE_WORKERS = 8
+KEYFRAME_SCAN_TIMEOUT = 300  # 扫描关键帧需要读取整个文件的包信息
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    fps REAL,
+    vcodec TEXT,
+    acodec TEXT,
+    audio_rate INTEGER,
+    probed_at REAL
+);
+CREATE TABLE IF NOT EXISTS keyframes (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    pts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keyframes_path ON keyframes (path, pts);
+CREATE TABLE IF NOT EXISTS keyframe_scans (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    scanned_at REAL
+);
+CREATE TABLE IF NOT EXISTS loudness (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    window_start REAL NOT NULL,
+    window_end REAL NOT NULL,
+    integrated REAL,
+    peak REAL,
+    PRIMARY KEY (path, size, mtime_ns, window_start, window_end)
+);
+"""
+
+MEDIA_FIELDS = ('duration', 'width', 'height', 'fps', 'vcodec', 'acodec', 'audio_rate')
+
+
+@contextlib.contextmanager
+def _connect(db_path=MEDIA_INDEX_DB):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def _parse_rate(rate):
+    try:
+        num, den = rate.split('/')
+        return round(float(num) / float(den), 3) if float(den) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def probe_media(path) -> dict:
+    """调用一次 ffprobe，同时获取时长、分辨率、帧率与音视频编码"""
+    cmd = [FFPROBE_PATH, '-v', 'error',
+           '-show_entries', 'format=duration:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,sample_rate',
+           '-of', 'json', path]
+    data = json.loads(run_ffprobe(cmd) or "{}")
+    info = dict.fromkeys(MEDIA_FIELDS)
+    duration = data.get('format', {}).get('duration')
+    info['duration'] = float(duration) if duration not in (None, 'N/A') else None
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and info['vcodec'] is None:
+            info['vcodec'] = stream.get('codec_name')
+            info['width'] = stream.get('width')
+            info['height'] = stream.get('height')
+            info['fps'] = _parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate'))
+        elif stream.get('codec_type') == 'audio' and info['acodec'] is None:
+            info['acodec'] = stream.get('codec_name')
+            info['audio_rate'] = int(stream['sample_rate']) if stream.get('sample_rate') else None
+    return info
+
+
+def _lookup(conn, path, size, mtime_ns):
+    row = conn.execute("SELECT * FROM media WHERE path = ? AND size = ? AND mtime_ns = ?",
+                       (path, size, mtime_ns)).fetchone()
+    return {field: row[field] for field in MEDIA_FIELDS} if row else None
+
+
+def _store(conn, path, size, mtime_ns, info):
+    conn.execute(
+        f"INSERT OR REPLACE INTO media (path, size, mtime_ns, {', '.join(MEDIA_FIELDS)}, probed_at) "
+        f"VALUES (?, ?, ?, {', '.join('?' * len(MEDIA_FIELDS))}, ?)",
+        (path, size, mtime_ns, *[info.get(field) for field in MEDIA_FIELDS], time.time()))
+
+
+def get_media_info(path, db_path=MEDIA_INDEX_DB):
+    """
+    读取媒体信息（时长、分辨率、帧率、编码）
+
+    以 (路径, 大小, 修改时间) 为键缓存在 SQLite 中，文件未变化时不再启动 ffprobe。
+    文件不存在或探测失败时返回 None。
+    """
+    return get_media_info_many([path], db_path).get(path)
+
+
+def get_media_info_many(paths, db_path=MEDIA_INDEX_DB, max_workers=PROBE_WORKERS) -> dict:
+    """批量读取媒体信息，未命中索引的文件并行探测，返回 {路径: 信息}"""
+    keys = {}
+    for path in paths:
+        try:
+            keys[path] = _file_key(path)
+        except OSError:
+            continue
+
+    results, missing = {}, []
+    with _connect(db_path) as conn:
+        for path, key in keys.items():
+            info = _lookup(conn, *key)
+            if info is None:
+                missing.append(path)
+            else:
+                results[path] = info
+    if not missing:
+        return results
+
+    def probe(path):
+        try:
+            return path, probe_media(path)
+        except Exception as e:
+            print(f"探测媒体信息失败 {path}: {e}")
+            return path, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+        probed = [(path, info) for path, info in executor.map(probe, missing) if info is not None]
+    with _connect(db_path) as conn:
+        for path, info in probed:
+            _store(conn, *keys[path], info)
+            results[path] = info
+    return results
+
+
+def get_keyframes(path, db_path=MEDIA_INDEX_DB) -> list:
+    """
+    读取视频流的关键帧时间表（秒，升序），首次读取时扫描包信息并写入索引
+
+    扫描完成后在 keyframe_scans 中记录文件指纹，没有关键帧的文件同样视为已缓存，不再重复扫描。
+    """
+    abs_path, size, mtime_ns = _file_key(path)
+    with _connect(db_path) as conn:
+        scanned = conn.execute("SELECT 1 FROM keyframe_scans WHERE path = ? AND size = ? AND mtime_ns = ?",
+                               (abs_path, size, mtime_ns)).fetchone()
+        if scanned:
+            return [row['pts'] for row in conn.execute(
+                "SELECT pts FROM keyframes WHERE path = ? AND size = ? AND mtime_ns = ? ORDER BY pts",
+                (abs_path, size, mtime_ns))]
+
+    cmd = [FFPROBE_PATH, '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+    output = run_ffprobe(cmd, "ffprobe 读取关键帧失败", timeout=KEYFRAME_SCAN_TIMEOUT)
+    keyframes = []
+    for line in output.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and 'K' in fields[1]:
+            try:
+                keyframes.append(float(fields[0]))
+            except ValueError:
+                continue
+    keyframes.sort()
+
+    with _connect(db_path) as conn:
+        conn.execute("DELETE FROM keyframes WHERE path = ?", (abs_path,))
+        conn.executemany("INSERT INTO keyframes (path, size, mtime_ns, pts) VALUES (?, ?, ?, ?)",
+                         [(abs_path, size, mtime_ns, pts) for pts in keyframes])
+        conn.execute("INSERT OR REPLACE INTO keyframe_scans (path, size, mtime_ns, scanned_at) VALUES (?, ?, ?, ?)",
+                     (abs_path, size, mtime_ns, time.time()))
+    return keyframes
+
+
+def _parse_ebur128_value(pattern, text):
+    matches = re.findall(pattern, text)
+    if not matches:
+        return None
+    return float('-inf') if matches[-1] == '-inf' else float(matches[-1])
+
+
+def measure_loudness(path, start=None, end=None) -> dict:
+    """
+    使用 ffmpeg 的 ebur128 滤镜一次性测量响度
+
+    Returns:
+        dict: {'integrated': 综合响度(LUFS), 'peak': 真峰值(dBFS)}
+    """
+    cmd = [FFMPEG_PATH, '-hide_banner', '-nostats']
+    if start:
+        cmd += ['-ss', str(start)]
+    if end is not None:
+        cmd += ['-t', str(end - (start or 0))]
+    cmd += ['-i', path, '-vn', '-af', 'ebur128=peak=true', '-f', 'null', '-']
+    if end is not None:
+        duration = end - (start or 0)
+    else:
+        duration = (get_media_info(path) or {}).get('duration')
+    result = run_ffmpeg(cmd, "响度测量失败", timeout=timeout_for_duration(duration))
+    integrated = _parse_ebur128_value(r"I:\s*(-?[\d.]+|-inf) LUFS", result.stderr)
+    if integrated is None:
+        raise RuntimeError("响度测量失败: 未能解析 ebur128 输出")
+    return {'integrated': integrated,
+            'peak': _parse_ebur128_value(r"Peak:\s*(-?[\d.]+|-inf) dBFS", result.stderr)}
+
+
+def get_loudness(path, start=None, end=None, db_path=MEDIA_INDEX_DB) -> dict:
+    """读取 (文件, 时间窗口) 的响度，首次读取时测量并写入索引"""
+    abs_path, size, mtime_ns = _file_key(path)
+    window = (start or 0, end if end is not None else -1)
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT integrated, peak FROM loudness WHERE path = ? AND size = ? AND mtime_ns = ? "
+                           "AND window_start = ? AND window_end = ?",
+                           (abs_path, size, mtime_ns, *window)).fetchone()
+    if row:
+        return {'integrated': row['integrated'], 'peak': row['peak']}
+
+    loudness = measure_loudness(path, start, end)
+    with _connect(db_path) as conn:
+        conn.execute("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (abs_path, size, mtime_ns, *window, loudness['integrated'], loudness['peak']))
+    return loudness
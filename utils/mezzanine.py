@@ -0,0 +1,114 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.file_lock import single_flight, get_temp_output_path
+from utils.fingerprint import short_fingerprint
+from utils.stream_selection import get_video_window_height, DEFAULT_RENDER_FPS
+from utils.media_index import get_media_info
+from utils.ffmpeg_runner import run_ffmpeg, timeout_for_duration
+from utils.download_cache import enforce_derived_quota, touch_derived
+
+FFMPEG_PATH = 'ffmpeg'
+MEZZANINE_DIR = "./videos/mezzanine"
+MEZZANINE_GOP_SECONDS = 1  # 短 GOP，渲染时任意位置的定位只需解码很少的帧
+MEZZANINE_AUDIO_RATE = 48000
+DEFAULT_MEZZANINE_WORKERS = 2
+DEFAULT_MEZZANINE_QUOTA_GB = 20
+MEZZANINE_NAME_PATTERN = re.compile(r"^(?P<stem>.+)_\d+p\d+_(?P<fingerprint>[0-9a-f]{12})\.mp4$")
+
+
+def get_source_fingerprint(source_path) -> str:
+    """源文件的内容指纹，源文件被重新下载后会生成新的中间文件"""
+    return short_fingerprint(source_path)
+
+
+def get_mezzanine_height(resolution) -> int:
+    height = get_video_window_height(resolution)
+    return height - height % 2  # libx264 要求偶数尺寸
+
+
+def get_mezzanine_path(source_path, resolution, fps=DEFAULT_RENDER_FPS, mezzanine_dir=MEZZANINE_DIR):
+    """中间文件按 (源文件, 目标分辨率, 帧率) 缓存"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    name = f"{stem}_{get_mezzanine_height(resolution)}p{fps}_{get_source_fingerprint(source_path)}.mp4"
+    return os.path.join(mezzanine_dir, name)
+
+
+def build_mezzanine(source_path, resolution, fps=DEFAULT_RENDER_FPS, mezzanine_dir=MEZZANINE_DIR):
+    """
+    将源视频转换为便于渲染的中间文件：恒定帧率、预缩放到视频窗口高度、短 GOP、统一的音频格式
+
+    时间轴与源文件保持一致，因此片段窗口的时间换算（clip_window）同样适用于中间文件。
+
+    Returns:
+        str: 中间文件路径
+    """
+    output_file = get_mezzanine_path(source_path, resolution, fps, mezzanine_dir)
+    os.makedirs(mezzanine_dir, exist_ok=True)
+    gop = fps * MEZZANINE_GOP_SECONDS
+
+    def produce():
+        temp_file = get_temp_output_path(output_file)
+        cmd = [
+            FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error',
+            '-i', source_path,
+            '-vf', f"scale=-2:{get_mezzanine_height(resolution)},fps={fps}",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-c:a', 'aac', '-b:a', '192k', '-ar', str(MEZZANINE_AUDIO_RATE), '-ac', '2',
+            '-movflags', '+faststart',
+            temp_file
+        ]
+        info = get_media_info(source_path) or {}
+        try:
+            run_ffmpeg(cmd, "生成中间文件失败", timeout=timeout_for_duration(info.get('duration')))
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        os.replace(temp_file, output_file)
+
+    single_flight(output_file, produce)
+    return output_file
+
+
+def get_render_source(source_path, resolution, fps=DEFAULT_RENDER_FPS, mezzanine_dir=MEZZANINE_DIR):
+    """渲染时使用的视频文件：已生成对应中间文件时使用中间文件，否则使用源文件"""
+    try:
+        mezzanine = get_mezzanine_path(source_path, resolution, fps, mezzanine_dir)
+    except OSError:
+        return source_path
+    if not os.path.isfile(mezzanine):
+        return source_path
+    touch_derived(mezzanine)
+    return mezzanine
+
+
+def prepare_mezzanines(clip_configs, resolution, fps=DEFAULT_RENDER_FPS, max_workers=DEFAULT_MEZZANINE_WORKERS,
+                       mezzanine_dir=MEZZANINE_DIR, quota_gb=DEFAULT_MEZZANINE_QUOTA_GB):
+    """
+    为所有片段的源视频生成中间文件（已存在的直接复用），完成后按配额淘汰其他中间文件
+
+    Returns:
+        dict: 源文件路径 -> 中间文件路径，生成失败的源文件不包含在内
+    """
+    sources = sorted({config['video'] for config in clip_configs
+                      if config.get('video') and os.path.isfile(config['video'])})
+    prepared = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(build_mezzanine, source, resolution, fps, mezzanine_dir): source
+                   for source in sources}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                prepared[source] = future.result()
+                print(f"中间文件已就绪: {os.path.basename(prepared[source])}")
+            except Exception as e:
+                print(f"生成 {source} 的中间文件失败，渲染时将使用源文件: {e}")
+    enforce_mezzanine_quota(quota_gb, keep_paths=prepared.values(), mezzanine_dir=mezzanine_dir)
+    return prepared
+
+
+def enforce_mezzanine_quota(quota_gb=DEFAULT_MEZZANINE_QUOTA_GB, keep_paths=(), mezzanine_dir=MEZZANINE_DIR):
+    """源文件已被重新下载的中间文件直接删除，其余按最近使用时间淘汰到配额以内"""
+    return enforce_derived_quota(mezzanine_dir, MEZZANINE_NAME_PATTERN, quota_gb, keep_paths)
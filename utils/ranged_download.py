@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import httpx
+
+DEFAULT_CONNECTIONS = 4  # 单个流的并行连接数
+MIN_PART_SIZE = 4 * 1024 * 1024  # 小于该大小的流不再拆分
+CHUNK_SIZE = 256 * 1024
+JOURNAL_SAVE_INTERVAL = 1.0  # 断点记录的最短写入间隔（秒）
+PROGRESS_INTERVAL = 0.5  # 进度输出的最短间隔（秒）
+MAX_PART_RETRIES = 3
+
+
+class RangeDownloadJournal:
+    """
+    记录分段下载进度的断点文件（<输出文件>.part.json）
+
+    parts 中每一项为 [起始字节, 结束字节(含), 已下载字节数]，
+    只有总大小一致时才会沿用已有的断点记录。
+    """
+    def __init__(self, path, total_size, parts):
+        self.path = path
+        self.total_size = total_size
+        self.parts = parts
+        self._last_saved = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load_or_create(cls, path, total_size, connections):
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('total_size') == total_size:
+                    return cls(path, total_size, data['parts'])
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+        return cls(path, total_size, split_ranges(total_size, connections))
+
+    @property
+    def downloaded(self):
+        return sum(part[2] for part in self.parts)
+
+    def save(self, force=False):
+        """写入断点记录；可在线程池中调用，多个分段同时保存时互斥"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_saved < JOURNAL_SAVE_INTERVAL:
+                return
+            parts = [list(part) for part in self.parts]
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'total_size': self.total_size, 'parts': parts}, f)
+            os.replace(temp_path, self.path)
+            self._last_saved = now
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def split_ranges(total_size, connections):
+    """将 [0, total_size) 平均拆分为若干段"""
+    count = max(1, min(connections, total_size // MIN_PART_SIZE))
+    part_size = -(-total_size // count)
+    return [[start, min(start + part_size, total_size) - 1, 0]
+            for start in range(0, total_size, part_size)]
+
+
+class ProgressPrinter:
+    """限制频率的下载进度输出"""
+    def __init__(self, info, total_size):
+        self.info = info
+        self.total_size = total_size
+        self._last_print = 0
+
+    def update(self, downloaded, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_print < PROGRESS_INTERVAL:
+            return
+        self._last_print = now
+        percentage = (downloaded / self.total_size) * 100 if self.total_size else 0
+        print(f'      -- [正在从bilibili下载流: {self.info} {percentage:.2f}%]', end='\r')
+
+
+async def probe_range_support(client: httpx.AsyncClient, url: str):
+    """请求首字节以检测服务器是否支持 Range，返回 (总大小, 是否支持分段)"""
+    async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as resp:
+        resp.raise_for_status()
+        content_range = resp.headers.get('content-range', '')
+        if resp.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                return int(total), True
+        length = resp.headers.get('content-length')
+        return (int(length) if length else None), False
+
+
+def _write_chunk(f, chunk):
+    """写入并刷新到操作系统，在线程池中执行，避免磁盘阻塞共享的事件循环"""
+    f.write(chunk)
+    f.flush()
+
+
+async def _download_single(client, url, out, progress):
+    """服务器不支持 Range 时退化为单连接顺序下载"""
+    temp_path = out + ".part"
+    downloaded = 0
+    async with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        f = await asyncio.to_thread(open, temp_path, 'wb')
+        try:
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                await asyncio.to_thread(_write_chunk, f, chunk)
+                downloaded += len(chunk)
+                progress.update(downloaded)
+        finally:
+            await asyncio.to_thread(f.close)
+    os.replace(temp_path, out)
+    return downloaded
+
+
+async def _download_part(client, url, temp_path, part, journal, progress):
+    for attempt in range(MAX_PART_RETRIES + 1):
+        start, end, done = part
+        if start + done > end:
+            return
+        try:
+            headers = {"Range": f"bytes={start + done}-{end}"}
+            async with client.stream("GET", url, headers=headers) as resp:
+                if resp.status_code != 206:
+                    raise httpx.HTTPStatusError(f"分段请求返回了非预期的状态码 {resp.status_code}",
+                                                request=resp.request, response=resp)
+                f = await asyncio.to_thread(open, temp_path, 'r+b')
+                try:
+                    f.seek(start + done)
+                    async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                        # 防止服务器返回超出请求范围的数据
+                        chunk = chunk[:end + 1 - (start + part[2])]
+                        # 数据写入并刷新后才计入进度，断点记录不会超过实际写入的字节数
+                        await asyncio.to_thread(_write_chunk, f, chunk)
+                        part[2] += len(chunk)
+                        await asyncio.to_thread(journal.save)
+                        progress.update(journal.downloaded)
+                finally:
+                    await asyncio.to_thread(f.close)
+            if start + part[2] > end:
+                return
+        except (httpx.TransportError, httpx.HTTPStatusError):
+            if attempt == MAX_PART_RETRIES:
+                raise
+            await asyncio.sleep(2 ** attempt)
+    raise IOError(f"分段 {part[0]}-{part[1]} 下载不完整")
+
+
+def _preallocate(path, size):
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+async def ranged_download(client: httpx.AsyncClient, url: str, out: str, info: str,
+                          connections=DEFAULT_CONNECTIONS, stats=None):
+    """
+    多连接分段下载，支持断点续传
+
+    数据先写入预分配大小的 <out>.part 文件，进度记录在 <out>.part.json 中，
+    中断后再次调用会从断点继续；全部完成后原子地重命名为 out。
+    out 已存在且没有断点文件时视为已下载完成（如任务在下载音频流或合并时失败），大小与远端一致则直接返回。
+
+    Args:
+        client(httpx.AsyncClient): 复用的连接池
+        url(str): 下载地址
+        out(path): 输出文件
+        info(str): 进度输出中显示的名称
+        connections(int): 并行连接数
+        stats(dict): 若提供，写入首字节时间 ttfb（秒）与本次实际传输的字节数 transferred
+
+    Returns:
+        int: 文件总字节数
+    """
+    stats = stats if stats is not None else {}
+    probe_start = time.monotonic()
+    total_size, supports_range = await probe_range_support(client, url)
+    stats['ttfb'] = time.monotonic() - probe_start
+    temp_path = out + ".part"
+    journal_path = out + ".part.json"
+    if os.path.isfile(out) and not os.path.exists(temp_path) and not os.path.exists(journal_path):
+        size = os.path.getsize(out)
+        if not total_size or size == total_size:
+            print(f"      -- [已下载完成: {info}，跳过]")
+            stats['transferred'] = 0
+            return size
+    progress = ProgressPrinter(info, total_size)
+    if not supports_range or not total_size:
+        downloaded = await _download_single(client, url, out, progress)
+        stats['transferred'] = downloaded
+        progress.update(downloaded, force=True)
+        print("Done.\n")
+        return downloaded
+
+    journal = RangeDownloadJournal.load_or_create(journal_path, total_size, connections)
+    if not os.path.exists(temp_path) or os.path.getsize(temp_path) != total_size:
+        # 预分配文件大小；文件丢失或大小不符时断点记录也随之作废
+        if journal.downloaded:
+            journal = RangeDownloadJournal(journal.path, total_size, split_ranges(total_size, connections))
+        await asyncio.to_thread(_preallocate, temp_path, total_size)
+    elif journal.downloaded:
+        print(f"      -- [断点续传: {info}，已完成 {journal.downloaded / total_size * 100:.2f}%]")
+
+    resumed = journal.downloaded
+    try:
+        await asyncio.gather(*[
+            _download_part(client, url, temp_path, part, journal, progress)
+            for part in journal.parts
+        ])
+    finally:
+        await asyncio.to_thread(journal.save, True)
+        stats['transferred'] = journal.downloaded - resumed
+
+    os.replace(temp_path, out)
+    journal.remove()
+    progress.update(total_size, force=True)
+    print("Done.\n")
+    return total_size
@@ -0,0 +1,138 @@
+import os
+import shutil
+from PIL import Image, ImageFont
+from utils.clip_window import to_local_time
+from utils.media_index import get_media_info_many
+
+REQUIRED_BG_CLIPS = ["./images/BgClips/bg.mp4", "./images/BgClips/black_bg.mp4"]
+DISK_SPACE_MARGIN = 1.5  # 预估输出大小的余量倍数
+DEFAULT_AUDIO_BITRATE_KBPS = 192
+
+
+class ValidationReport:
+    """渲染前检查的结果，errors 不为空时不应开始渲染"""
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def error(self, clip_id, message):
+        self.errors.append({'clip_id': clip_id, 'message': message})
+
+    def warning(self, clip_id, message):
+        self.warnings.append({'clip_id': clip_id, 'message': message})
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def format_lines(self):
+        lines = [f"[错误] {item['clip_id']}: {item['message']}" for item in self.errors]
+        lines += [f"[警告] {item['clip_id']}: {item['message']}" for item in self.warnings]
+        return lines
+
+
+def _parse_bitrate_kbps(bitrate) -> float:
+    """支持 5000、'5000k'、'5M' 等写法"""
+    text = str(bitrate).strip().lower()
+    if text.endswith('m'):
+        return float(text[:-1]) * 1000
+    if text.endswith('k'):
+        return float(text[:-1])
+    return float(text) if text else 0
+
+
+def _check_image(report, clip_id, image_path, resolution):
+    if not image_path or not os.path.isfile(image_path):
+        report.error(clip_id, f"图片不存在: {image_path}")
+        return
+    try:
+        # 只读取文件头，不解码像素
+        with Image.open(image_path) as image:
+            width, height = image.size
+    except Exception as e:
+        report.error(clip_id, f"无法读取图片 {image_path}: {e}")
+        return
+    if abs(width / height - resolution[0] / resolution[1]) > 0.01:
+        report.warning(clip_id, f"图片比例 {width}x{height} 与输出分辨率 {resolution[0]}x{resolution[1]} 不一致，将被拉伸")
+    elif height < resolution[1]:
+        report.warning(clip_id, f"图片分辨率 {width}x{height} 低于输出分辨率，将被放大")
+
+
+def _check_video_clip(report, config, media_info):
+    clip_id = config['id']
+    video_path = config.get('video')
+    if not video_path or not os.path.isfile(video_path):
+        report.error(clip_id, f"视频文件不存在: {video_path}")
+        return
+    if media_info is None or not media_info.get('duration'):
+        report.error(clip_id, f"无法读取视频信息: {video_path}")
+        return
+    if 'start' not in config or 'end' not in config:
+        report.error(clip_id, "缺少 start/end 配置")
+        return
+    local_start = to_local_time(video_path, config['start'])
+    local_end = to_local_time(video_path, config['end'])
+    duration = media_info['duration']
+    if local_start < 0 or local_start >= duration:
+        report.error(clip_id, f"开始时间 {config['start']} 超出视频长度")
+    elif local_end <= local_start or local_end > duration:
+        report.error(clip_id, f"结束时间 {config['end']} 无效（视频长度 {duration:.1f} 秒）")
+    if config.get('duration') and abs((config['end'] - config['start']) - config['duration']) > 1:
+        report.warning(clip_id, f"duration {config['duration']} 与 end - start 不一致")
+
+
+def validate_video_configs(video_configs, resolution, font_path, output_dir, video_bitrate=None):
+    """
+    渲染前检查 video_configs.json 中的所有片段
+
+    检查视频与图片是否存在、start/end 是否在视频长度范围内、图片尺寸、字体是否可用、
+    以及输出目录的剩余空间；视频信息来自媒体索引，不会打开视频文件。
+
+    Args:
+        video_configs(dict): 视频配置（intro/main/ending）
+        resolution(tuple): 输出分辨率
+        font_path(path): 字体文件
+        output_dir(path): 输出目录
+        video_bitrate: 视频码率（如 '5000k'），用于估算输出大小
+
+    Returns:
+        ValidationReport: 完整的检查结果
+    """
+    report = ValidationReport()
+    if not video_configs or not video_configs.get('main'):
+        report.error("main", "配置中没有主视频片段")
+        return report
+
+    try:
+        ImageFont.truetype(font_path, 32)
+    except Exception as e:
+        report.error("font", f"无法加载字体 {font_path}: {e}")
+
+    for bg_clip in REQUIRED_BG_CLIPS:
+        if not os.path.isfile(bg_clip):
+            report.error("background", f"背景视频不存在: {bg_clip}")
+
+    main_configs = video_configs['main']
+    media_infos = get_media_info_many([config['video'] for config in main_configs
+                                       if config.get('video') and os.path.isfile(config['video'])])
+    for config in main_configs:
+        _check_image(report, config['id'], config.get('main_image'), resolution)
+        _check_video_clip(report, config, media_infos.get(config.get('video')))
+
+    total_duration = 0
+    for section in ('intro', 'main', 'ending'):
+        for config in video_configs.get(section, []):
+            total_duration += config.get('duration') or 0
+
+    if video_bitrate:
+        estimated = (_parse_bitrate_kbps(video_bitrate) + DEFAULT_AUDIO_BITRATE_KBPS) * 1000 / 8 * total_duration
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            free = shutil.disk_usage(output_dir).free
+            if free < estimated * DISK_SPACE_MARGIN:
+                report.error("output", f"输出目录剩余空间 {free / 1024 ** 3:.1f}GB，"
+                                       f"预计需要约 {estimated * DISK_SPACE_MARGIN / 1024 ** 3:.1f}GB")
+        except OSError as e:
+            report.error("output", f"无法访问输出目录 {output_dir}: {e}")
+
+    return report
@@ -0,0 +1,168 @@
+import os
+import uuid
+import errno
+import shutil
+import threading
+import contextlib
+
+TMPFS_ROOT = "/dev/shm"  # Linux 下的内存文件系统
+DISK_SCRATCH_ROOT = "./videos/.scratch"
+TMPFS_MIN_FREE_GB = 4  # 内存文件系统剩余空间不少于该值时才使用
+DEFAULT_SCRATCH_LIMIT_GB = 20
+
+
+class ScratchLimitError(RuntimeError):
+    pass
+
+
+def get_dir_size(path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _free_bytes(path) -> int:
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+
+class ScratchSpace:
+    """一个作用域内的临时目录"""
+    def __init__(self, manager, path, stage):
+        self.manager = manager
+        self.path = path
+        self.stage = stage
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def usage(self) -> int:
+        """当前占用的字节数；同时更新峰值并检查总量限制"""
+        return self.manager.checkpoint()
+
+
+class ScratchManager:
+    """
+    中间文件的临时空间管理。
+
+    每个阶段通过 `scratch_dir` 申请独立的临时目录，离开作用域时（包括异常）一定会被删除；
+    未指定根目录时，内存文件系统剩余空间充足则使用 tmpfs，否则使用磁盘上的目录。
+    所有活动目录的总大小受 limit 限制，并记录峰值占用。
+    """
+    def __init__(self, root=None, limit_gb=DEFAULT_SCRATCH_LIMIT_GB, min_tmpfs_free_gb=TMPFS_MIN_FREE_GB):
+        self.limit_bytes = limit_gb * 1024 ** 3 if limit_gb else None
+        self.root = root or self._pick_root(min_tmpfs_free_gb)
+        self.peak_usage = 0
+        self._active = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pick_root(min_tmpfs_free_gb):
+        if os.path.isdir(TMPFS_ROOT) and _free_bytes(TMPFS_ROOT) >= min_tmpfs_free_gb * 1024 ** 3:
+            return os.path.join(TMPFS_ROOT, "chu-gen-scratch")
+        return DISK_SCRATCH_ROOT
+
+    def current_usage(self) -> int:
+        with self._lock:
+            paths = list(self._active)
+        return sum(get_dir_size(path) for path in paths)
+
+    def checkpoint(self) -> int:
+        usage = self.current_usage()
+        with self._lock:
+            self.peak_usage = max(self.peak_usage, usage)
+        if self.limit_bytes and usage > self.limit_bytes:
+            raise ScratchLimitError(f"临时空间占用 {usage / 1024 ** 3:.2f}GB 超出限制 "
+                                    f"{self.limit_bytes / 1024 ** 3:.2f}GB")
+        return usage
+
+    def _root_for(self, size_hint):
+        """预计大小放不下时退回磁盘目录"""
+        if size_hint and self.root != DISK_SCRATCH_ROOT:
+            os.makedirs(self.root, exist_ok=True)
+            if _free_bytes(self.root) < size_hint:
+                return DISK_SCRATCH_ROOT
+        return self.root
+
+    @contextlib.contextmanager
+    def scratch_dir(self, stage, size_hint=0):
+        """
+        申请一个临时目录
+
+        Args:
+            stage(str): 阶段名称，用于目录命名
+            size_hint(int): 预计占用的字节数，用于选择位置与提前检查限制
+        """
+        if self.limit_bytes and size_hint and self.current_usage() + size_hint > self.limit_bytes:
+            raise ScratchLimitError(f"{stage} 预计需要 {size_hint / 1024 ** 3:.2f}GB 临时空间，超出限制")
+        root = self._root_for(size_hint)
+        path = os.path.abspath(os.path.join(root, f"{stage}-{os.getpid()}-{uuid.uuid4().hex[:8]}"))
+        os.makedirs(path)
+        with self._lock:
+            self._active[path] = stage
+        try:
+            yield ScratchSpace(self, path, stage)
+            self.checkpoint()
+        finally:
+            with self._lock:
+                self._active.pop(path, None)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def report(self) -> str:
+        return f"临时空间位置: {self.root}，峰值占用 {self.peak_usage / 1024 ** 2:.1f} MB"
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def configure_scratch(root=None, limit_gb=DEFAULT_SCRATCH_LIMIT_GB):
+    """设置临时空间的位置与限制（root 为空时自动选择），之后的 get_scratch_manager 返回新的实例"""
+    global _manager
+    with _manager_lock:
+        _manager = ScratchManager(root or None, limit_gb)
+    return _manager
+
+
+def get_scratch_manager() -> ScratchManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ScratchManager()
+        return _manager
+
+
+def scratch_dir(stage, size_hint=0):
+    return get_scratch_manager().scratch_dir(stage, size_hint)
+
+
+def move_into_place(temp_path, output_path):
+    """
+    将临时空间中的文件移动到输出位置
+
+    同一文件系统时直接原子替换；跨文件系统（例如临时空间位于 tmpfs）时先复制到输出目录下的临时文件，再原子替换，
+    其他进程不会读到复制了一半的文件。
+    """
+    try:
+        os.replace(temp_path, output_path)
+        return output_path
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    stem, ext = os.path.splitext(output_path)
+    staging = f"{stem}.{os.getpid()}-{threading.get_ident()}.tmp{ext}"
+    try:
+        shutil.copyfile(temp_path, staging)
+        os.replace(staging, output_path)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    os.remove(temp_path)
+    return output_path
@@ -0,0 +1,173 @@
+from bilibili_api import video
+
+# 视频画面在成品中占输出高度的比例（见 gene_video.create_video_segment）
+VIDEO_WINDOW_HEIGHT_RATIO = 0.667
+DEFAULT_RENDER_FPS = 60
+
+# bilibili 清晰度对应的 (高度, 帧率)
+BILIBILI_QUALITY_SIZES = {
+    video.VideoQuality._360P: (360, 30),
+    video.VideoQuality._480P: (480, 30),
+    video.VideoQuality._720P: (720, 30),
+    video.VideoQuality._1080P: (1080, 30),
+    video.VideoQuality._1080P_PLUS: (1080, 30),
+    video.VideoQuality._1080P_60: (1080, 60),
+    video.VideoQuality._4K: (2160, 30),
+    video.VideoQuality._8K: (4320, 30),
+}
+
+# 编码的处理代价，越小越优先：AVC 可直接被 moviepy 快速解码，其余编码解码慢或需要转码
+CODEC_COST = {
+    'h264': 0,
+    'hevc': 1,
+    'vp9': 2,
+    'vp8': 2,
+    'av1': 3,
+}
+UNKNOWN_CODEC_COST = 4
+# 下载后仍需转码为 H.264 的编码（与 encoding_translation 保持一致）
+CODECS_NEEDING_TRANSCODE = ('av1', 'vp8', 'vp9')
+# bilibili 编码偏好顺序，越前面越优先
+BILIBILI_CODEC_PREFERENCE = [video.VideoCodecs.AVC, video.VideoCodecs.HEV, video.VideoCodecs.AV1]
+
+
+def normalize_codec(codec) -> str:
+    """将 bilibili / YouTube 的编码标识（如 avc1.640028、hev1、av01.0.08M.08、vp09）统一为 ffprobe 的编码名"""
+    if not codec:
+        return ""
+    codec = str(getattr(codec, 'value', codec)).lower()
+    if codec.startswith(('avc', 'h264')):
+        return 'h264'
+    if codec.startswith(('hev', 'hvc', 'hevc', 'h265')):
+        return 'hevc'
+    if codec.startswith(('av01', 'av1')):
+        return 'av1'
+    if codec.startswith(('vp09', 'vp9')):
+        return 'vp9'
+    if codec.startswith(('vp08', 'vp8')):
+        return 'vp8'
+    return codec
+
+
+def get_codec_cost(codec) -> int:
+    return CODEC_COST.get(normalize_codec(codec), UNKNOWN_CODEC_COST)
+
+
+def get_video_window_height(render_res) -> int:
+    """成品中视频画面的实际高度（像素）"""
+    return int(VIDEO_WINDOW_HEIGHT_RATIO * render_res[1])
+
+
+def get_stream_target(render_res, render_fps=DEFAULT_RENDER_FPS) -> dict:
+    """根据渲染分辨率与帧率计算下载流需要满足的最低规格"""
+    return {'height': get_video_window_height(render_res), 'fps': render_fps}
+
+
+def pick_smallest_adequate(candidates, target):
+    """
+    从 (高度, 帧率, 编码, 流) 候选中选择满足目标规格、编码代价最低的最小流；
+    只有不存在满足分辨率的 AVC 流时才会选择其他编码。
+    没有满足的流时退而选择最大的流。帧率只在候选中存在满足要求的流时才作为硬性条件。
+    """
+    if not candidates:
+        return None
+    max_fps = max(c[1] for c in candidates)
+    need_fps = min(target['fps'], max_fps)
+    adequate = [c for c in candidates if c[0] >= target['height'] and c[1] >= need_fps]
+    if adequate:
+        return min(adequate, key=lambda c: (get_codec_cost(c[2]), c[0], c[1]))
+    return min(candidates, key=lambda c: (-c[0], -c[1], get_codec_cost(c[2])))
+
+
+def select_bilibili_streams(detecter, target=None):
+    """
+    选择 bilibili 的视频流与音频流
+
+    Args:
+        detecter(VideoDownloadURLDataDetecter): 下载地址解析器
+        target(dict): get_stream_target 返回的目标规格，为 None 时选择最佳流
+
+    Returns:
+        tuple: ([视频流, 音频流], 选择信息字典)
+    """
+    best_streams = detecter.detect_best_streams(codecs=BILIBILI_CODEC_PREFERENCE, no_dolby_video=True, no_hdr=True)
+    if detecter.check_flv_stream():
+        return best_streams, {}
+    if target is None:
+        return best_streams, describe_bilibili_stream(best_streams[0])
+
+    candidates = []
+    for stream in detecter.detect_all():
+        if isinstance(stream, video.VideoStreamDownloadURL) and stream.video_quality in BILIBILI_QUALITY_SIZES:
+            height, fps = BILIBILI_QUALITY_SIZES[stream.video_quality]
+            candidates.append((height, fps, normalize_codec(stream.video_codecs), stream))
+    chosen = pick_smallest_adequate(candidates, target)
+    if chosen is None:
+        return best_streams, describe_bilibili_stream(best_streams[0])
+
+    height, fps, codec, stream = chosen
+    max_height = max(c[0] for c in candidates)
+    return [stream, best_streams[1]], {
+        'height': height,
+        'fps': fps,
+        'codec': codec,
+        'quality': stream.video_quality.name,
+        'is_best_available': height >= max_height,
+    }
+
+
+def describe_bilibili_stream(stream) -> dict:
+    """生成 bilibili 视频流的选择信息（未按目标规格挑选时使用）"""
+    if not isinstance(stream, video.VideoStreamDownloadURL):
+        return {}
+    info = {'codec': normalize_codec(stream.video_codecs), 'quality': stream.video_quality.name}
+    if stream.video_quality in BILIBILI_QUALITY_SIZES:
+        info['height'], info['fps'] = BILIBILI_QUALITY_SIZES[stream.video_quality]
+    return info
+
+
+def select_youtube_streams(yt, target=None):
+    """
+    选择 YouTube 的自适应视频流与音频流
+
+    Returns:
+        tuple: ([视频流, 音频流], 选择信息字典)
+    """
+    video_streams = yt.streams.filter(adaptive=True, file_extension='mp4', only_video=True)
+    audio = yt.streams.filter(only_audio=True).first()
+
+    candidates = []
+    for stream in video_streams:
+        if stream.resolution:
+            candidates.append((int(stream.resolution.rstrip('p')), stream.fps or 30,
+                               normalize_codec(stream.video_codec), stream))
+    if not candidates:
+        return [video_streams.order_by('resolution').desc().first(), audio], {}
+    # 未指定目标时选择最高分辨率中编码代价最低的流
+    chosen = pick_smallest_adequate(candidates, target or {'height': float('inf'), 'fps': 0})
+
+    height, fps, codec, stream = chosen
+    max_height = max(c[0] for c in candidates)
+    return [stream, audio], {
+        'height': height,
+        'fps': fps,
+        'codec': codec,
+        'quality': stream.resolution,
+        'is_best_available': height >= max_height,
+    }
+
+
+def record_needs_transcode(record):
+    """根据下载记录判断是否需要转码；记录中没有编码信息时返回 None，由调用方自行探测"""
+    if not record or not record.get('codec'):
+        return None
+    return record['codec'] in CODECS_NEEDING_TRANSCODE
+
+
+def needs_upgrade(record, target) -> bool:
+    """已下载的流是否低于目标规格且有可能获取更高规格"""
+    if not record or not target or 'height' not in record:
+        return False
+    if record.get('is_best_available'):
+        return False
+    return record['height'] < target['height']
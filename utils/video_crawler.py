@@ -1,28 +1,41 @@
 from pytubefix import YouTube, Search
-from bilibili_api import login, user, search, video, Credential, sync, HEADERS
+from bilibili_api import login, user, search, video, Credential, HEADERS
 from bilibili_api.video import Video
 from typing import Tuple
 from abc import ABC, abstractmethod
 import os
 import yaml
 import json
-import asyncio
 import pickle
-import httpx
 import traceback
 import subprocess
-import platform
 import re
-
-# 根据操作系统选择FFMPEG的输出重定向方式
-# TODO：添加日志输出
-if platform.system() == "Windows":
-    REDIRECT = "> NUL 2>&1"
-else:
-    REDIRECT = "> /dev/null 2>&1"
+import time
+import asyncio
+import shutil
+import contextlib
+import threading
+from utils.bili_client import bili_sync, bili_submit, get_http_client
+from utils.ranged_download import ranged_download
+from utils.clip_window import save_window_info, remove_window_info
+from utils.stream_selection import select_bilibili_streams, select_youtube_streams, describe_bilibili_stream, \
+    normalize_codec, BILIBILI_CODEC_PREFERENCE
+from utils.download_cache import record_download
+from utils.download_telemetry import record_transfer, measure_transfer, measure_merge, get_url_host
+from utils.scratch import scratch_dir, move_into_place
+from utils.ffmpeg_runner import run_ffmpeg, run_ffprobe, timeout_for_duration
+from utils.circuit_breaker import RiskControlError, get_circuit_breaker, is_risk_control_error, is_risk_control_response
 
 FFMPEG_PATH = 'ffmpeg'
+FFPROBE_PATH = 'ffprobe'
+# 可直接流复制到 MP4 容器的编码
+MP4_COPY_VIDEO_CODECS = ('h264', 'hevc')
+MP4_COPY_AUDIO_CODECS = ('aac', 'mp3')
 MAX_LOGIN_RETRIES = 3
+CREDENTIAL_CACHE_TTL = 6 * 60 * 60  # 凭证校验结果的缓存有效期（秒）
+CREDENTIAL_REFRESH_AHEAD = 0.5  # 缓存使用超过有效期的该比例后，在后台提前重新校验
+PO_TOKEN_CACHE_TTL = 6 * 60 * 60  # PO Token 的默认缓存有效期（秒）
+PO_TOKEN_CACHE_FILE = "./cred_datas/po_token_cache.json"
 
 def custom_po_token_verifier() -> Tuple[str, str]:
 
@@ -67,6 +80,101 @@ def autogen_po_token_verifier() -> Tuple[str, str]:
     
     return output["visitorData"], output["poToken"]
 
+class POTokenProvider:
+    """
+    带缓存的 PO Token 提供器，可直接作为 pytubefix 的 po_token_verifier 使用。
+
+    (visitor_data, po_token) 同时缓存在内存与磁盘中，在有效期内不再重新生成；
+    并发请求通过锁共享同一次生成，避免每次 Search / YouTube 都启动一次 node 进程。
+    """
+    def __init__(self, generator, lifetime=PO_TOKEN_CACHE_TTL, cache_file=PO_TOKEN_CACHE_FILE, cache_key="auto"):
+        self._generator = generator
+        self.lifetime = lifetime
+        self._cache_file = cache_file  # 为 None 时只缓存在内存中
+        self._cache_key = cache_key
+        self._token = None
+        self._created_at = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, created_at):
+        return time.time() - created_at < self.lifetime
+
+    def _load_disk_cache(self):
+        if not self._cache_file or not os.path.isfile(self._cache_file):
+            return None
+        try:
+            with open(self._cache_file, 'r', encoding='utf-8') as f:
+                entry = json.load(f).get(self._cache_key)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if not entry or not self._is_fresh(entry['created_at']):
+            return None
+        return entry
+
+    def _save_disk_cache(self):
+        if not self._cache_file:
+            return
+        try:
+            data = {}
+            if os.path.isfile(self._cache_file):
+                with open(self._cache_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            data[self._cache_key] = {
+                'visitor_data': self._token[0],
+                'po_token': self._token[1],
+                'created_at': self._created_at
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(self._cache_file)), exist_ok=True)
+            temp_file = self._cache_file + ".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(temp_file, self._cache_file)
+        except Exception as e:
+            print(f"写入PO Token缓存失败: {e}")
+
+    def invalidate(self):
+        """丢弃当前缓存的 PO Token，下次调用时重新生成"""
+        with self._lock:
+            self._token = None
+            self._created_at = 0
+
+    def __call__(self) -> Tuple[str, str]:
+        with self._lock:
+            if self._token and self._is_fresh(self._created_at):
+                return self._token
+
+            entry = self._load_disk_cache()
+            if entry:
+                self._token = (entry['visitor_data'], entry['po_token'])
+                self._created_at = entry['created_at']
+                return self._token
+
+            visitor_data, po_token = self._generator()
+            if not visitor_data or not po_token:
+                # 生成失败时不缓存，下次调用会重试
+                return visitor_data, po_token
+            self._token = (visitor_data, po_token)
+            self._created_at = time.time()
+            self._save_disk_cache()
+            return self._token
+
+_po_token_providers = {}
+_po_token_providers_lock = threading.Lock()
+
+def get_po_token_provider(auto_get_potoken, lifetime=PO_TOKEN_CACHE_TTL) -> POTokenProvider:
+    """获取进程内共享的 PO Token 提供器，使不同下载器实例也共用同一份缓存"""
+    with _po_token_providers_lock:
+        provider = _po_token_providers.get(auto_get_potoken)
+        if provider is None:
+            if auto_get_potoken:
+                provider = POTokenProvider(autogen_po_token_verifier, lifetime)
+            else:
+                # 自定义 PO Token 已保存在 global_config.yaml 中，只需缓存在内存以免重复读取配置
+                provider = POTokenProvider(custom_po_token_verifier, lifetime, cache_file=None, cache_key="custom")
+            _po_token_providers[auto_get_potoken] = provider
+        provider.lifetime = lifetime
+        return provider
+
 def remove_html_tags_and_invalid_chars(text: str) -> str:
     """去除字符串中的HTML标记和非法字符"""
     # 去除HTML标记
@@ -86,7 +194,73 @@ def convert_duration_to_seconds(duration: str) -> int:
     except:
         return int(duration)
 
-def load_credential(credential_path):
+def get_credential_status_path(credential_path):
+    """凭证校验结果缓存文件，与凭证文件放在同一目录下"""
+    return os.path.splitext(credential_path)[0] + "_status.json"
+
+def load_credential_status(credential_path):
+    """读取凭证校验结果缓存，凭证文件被重新写入（重新登录）后缓存自动失效"""
+    status_path = get_credential_status_path(credential_path)
+    if not os.path.isfile(status_path) or not os.path.isfile(credential_path):
+        return None
+    try:
+        with open(status_path, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if status.get('cred_mtime') != os.path.getmtime(credential_path):
+        return None
+    return status
+
+def save_credential_status(credential_path, valid, username=None):
+    status = {
+        'valid': valid,
+        'username': username,
+        'checked_at': time.time(),
+        'cred_mtime': os.path.getmtime(credential_path),
+    }
+    status_path = get_credential_status_path(credential_path)
+    temp_path = status_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, ensure_ascii=False, indent=4)
+    os.replace(temp_path, status_path)
+    return status
+
+async def validate_credential(credential, credential_path):
+    """联网校验凭证（必要时刷新并重新缓存），并将校验结果写入缓存"""
+    is_valid = await credential.check_valid()
+    if not is_valid:
+        return save_credential_status(credential_path, False)
+
+    need_refresh = await credential.check_refresh()
+    if need_refresh:
+        print("#####【bilibili】正在尝试刷新登录凭证。")
+        await credential.refresh()
+        with open(credential_path, 'wb') as f:
+            pickle.dump(credential, f)
+
+    username = (await user.get_self_info(credential))['name']
+    return save_credential_status(credential_path, True, username)
+
+_revalidating_credentials = set()
+_revalidating_lock = threading.Lock()
+
+def schedule_credential_revalidation(credential, credential_path):
+    """在后台事件循环中提前重新校验凭证，不阻塞调用方"""
+    with _revalidating_lock:
+        if credential_path in _revalidating_credentials:
+            return
+        _revalidating_credentials.add(credential_path)
+
+    def on_done(future):
+        with _revalidating_lock:
+            _revalidating_credentials.discard(credential_path)
+        if future.exception() is not None:
+            print(f"#####【bilibili】后台校验登录凭证失败: {future.exception()}")
+
+    bili_submit(validate_credential(credential, credential_path)).add_done_callback(on_done)
+
+def load_credential(credential_path, cache_ttl=CREDENTIAL_CACHE_TTL):
     if not os.path.isfile(credential_path):
         print("#####【bilibili】未找到登录凭证，请在终端扫码登录（按住 Ctrl + 滚轮缩小终端文字大小以便扫描二维码）")
         return None
@@ -109,39 +283,183 @@ def load_credential(credential_path):
             print("#####【bilibili】登录凭证无效，请在终端重新扫码登录（按住 Ctrl + 滚轮缩小终端文字大小以便扫描二维码）")
             return False
         
+        # 缓存的校验结果仍在有效期内时，直接使用缓存，不发起网络请求
+        status = load_credential_status(credential_path)
+        if status and status['valid']:
+            age = time.time() - status['checked_at']
+            if age < cache_ttl:
+                # 缓存即将过期时，在后台提前重新校验
+                if age > cache_ttl * CREDENTIAL_REFRESH_AHEAD:
+                    schedule_credential_revalidation(credential, credential_path)
+                print(f"#####【bilibili】缓存登录成功：{status['username']}】")
+                return credential
+
         # 验证凭证的有效性
-        is_valid = sync(credential.check_valid())
-        if not is_valid:
-            print("#####【bilibili】登录凭证无效，请在终端重新扫码登录（按住 Ctrl + 滚轮缩小终端文字大小以便扫描二维码）")
-            return None
         try:
-            need_refresh = sync(credential.check_refresh())
-            if need_refresh:
-                print("#####【bilibili】正在尝试刷新登录凭证。")
-                sync(credential.refresh())
+            status = bili_sync(validate_credential(credential, credential_path))
         except:
             traceback.print_exc()
             print("#####【【bilibili】刷新登录凭证失败，请在终端重新扫码登录（按住 Ctrl + 滚轮缩小终端文字大小以便扫描二维码）")
             return None
+        if not status['valid']:
+            print("#####【bilibili】登录凭证无效，请在终端重新扫码登录（按住 Ctrl + 滚轮缩小终端文字大小以便扫描二维码）")
+            return None
         
-        print(f"#####【bilibili】缓存登录成功：{sync(user.get_self_info(credential))['name']}】")
+        print(f"#####【bilibili】缓存登录成功：{status['username']}】")
         return credential
 
-async def download_url_from_bili(url: str, out: str, info: str):
-    async with httpx.AsyncClient(headers=HEADERS) as sess:
-        resp = await sess.get(url)
-        length = resp.headers.get('content-length')
-        with open(out, 'wb') as f:
-            process = 0
-            for chunk in resp.iter_bytes(1024):
-                if not chunk:
-                    break
-
-                process += len(chunk)
-                percentage = (process / int(length)) * 100 if length else 0
-                print(f'      -- [正在从bilibili下载流: {info} {percentage:.2f}%]', end='\r')
-                f.write(chunk)
-        print("Done.\n")
+def create_job_workspace(output_path, output_name, resumable=False):
+    """
+    为单个下载任务创建独立的临时目录
+
+    非续传任务的目录由临时空间管理（可能位于 tmpfs），任务结束（包括失败）后自动清理，
+    结果文件通过 move_into_place 移动到输出位置。
+    resumable 为 True 时目录位于输出目录下且名称固定，断点文件需要在重启后保留，
+    任务失败后保留其中的断点文件以便下次续传，只在任务成功后删除。
+    """
+    if not resumable:
+        return _scratch_workspace(output_name)
+    work_root = os.path.join(output_path, ".work")
+    os.makedirs(work_root, exist_ok=True)
+    return _resumable_workspace(os.path.join(work_root, output_name))
+
+@contextlib.contextmanager
+def _scratch_workspace(output_name):
+    with scratch_dir("download") as scratch:
+        yield scratch.path
+
+@contextlib.contextmanager
+def _resumable_workspace(workspace):
+    os.makedirs(workspace, exist_ok=True)
+    yield workspace
+    shutil.rmtree(workspace, ignore_errors=True)
+
+def run_ffmpeg_mux(inputs, output_file, codec_args=None, input_args=None, retry_on_failure=False, duration=None):
+    """
+    调用 ffmpeg 合并/转封装音视频，卡住或超时时终止并重试，失败时抛出 FFmpegError
+
+    Args:
+        inputs(list): 输入文件（或地址）列表
+        output_file(path): 输出文件
+        codec_args(list): 编码相关参数，如 ['-c', 'copy']
+        input_args(list): 与 inputs 一一对应的输入参数列表，如 [['-ss', '10'], []]
+        retry_on_failure(bool): 返回码非 0 时是否重试（输入为网络地址时使用）
+        duration(float): 输出的媒体时长（秒），用于估算总时长上限
+    """
+    cmd = [FFMPEG_PATH, '-y', '-hide_banner', '-loglevel', 'error']
+    for i, input_file in enumerate(inputs):
+        if input_args:
+            cmd += input_args[i]
+        cmd += ['-i', input_file]
+    cmd += (codec_args or []) + [output_file]
+    run_ffmpeg(cmd, "ffmpeg 合并失败", timeout=timeout_for_duration(duration), retry_on_failure=retry_on_failure)
+    return output_file
+
+def probe_stream_codecs(file_path):
+    """
+    使用 ffprobe 获取文件中首个视频流与音频流的编码
+
+    Returns:
+        dict: {'video': 编码名, 'audio': 编码名}，不存在的流为 None
+    """
+    cmd = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'stream=codec_type,codec_name', '-of', 'json', file_path]
+    codecs = {'video': None, 'audio': None}
+    for stream in json.loads(run_ffprobe(cmd)).get('streams', []):
+        codec_type = stream.get('codec_type')
+        if codec_type in codecs and codecs[codec_type] is None:
+            codecs[codec_type] = stream.get('codec_name')
+    return codecs
+
+def get_mp4_remux_args(codecs):
+    """兼容 MP4 的流直接复制，不兼容的流才使用快速预设重新编码"""
+    if codecs['video'] in MP4_COPY_VIDEO_CODECS:
+        video_args = ['-c:v', 'copy']
+    else:
+        video_args = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20', '-pix_fmt', 'yuv420p']
+    if codecs['audio'] is None or codecs['audio'] in MP4_COPY_AUDIO_CODECS:
+        audio_args = ['-c:a', 'copy']
+    else:
+        audio_args = ['-c:a', 'aac', '-b:a', '192k']
+    return video_args + audio_args + ['-movflags', '+faststart']
+
+def remux_flv_to_mp4(flv_file, output_file, duration=None):
+    """
+    将 FLV 转封装为 MP4：H.264/AAC 直接流复制，只有编码不兼容时才重新编码
+
+    Returns:
+        str: 输出文件的视频编码
+    """
+    codecs = probe_stream_codecs(flv_file)
+    codec_args = get_mp4_remux_args(codecs)
+    if 'copy' not in codec_args[:2]:
+        print(f"FLV 视频编码 {codecs['video']} 无法直接封装为 MP4，将重新编码")
+    run_ffmpeg_mux([flv_file], output_file, codec_args, duration=duration)
+    return codecs['video'] if codecs['video'] in MP4_COPY_VIDEO_CODECS else 'h264'
+
+def download_window_ffmpeg(urls, output_file, window, headers=None):
+    """
+    只下载 [window[0], window[1]] 时间窗口内的数据
+
+    ffmpeg 对 HTTP 输入使用 Range 请求进行定位，因此只会拉取覆盖该窗口的分段；
+    输出使用流复制，不重新编码，因此实际从 window[0] 之前最近的关键帧开始。
+    下载时保留原视频的时间戳，探测出实际起点后再转封装为从 0 开始的文件。
+
+    Args:
+        urls(list): 流地址列表，DASH 时为 [视频流, 音频流]，FLV/渐进式时为单个地址
+        output_file(path): 输出文件
+        window(tuple): (开始秒数, 结束秒数)
+        headers(dict): 请求头
+
+    Returns:
+        float: 输出文件的 0 秒在原视频中对应的秒数，应作为窗口信息的 source_offset
+    """
+    window_start, window_end = window
+    input_args = []
+    for _ in urls:
+        args = ['-ss', str(window_start), '-t', str(window_end - window_start)]
+        if headers:
+            args = ['-headers', "".join(f"{k}: {v}\r\n" for k, v in headers.items())] + args
+        input_args.append(args)
+    if len(urls) > 1:
+        stream_maps = ['-map', '0:v:0', '-map', '1:a:0']
+    else:
+        stream_maps = ['-map', '0:v:0', '-map', '0:a:0?']
+    # -copyts -start_at_zero: 输出时间戳即原视频中的时间
+    copyts_file = os.path.splitext(output_file)[0] + ".copyts.mkv"
+    try:
+        run_ffmpeg_mux(urls, copyts_file, stream_maps + ['-c', 'copy', '-copyts', '-start_at_zero'],
+                       input_args=input_args, retry_on_failure=True, duration=window_end - window_start)
+        source_offset = get_media_start_time(copyts_file)
+        if source_offset is None:
+            source_offset = window_start
+        # 不带 -copyts 转封装时 ffmpeg 会减去输入的起始时间，输出文件从 0 开始
+        run_ffmpeg_mux([copyts_file], output_file, ['-map', '0', '-c', 'copy', '-movflags', '+faststart'],
+                       duration=window_end - window_start)
+    finally:
+        if os.path.exists(copyts_file):
+            os.remove(copyts_file)
+    return source_offset
+
+def get_media_start_time(file_path):
+    """使用 ffprobe 读取文件的起始时间（所有流中最早的时间戳），无法读取时返回 None"""
+    cmd = [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=start_time', '-of', 'json', file_path]
+    start_time = json.loads(run_ffprobe(cmd) or "{}").get('format', {}).get('start_time')
+    try:
+        return float(start_time)
+    except (TypeError, ValueError):
+        return None
+
+async def download_url_from_bili(url: str, out: str, info: str, clip_name=None):
+    # 使用共享的 AsyncClient 连接池进行多连接分段下载，支持断点续传
+    sess = await get_http_client()
+    stats = {}
+    start = time.monotonic()
+    try:
+        await ranged_download(sess, url, out, info, stats=stats)
+    finally:
+        if clip_name and 'ttfb' in stats:
+            record_transfer(clip_name, stats.get('transferred', 0), time.monotonic() - start, stats['ttfb'],
+                            host=get_url_host(url))
 
 # async def bilibili_download(bvid, credential, output_name, output_path, high_res=False):
 #     v = video.Video(bvid=bvid, credential=credential)
@@ -174,18 +492,23 @@ async def download_url_from_bili(url: str, out: str, info: str):
 #         os.remove("audio_temp.m4s")
 #         print(f"合并完成，存储为: {output_name}.mp4")
 
-async def bilibili_download(self, bvid, page=1, output_name=None, output_path="."):
+async def bilibili_download(bvid, credential=None, page=1, output_name=None, output_path=".", high_res=True, window=None,
+                            target=None):
     """ 哔哩哔哩视频合并
 
     Args:
         bvid(str): 视频BV号
+        credential(Credential): 登录凭证
         page(int): 分P序号（从1开始）
         output_name(str): 输出文件名（不含后缀）
         output_path(path): 输出目录
+        high_res(bool): 是否下载最高画质，否则限制为480P
+        window(tuple): 只下载该时间窗口 (开始秒数, 结束秒数)，为 None 时下载完整视频
+        target(dict): 渲染所需的最低流规格（见 stream_selection.get_stream_target），为 None 时下载最佳流
     """
     try:
-        v = video.Video(bvid=bvid, credential=self.credential)
-        page_list = sync(v.get_page_list())
+        v = video.Video(bvid=bvid, credential=credential)
+        page_list = await v.get_page_list()
         
         # 检查分P序号是否有效
         if page < 1 or page > len(page_list):
@@ -197,25 +520,68 @@ async def bilibili_download(self, bvid, page=1, output_name=None, output_path=".
         download_url_data = await v.get_download_url(target_cid)  # 关键修改：传入cid
         detecter = video.VideoDownloadURLDataDetecter(data=download_url_data)
 
-        # 后续下载逻辑（与原代码一致）
-        streams = detecter.detect_best_streams()
-        output_file = os.path.join(output_path, f"{output_name or page_list[page - 1]['part']}.mp4")
-        
-        if detecter.check_flv_stream():
-            await download_url_from_bili(streams[0].url, "flv_temp.flv", "FLV音视频")
-            os.system(f'{FFMPEG_PATH} -y -i flv_temp.flv {output_file} {REDIRECT}')
-            os.remove("flv_temp.flv")
-            print(f"下载完成，存储为: {output_name}.mp4")
+        # 选择媒体流: 返回列表中0是视频流，1是音频流
+        if high_res:
+            # 选择满足渲染分辨率的最小流，而不是总是下载最高画质
+            streams, selection = select_bilibili_streams(detecter, target)
         else:
-            await download_url_from_bili(streams[0].url, "video_temp.m4s", "视频流")
-            await download_url_from_bili(streams[1].url, "audio_temp.m4s", "音频流")
-            print(f"下载完成，正在合并音视频轨道。")
-            os.system(f'{FFMPEG_PATH} -y -i video_temp.m4s -i audio_temp.m4s -vcodec copy -acodec copy {output_file} {REDIRECT}')
-            os.remove("video_temp.m4s")
-            os.remove("audio_temp.m4s")
-            print(f"合并完成（已删除临时文件）：{output_file}")
+            streams = detecter.detect_best_streams(video_max_quality=video.VideoQuality._480P,
+                                                   codecs=BILIBILI_CODEC_PREFERENCE,
+                                                   no_dolby_video=True, no_dolby_audio=True, no_hdr=True)
+            selection = describe_bilibili_stream(streams[0])
+        output_name = output_name or page_list[page - 1]['part']
+        output_file = os.path.join(output_path, f"{output_name}.mp4")
+        if 'height' in selection:
+            print(f"已选择视频流: {selection['quality']}（{selection['height']}p{selection['fps']}, {selection['codec']}）")
+
+        if window:
+            source_duration = page_list[page - 1].get('duration')
+            if source_duration:
+                window = (min(window[0], max(0, source_duration - 1)), min(window[1], source_duration))
+            urls = [streams[0].url] if detecter.check_flv_stream() else [streams[0].url, streams[1].url]
+            print(f"正在下载片段窗口 {window[0]}s - {window[1]}s")
+            with create_job_workspace(output_path, output_name) as workspace:
+                temp_output = os.path.join(workspace, "output.mp4")
+                with measure_transfer(output_name, temp_output, host=get_url_host(urls[0])):
+                    source_offset = await asyncio.to_thread(download_window_ffmpeg, urls, temp_output, window, HEADERS)
+                await asyncio.to_thread(move_into_place, temp_output, output_file)
+            save_window_info(output_file, source_offset, window[1], source_duration)
+            await asyncio.to_thread(record_download, output_path, output_name, platform="bilibili", high_res=high_res,
+                                    **selection)
+            print(f"下载完成，存储为: {output_name}.mp4")
+            return True
+        
+        # 每个下载任务使用独立的临时目录，失败时保留断点文件，下次下载时续传
+        with create_job_workspace(output_path, output_name, resumable=True) as workspace:
+            temp_output = os.path.join(workspace, "output.mp4")
+            if detecter.check_flv_stream():
+                flv_temp = os.path.join(workspace, "flv_temp.flv")
+                await download_url_from_bili(streams[0].url, flv_temp, "FLV音视频", clip_name=output_name)
+                with measure_merge(output_name):
+                    selection['codec'] = await asyncio.to_thread(remux_flv_to_mp4, flv_temp, temp_output,
+                                                                 page_list[page - 1].get('duration'))
+                await asyncio.to_thread(move_into_place, temp_output, output_file)
+                print(f"下载完成，存储为: {output_name}.mp4")
+            else:
+                video_temp = os.path.join(workspace, "video_temp.m4s")
+                audio_temp = os.path.join(workspace, "audio_temp.m4s")
+                await download_url_from_bili(streams[0].url, video_temp, "视频流", clip_name=output_name)
+                await download_url_from_bili(streams[1].url, audio_temp, "音频流", clip_name=output_name)
+                print(f"下载完成，正在合并音视频轨道。")
+                with measure_merge(output_name):
+                    await asyncio.to_thread(run_ffmpeg_mux, [video_temp, audio_temp], temp_output,
+                                            ['-vcodec', 'copy', '-acodec', 'copy'],
+                                            duration=page_list[page - 1].get('duration'))
+                await asyncio.to_thread(move_into_place, temp_output, output_file)
+                print(f"合并完成（已删除临时文件）：{output_file}")
+        remove_window_info(output_file)
+        await asyncio.to_thread(record_download, output_path, output_name, platform="bilibili", high_res=high_res,
+                                **selection)
+        return True
 
     except Exception as e:
+        if is_risk_control_error(e):
+            raise RiskControlError(f"下载触发风控: {e}") from e
         print(f"下载失败: {e}")
         return False
 
@@ -225,7 +591,7 @@ class Downloader(ABC):
         pass
 
     @abstractmethod
-    def download_video(self, video_id, output_name, output_path, high_res=False):
+    def download_video(self, video_id, output_name, output_path, high_res=False, window=None, target=None):
         pass
 
 # def parse_video_id(input_str):
@@ -309,7 +675,7 @@ def get_youtube_video_info(video_id: str) -> dict:
 class PurePytubefixDownloader(Downloader):
     """使用pytubefix进行搜索和下载的youtube视频下载器"""
     def __init__(self, proxy=None, use_oauth=False, use_potoken=False, auto_get_potoken=False, 
-                 search_max_results=3):
+                 search_max_results=3, po_token_ttl=PO_TOKEN_CACHE_TTL):
         self.proxy = proxy
         # use_oauth 和 use_potoken 互斥，优先使用use_potoken
         self.use_potoken = use_potoken
@@ -317,10 +683,7 @@ class PurePytubefixDownloader(Downloader):
             self.use_oauth = False
         else:
             self.use_oauth = use_oauth
-        if auto_get_potoken:
-            self.po_token_verifier = autogen_po_token_verifier
-        else:
-            self.po_token_verifier = custom_po_token_verifier
+        self.po_token_verifier = get_po_token_provider(auto_get_potoken, po_token_ttl)
 
         self.search_max_results = search_max_results
     
@@ -351,7 +714,7 @@ class PurePytubefixDownloader(Downloader):
             videos = videos[:self.search_max_results]
         return videos
     
-    def download_video(self, video_id, output_name, output_path, high_res=False):
+    def download_video(self, video_id, output_name, output_path, high_res=False, window=None, target=None):
         try:
             if not os.path.exists(output_path):
                 os.makedirs(output_path)
@@ -371,33 +734,58 @@ class PurePytubefixDownloader(Downloader):
                          po_token_verifier=self.po_token_verifier)
             
             print(f"正在下载: {yt.title}")
+            output_file = os.path.join(output_path, f"{output_name}.mp4")
             if high_res:
-                # 分别下载视频和音频
-                video = yt.streams.filter(adaptive=True, file_extension='mp4').\
-                    order_by('resolution').desc().first()
-                audio = yt.streams.filter(only_audio=True).first()
-                down_video = video.download(output_path, filename="video_temp")
-                down_audio = audio.download(output_path, filename="audio_temp")
-                print(f"下载完成，正在合并视频和音频")
-                output_file = os.path.join(output_path, f"{output_name}.mp4")
-                os.system(f'{FFMPEG_PATH} -y -i {down_video} -i {down_audio} -vcodec copy -acodec copy {output_file} {REDIRECT}')
-                # 删除临时文件
-                os.remove(f"{down_video}")
-                os.remove(f"{down_audio}")
-                print(f"合并完成，存储为: {output_name}.mp4")
+                # 选择满足渲染分辨率的最小流，而不是总是下载最高画质
+                (video, audio), selection = select_youtube_streams(yt, target)
+                if selection:
+                    print(f"已选择视频流: {selection['quality']}（{selection['height']}p{selection['fps']}, {selection['codec']}）")
             else:
-                downloaded_file = yt.streams.filter(progressive=True, file_extension='mp4').\
-                    order_by('resolution').desc().first().download(output_path)
-                # 重命名下载到的视频文件
-                new_filename = f"{output_name}.mp4"
-                output_file = os.path.join(output_path, new_filename)
-  
-                # 检查文件是否存在，如果存在则删除
-                if os.path.exists(output_file):
-                    os.remove(output_file)  # 删除已存在的文件
-                
-                os.rename(downloaded_file, output_file)
-                print(f"下载完成，存储为: {new_filename}")
+                video = yt.streams.filter(progressive=True, file_extension='mp4').\
+                    order_by('resolution').desc().first()
+                audio = None
+                selection = {'codec': normalize_codec(video.video_codec)} if video else {}
+            # 每个下载任务使用独立的临时目录，任务结束（包括失败）后自动清理
+            with create_job_workspace(output_path, output_name) as workspace:
+                temp_output = os.path.join(workspace, "output.mp4")
+                if window:
+                    window = (min(window[0], max(0, yt.length - 1)), min(window[1], yt.length))
+                    print(f"正在下载片段窗口 {window[0]}s - {window[1]}s")
+                    urls = [video.url, audio.url] if audio else [video.url]
+                    with measure_transfer(output_name, temp_output, host=get_url_host(urls[0])):
+                        source_offset = download_window_ffmpeg(urls, temp_output, window)
+                    move_into_place(temp_output, output_file)
+                    save_window_info(output_file, source_offset, window[1], yt.length)
+                    record_download(output_path, output_name, platform="youtube", high_res=high_res, **selection)
+                    print(f"下载完成，存储为: {output_name}.mp4")
+                    return output_file
+
+                if high_res:
+                    # 分别下载视频和音频
+                    transfer_start = time.monotonic()
+                    down_video = video.download(workspace, filename="video_temp")
+                    record_transfer(output_name, os.path.getsize(down_video), time.monotonic() - transfer_start,
+                                    host=get_url_host(video.url))
+                    transfer_start = time.monotonic()
+                    down_audio = audio.download(workspace, filename="audio_temp")
+                    record_transfer(output_name, os.path.getsize(down_audio), time.monotonic() - transfer_start,
+                                    host=get_url_host(audio.url))
+                    print(f"下载完成，正在合并视频和音频")
+                    with measure_merge(output_name):
+                        run_ffmpeg_mux([down_video, down_audio], temp_output, ['-vcodec', 'copy', '-acodec', 'copy'],
+                                       duration=yt.length)
+                    move_into_place(temp_output, output_file)
+                    print(f"合并完成，存储为: {output_name}.mp4")
+                else:
+                    transfer_start = time.monotonic()
+                    downloaded_file = video.download(workspace)
+                    record_transfer(output_name, os.path.getsize(downloaded_file), time.monotonic() - transfer_start,
+                                    host=get_url_host(video.url))
+                    # 重命名下载到的视频文件（覆盖已存在的文件）
+                    move_into_place(downloaded_file, output_file)
+                    print(f"下载完成，存储为: {output_name}.mp4")
+            remove_window_info(output_file)
+            record_download(output_path, output_name, platform="youtube", high_res=high_res, **selection)
 
             return output_file
             
@@ -410,6 +798,7 @@ class BilibiliDownloader(Downloader):
     def __init__(self, proxy=None, no_credential=False, credential_path="../cred_datas/bilibili_cred.pkl", search_max_results=3):
         self.proxy = proxy
         self.search_max_results = search_max_results
+        self.credential_path = credential_path
         
         if no_credential:
             self.credential = None
@@ -428,7 +817,12 @@ class BilibiliDownloader(Downloader):
     def get_credential_username(self):
         if not self.credential:
             return None
-        return sync(user.get_self_info(self.credential))['name']
+        status = load_credential_status(self.credential_path)
+        if status and status['valid'] and status.get('username'):
+            return status['username']
+        username = bili_sync(user.get_self_info(self.credential))['name']
+        save_credential_status(self.credential_path, True, username)
+        return username
 
     def log_in(self, credential_path):
         # credential = login.login_with_qrcode_term() # 在终端打印二维码登录
@@ -439,28 +833,43 @@ class BilibiliDownloader(Downloader):
         except:
             print("#####【登录失败，请重试】")
             return False
-        print(f"#####【bilibili】登录成功：{sync(user.get_self_info(credential))['name']}】")
+        username = bili_sync(user.get_self_info(credential))['name']
+        print(f"#####【bilibili】登录成功：{username}】")
         self.credential = credential
-        # 缓存凭证
+        # 缓存凭证及其校验结果
         with open(credential_path, 'wb') as f:
             pickle.dump(credential, f)
+        save_credential_status(credential_path, True, username)
         return True
     
     def search_video(self, keyword): 
             # 并发搜索50个视频可能被风控，使用同步方法逐个搜索
-            results = sync(
-                search.search_by_type(keyword=keyword, 
-                                    search_type=search.SearchObjectType.VIDEO,
-                                    order_type=search.OrderVideo.TOTALRANK,
-                                    order_sort=0,  # 由高到低
-                                    page=1,
-                                    page_size=self.search_max_results)
-            )
+            breaker = get_circuit_breaker("bilibili.search")
+            breaker.wait_if_open()
+            try:
+                results = bili_sync(
+                    search.search_by_type(keyword=keyword, 
+                                        search_type=search.SearchObjectType.VIDEO,
+                                        order_type=search.OrderVideo.TOTALRANK,
+                                        order_sort=0,  # 由高到低
+                                        page=1,
+                                        page_size=self.search_max_results)
+                )
+            except Exception as e:
+                if is_risk_control_error(e):
+                    delay = breaker.record_failure()
+                    raise RiskControlError(f"搜索触发风控，将暂停 {delay} 秒: {e}") from e
+                raise
             videos = []
             if 'result' not in results:
+                if is_risk_control_response(results):
+                    delay = breaker.record_failure()
+                    raise RiskControlError(f"搜索触发风控，将暂停 {delay} 秒")
+                breaker.record_success()
                 print(f"搜索结果异常，请检查如下输出：")
                 print(results)
                 return []
+            breaker.record_success()
             res_list = results['result']
             for each in res_list:
                 videos.append({
@@ -473,17 +882,32 @@ class BilibiliDownloader(Downloader):
                 })
             return videos
 
-    def download_video(self, video_id, output_name, output_path, high_res=False):
+    def download_video(self, video_id, output_name, output_path, high_res=False, window=None, target=None):
         if not self.credential:
             print(f"Warning: 未成功配置bilibili登录凭证，下载视频可能失败！")
-        # 使用异步方法下载
-        result = asyncio.run(
-            bilibili_download(bvid=video_id, 
-                              credential=self.credential, 
-                              output_name=output_name, 
-                              output_path=output_path,
-                              high_res=high_res)
-        )
+        video_id, page = parse_video_id(video_id)
+        breaker = get_circuit_breaker("bilibili.download")
+        breaker.wait_if_open()
+        # 在共享的后台事件循环中执行异步下载
+        try:
+            result = bili_sync(
+                bilibili_download(bvid=video_id, 
+                                  credential=self.credential, 
+                                  page=page,
+                                  output_name=output_name, 
+                                  output_path=output_path,
+                                  high_res=high_res,
+                                  window=window,
+                                  target=target)
+            )
+        except RiskControlError:
+            breaker.record_failure()
+            raise
+        if not result:
+            # 其他原因的失败不能说明风控已解除，不重置退避时间
+            return None
+        breaker.record_success()
+        return os.path.join(output_path, f"{output_name}.mp4")
 
 
 # test
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.bili_client import bili_sync
+from utils.video_crawler import get_bilibili_video_info, get_youtube_video_info
+from utils.circuit_breaker import RiskControlError, get_circuit_breaker, is_risk_control_error
+
+VIDEO_INFO_CACHE_FILE = "./videos/video_info_cache.json"
+VIDEO_INFO_CACHE_TTL = 7 * 24 * 60 * 60  # 视频元数据缓存有效期（秒）
+BILIBILI_MAX_CONCURRENCY = 4  # 批量查询B站元数据时的最大并发数，过高容易触发风控
+YOUTUBE_MAX_WORKERS = 4
+
+
+class VideoInfoResolver:
+    """
+    带缓存的视频元数据解析器。
+
+    以 (平台, 视频ID, 分P) 为键缓存标题、时长与地址，支持批量查询，
+    同一批次中的B站请求在共享事件循环中并发执行，YouTube 请求使用线程池并发执行。
+    """
+    def __init__(self, cache_file=VIDEO_INFO_CACHE_FILE, ttl=VIDEO_INFO_CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()
+
+    @staticmethod
+    def make_key(platform, video_id, page=1):
+        return f"{platform}:{video_id}:{page}"
+
+    def _load_cache(self):
+        if not os.path.isfile(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(f"视频元数据缓存损坏，已忽略: {self.cache_file}")
+            return {}
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f, ensure_ascii=False, indent=4)
+        os.replace(temp_file, self.cache_file)
+
+    def get_cached(self, platform, video_id, page=1):
+        """只查询缓存，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._cache.get(self.make_key(platform, video_id, page))
+        if not entry or time.time() - entry['cached_at'] > self.ttl:
+            return None
+        return entry['info']
+
+    def put(self, platform, video_id, page, info):
+        with self._lock:
+            self._cache[self.make_key(platform, video_id, page)] = {
+                'info': info,
+                'cached_at': time.time()
+            }
+
+    def resolve(self, platform, video_id, page=1):
+        """查询单个视频的元数据，失败时抛出异常"""
+        results = self.resolve_many([(platform, video_id, page)], raise_errors=True)
+        return results[self.make_key(platform, video_id, page)]
+
+    def resolve_many(self, requests, raise_errors=False):
+        """
+        批量查询视频元数据
+
+        Args:
+            requests(list): (平台, 视频ID, 分P) 元组列表
+            raise_errors(bool): 是否在查询失败时抛出异常，否则忽略失败项
+
+        Returns:
+            dict: 键为 make_key(平台, 视频ID, 分P)，值为视频元数据字典
+        """
+        results = {}
+        bilibili_missing = []
+        youtube_missing = []
+        for platform, video_id, page in dict.fromkeys(requests):
+            info = self.get_cached(platform, video_id, page)
+            if info is not None:
+                results[self.make_key(platform, video_id, page)] = info
+            elif platform == "bilibili":
+                bilibili_missing.append((video_id, page))
+            elif platform == "youtube":
+                youtube_missing.append((video_id, page))
+            else:
+                raise ValueError(f"不支持的平台: {platform}")
+
+        errors = []
+        if bilibili_missing:
+            fetched = bili_sync(self._fetch_bilibili_batch(bilibili_missing))
+            for (video_id, page), info in zip(bilibili_missing, fetched):
+                if isinstance(info, Exception):
+                    errors.append(info)
+                    continue
+                self.put("bilibili", video_id, page, info)
+                results[self.make_key("bilibili", video_id, page)] = info
+
+        if youtube_missing:
+            with ThreadPoolExecutor(max_workers=YOUTUBE_MAX_WORKERS) as executor:
+                futures = {
+                    key: executor.submit(get_youtube_video_info, key[0])
+                    for key in youtube_missing
+                }
+            for (video_id, page), future in futures.items():
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                info = future.result()
+                self.put("youtube", video_id, page, info)
+                results[self.make_key("youtube", video_id, page)] = info
+
+        if bilibili_missing or youtube_missing:
+            with self._lock:
+                self._save_cache()
+
+        if errors and raise_errors:
+            raise errors[0]
+        return results
+
+    async def _fetch_bilibili_batch(self, keys):
+        """
+        并发查询B站元数据，与搜索、下载一样经过熔断器：
+        熔断期间不再发出请求，剩余的查询直接以 RiskControlError 返回
+        """
+        semaphore = asyncio.Semaphore(BILIBILI_MAX_CONCURRENCY)
+        breaker = get_circuit_breaker("bilibili.info")
+
+        async def fetch_one(video_id, page):
+            async with semaphore:
+                if breaker.state == breaker.OPEN:
+                    raise RiskControlError(f"B站接口处于风控暂停中，跳过查询 {video_id}")
+                try:
+                    info = await get_bilibili_video_info(video_id, page)
+                except Exception as e:
+                    if is_risk_control_error(e):
+                        delay = breaker.record_failure()
+                        raise RiskControlError(f"查询视频信息触发风控，将暂停 {delay} 秒: {e}") from e
+                    raise
+                breaker.record_success()
+                return info
+
+        return await asyncio.gather(*[fetch_one(video_id, page) for video_id, page in keys],
+                                    return_exceptions=True)
+
+    def seed_candidates(self, b30_config, platform):
+        """
+        将存档中已有的备选视频元数据写入缓存，不发出任何请求
+
+        YouTube 搜索结果中已包含完整的元数据；B站搜索结果与视频信息接口的格式不同，
+        只在用户实际选择或手动输入时才通过 resolve 查询。
+        """
+        if platform != "youtube":
+            return
+        for song in b30_config:
+            for video_info in song.get('video_info_list', []):
+                video_id = video_info.get('pure_id', video_info['id'])
+                if self.get_cached(platform, video_id) is None:
+                    self.put(platform, video_id, 1, {
+                        "id": video_id,
+                        "url": video_info['url'],
+                        "title": video_info['title'],
+                        "duration": video_info['duration']
+                    })
+        with self._lock:
+            self._save_cache()
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_video_info_resolver() -> VideoInfoResolver:
+    """获取进程内共享的元数据解析器，使不同用户会话共用同一份缓存"""
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = VideoInfoResolver()
+        return _resolver